@@ -1,9 +1,11 @@
 import os
+import mmap
 import struct
 
 from cStringIO import StringIO
 
 import vstruct
+import vstruct.view as vs_view
 import vstruct.defs.pe as vs_pe
 
 import ordlookup
@@ -129,6 +131,9 @@ UNW_FLAG_EHANDLER   = 0x1
 UNW_FLAG_UHANDLER   = 0x2
 UNW_FLAG_CHAININFO  = 0x4
 
+# A RUNTIME_FUNCTION ( BeginAddress, EndAddress, UnwindInfoAddress )
+rtfunc = struct.Struct('<III')
+
 # Resource Types
 RT_CURSOR           = 1
 RT_BITMAP           = 2
@@ -354,16 +359,23 @@ class PE(object):
         """
         Construct a PE object.  use inmem=True if you are
         using a MemObjFile or other "memory like" image.
+
+        The fd may also be an mmap.mmap object (see peFromFileName), in
+        which case all reads are simple slices of the mapping.
         """
         object.__init__(self)
         self.inmem = inmem
         self.filesize = None
+        self.fdmap = None
 
         if not inmem:
             fd.seek(0, os.SEEK_END)
             self.filesize = fd.tell()
             fd.seek(0)
 
+            if isinstance(fd, mmap.mmap):
+                self.fdmap = fd
+
         self.fd = fd
 
         self.pe32p = False
@@ -387,18 +399,44 @@ class PE(object):
 
         self.IMAGE_NT_HEADERS = nt
 
-    def getPdataEntries(self):
+    def _getPdataBytes(self):
         sec = self.getSectionByName('.pdata')
         if sec == None:
+            return None
+        return self.readAtRva(sec.VirtualAddress, sec.VirtualSize)
+
+    def getRuntimeFunctions(self):
+        '''
+        Return a list of (BeginAddress, EndAddress, UnwindInfoAddress)
+        tuples for the RUNTIME_FUNCTION entries in the .pdata section
+        ( without building a structure for each ).
+        '''
+        rbytes = self._getPdataBytes()
+        if not rbytes:
+            return []
+
+        endoff = len(rbytes) - (len(rbytes) % rtfunc.size)
+        return [ rtfunc.unpack_from(rbytes, off) for off in xrange(0, endoff, rtfunc.size) ]
+
+    def getPdataEntries(self, lazy=False):
+        '''
+        Return the IMAGE_RUNTIME_FUNCTION_ENTRY structures from the .pdata
+        section.  Use lazy=True to get vstruct.view objects which only
+        decode the fields you access ( see also getRuntimeFunctions() ).
+        '''
+        rbytes = self._getPdataBytes()
+        if not rbytes:
             return ()
-        ret = []
-        rbytes = self.readAtRva(sec.VirtualAddress, sec.VirtualSize)
-        while len(rbytes):
-            f = vs_pe.IMAGE_RUNTIME_FUNCTION_ENTRY()
-            f.vsParse(rbytes)
-            rbytes = rbytes[len(f):]
-            ret.append(f)
-        return ret
+
+        fclass = vs_pe.IMAGE_RUNTIME_FUNCTION_ENTRY
+        count = len(rbytes) / rtfunc.size
+
+        if lazy:
+            return [ vs_view.getStructView(fclass, rbytes, off) for off in xrange(0, count * rtfunc.size, rtfunc.size) ]
+
+        entries = vstruct.VArray()
+        entries.vsParseElements(fclass, count, rbytes)
+        return [ entries[i] for i in xrange(count) ]
 
     def getDllName(self):
         '''
@@ -463,7 +501,21 @@ class PE(object):
                 return s
         return None
 
-    def readStructAtRva(self, rva, structname, check=False):
+    def readStructAtRva(self, rva, structname, check=False, lazy=False):
+        '''
+        Read the named structure at the given rva.  Use lazy=True to get
+        a vstruct.view which only decodes the fields you access.
+        '''
+        if lazy:
+            cls = vstruct.getStructureClass(structname)
+            slen = vs_view.getViewLayout(cls).size
+            if check and not self.checkRva(rva, size=slen):
+                return None
+            bytes = self.readAtRva(rva, slen)
+            if not bytes:
+                return None
+            return vs_view.getStructView(cls, bytes)
+
         s = vstruct.getStructure(structname)
         slen = len(s)
         if check and not self.checkRva(rva, size=slen):
@@ -634,11 +686,13 @@ class PE(object):
         secsize = len(vstruct.getStructure("pe.IMAGE_SECTION_HEADER"))
 
         sbytes = self.readAtOffset(off, secsize * self.IMAGE_NT_HEADERS.FileHeader.NumberOfSections)
-        while sbytes:
+        if sbytes == None:
+            return
+
+        for soff in xrange(0, len(sbytes), secsize):
             s = vstruct.getStructure("pe.IMAGE_SECTION_HEADER")
-            s.vsParse(sbytes[:secsize])
+            s.vsParse(sbytes, offset=soff)
             self.sections.append(s)
-            sbytes = sbytes[secsize:]
 
     def readRvaFormat(self, fmt, rva):
         size = struct.calcsize(fmt)
@@ -650,16 +704,29 @@ class PE(object):
         return self.readAtOffset(offset, size, shortok)
 
     def readAtOffset(self, offset, size, shortok=False):
-        ret = ""
-        self.fd.seek(offset)
-        while len(ret) != size:
-            rlen = size - len(ret)
-            x = self.fd.read(rlen)
-            if x == "":
-                if not shortok:
-                    return None
-                return ret
-            ret += x
+        if self.fdmap != None:
+            ret = self.fdmap[offset:offset+size]
+
+        else:
+            self.fd.seek(offset)
+            ret = self.fd.read(size)
+
+            # Only loop (and join) on short reads
+            if len(ret) != size:
+                chunks = [ ret ]
+                rlen = size - len(ret)
+                while rlen:
+                    x = self.fd.read(rlen)
+                    if not x:
+                        break
+                    chunks.append(x)
+                    rlen -= len(x)
+
+                ret = ''.join(chunks)
+
+        if len(ret) != size and not shortok:
+            return None
+
         return ret
 
     def parseLoadConfig(self):
@@ -804,26 +871,26 @@ class PE(object):
         
         reloff = self.rvaToOffset(rva)
         relbytes = self.readAtOffset(reloff, rsize)
-        
+        if not relbytes:
+            return
 
-        while relbytes:
-            pageva, chunksize = struct.unpack("<LL", relbytes[:8])
+        # Walk the blocks by offset ( no re-slicing of the buffer )
+        off = 0
+        relsize = len(relbytes)
+        while off < relsize:
+            pageva, chunksize = struct.unpack_from("<LL", relbytes, off)
             relcnt = (chunksize - 8) / 2
-            
+
             # RP BUG FIX - when the reloc section has no fixups but the directory exists..
             if not chunksize or not pageva:
                 return
             # RP BUG FIX - sometimes the chunksize is invalid we do a quick check to make sure we dont overrun the buffer
-            if chunksize > len(relbytes):
+            if chunksize > relsize - off:
                 return
-            
-            
-            rels = struct.unpack("<%dH" % relcnt, relbytes[8:chunksize])
-            for r in rels:
-                rtype = r >> 12
-                roff  = r & 0xfff
-                self.relocations.append((pageva+roff, rtype))
-            relbytes = relbytes[chunksize:]
+
+            rels = struct.unpack_from("<%dH" % relcnt, relbytes, off + 8)
+            self.relocations.extend([ (pageva + (r & 0xfff), r >> 12) for r in rels ])
+            off += chunksize
 
     def getExportName(self):
         '''
@@ -1083,12 +1150,18 @@ def peFromMemoryObject(memobj, baseaddr):
     fd = MemObjFile(memobj, baseaddr)
     return PE(fd, inmem=True)
 
-def peFromFileName(fname):
+def peFromFileName(fname, mapped=False):
     """
     Utility helper that assures that the file is opened in 
     binary mode which is required for proper functioning.
+
+    Use mapped=True to parse from a (read only) mmap of the file.
     """
     f = file(fname, "rb")
+    if mapped and os.path.getsize(fname):
+        fmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        return PE(fmap)
     return PE(f)
 
 def peFromBytes(fbytes):
@@ -1,51 +1,110 @@
 '''
+Carve (optionally single byte xor encoded) PE files out of a larger blob
+of bytes ( a memory dump, disk image, etc ).
+
+The input may be a str or an mmap (see carveFile) and is scanned in a
+single pass, one chunk at a time.
 '''
 import sys
+import mmap
 import struct
+import binascii
 
 from cStringIO import StringIO
 from itertools import izip, cycle
 
 import PE
- 
+
+# Translation tables for decoding with a single byte xor key
+xor_tables = [ ''.join([ chr(c ^ i) for c in xrange(256) ]) for i in xrange(256) ]
+
 def xorbytes(data, key):
+    if len(key) == 1:
+        return data.translate(xor_tables[ord(key)])
     return ''.join(chr(ord(x) ^ ord(y)) for (x,y) in izip(data, cycle(key)))
 
 def xorstatic(data, i):
-    return ''.join( chr( ord(c) ^ i ) for c in data )
+    return data.translate(xor_tables[i])
 
 mz_xor = [ (xorstatic('MZ', i), xorstatic('PE', i), i) for i in xrange(256) ]
 
-def carve(pbytes, offset=0):
+# The xor of "M" and "Z" is the same for any key ( as hex )
+mz_hexdiff = '%.2x' % (ord('M') ^ ord('Z'))
+
+def _iterMzCandidates(pbytes, start, end):
+    '''
+    Yield the offsets in [start, end) of every two byte sequence which
+    could be "MZ" xor'd with a single byte key.
+
+    The xor of each byte with the next one is computed for the whole chunk
+    at once ( as one long integer operation ) and then searched for the
+    xor of "M" and "Z".
+    '''
+    chunk = pbytes[start:end+1]
+    if len(chunk) < 2:
+        return
+
+    hexbytes = binascii.hexlify(chunk)
+    val = long(hexbytes, 16)
+    diff = '%.*x' % (len(hexbytes), val ^ (val >> 8))
+
+    # Byte 0 of the diff is not a pair ( skip it )
+    hoff = diff.find(mz_hexdiff, 2)
+    while hoff != -1:
+        if not hoff & 1:
+            yield start + (hoff >> 1) - 1
+        hoff = diff.find(mz_hexdiff, hoff + 1)
+
+def carveChunks(pbytes, offset=0, chunksize=0x100000):
     '''
-    Return a list of (offset, size, xor) tuples of embedded PEs
+    Yield a list of (offset, xor) tuples of the embedded PEs found in each
+    chunk of the input ( so input of any size may be carved ).
     '''
     pblen = len(pbytes)
-    todo = [ (pbytes.find(mzx, offset), mzx, pex, i) for mzx,pex,i in mz_xor ]
-    todo = [ (off, mzx, pex, i) for (off,mzx,pex,i) in todo if off != -1 ]
+    for start in xrange(offset, pblen, chunksize):
+        end = min(start + chunksize, pblen)
 
-    while len(todo):
+        ret = []
+        for off in _iterMzCandidates(pbytes, start, end):
+            i = ord(pbytes[off]) ^ 0x4d
 
-        off, mzx, pex, i = todo.pop()
+            # The MZ header has one field we will check
+            # e_lfanew is at 0x3c
+            e_lfanew = off + 0x3c
+            if pblen < (e_lfanew + 4):
+                break
 
-        # The MZ header has one field we will check
-        # e_lfanew is at 0x3c
-        e_lfanew = off + 0x3c
-        if pblen < (e_lfanew + 4):
-            continue
+            newoff = struct.unpack('<I', xorstatic( pbytes[e_lfanew : e_lfanew + 4], i))[0]
 
-        newoff = struct.unpack('<I', xorstatic( pbytes[e_lfanew : e_lfanew + 4], i))[0]
+            peoff = off + newoff
+            if pblen < (peoff + 2):
+                continue
 
-        peoff = off + newoff
-        if pblen < (peoff + 2):
-            continue
+            if pbytes[ peoff : peoff + 2 ] == mz_xor[i][1]:
+                ret.append( (off, i) )
 
-        if pbytes[ peoff : peoff + 2 ] == pex:
+        yield ret
+
+def carve(pbytes, offset=0):
+    '''
+    Yield (offset, xor) tuples of embedded PEs ( in offset order )
+    '''
+    for ret in carveChunks(pbytes, offset=offset):
+        for off, i in ret:
             yield (off, i)
 
-        nextres = pbytes.find(mzx, off+1)
-        if nextres != -1:
-            todo.append( (nextres, mzx, pex, i) )
+def carveFile(fname, chunksize=0x100000):
+    '''
+    Carve the given file using a read only mmap.  Yields the same lists
+    as carveChunks().
+    '''
+    with file(fname, 'rb') as fd:
+        fmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for ret in carveChunks(fmap, chunksize=chunksize):
+                yield ret
+        finally:
+            fmap.close()
 
 class CarvedPE(PE.PE):
 
@@ -55,7 +114,7 @@ class CarvedPE(PE.PE):
         self.xorkey = xkey
         PE.PE.__init__(self, StringIO())
 
-    def readAtOffset(self, offset, size):
+    def readAtOffset(self, offset, size, shortok=False):
         offset += self.carved_offset
         return xorbytes(self.fbytes[offset:offset+size], self.xorkey)
 
@@ -67,9 +126,9 @@ class CarvedPE(PE.PE):
 
 if __name__ == '__main__':
 
-    fbytes = file(sys.argv[1], 'rb').read()
+    fd = file(sys.argv[1], 'rb')
+    fbytes = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
     for offset, i in  carve(fbytes):
         print 'OFFSET: %d (xor: %d)' % (offset, i)
         p = CarvedPE(fbytes, offset, chr(i))
         print 'SIZE',p.getFileSize()
-
@@ -0,0 +1,102 @@
+import os
+import time
+import random
+import struct
+import tempfile
+import unittest
+
+import PE.carve as pe_carve
+
+from PE.tests.test_tables import buildPe64
+
+def legacyCarve(pbytes, offset=0):
+    # One find() stream per xor key
+    ret = []
+    pblen = len(pbytes)
+    for mzx, pex, i in pe_carve.mz_xor:
+        off = pbytes.find(mzx, offset)
+        while off != -1:
+            e_lfanew = off + 0x3c
+            if pblen >= e_lfanew + 4:
+                newoff = struct.unpack('<I', pe_carve.xorstatic(pbytes[e_lfanew:e_lfanew + 4], i))[0]
+                peoff = off + newoff
+                if pblen >= peoff + 2 and pbytes[peoff:peoff + 2] == pex:
+                    ret.append((off, i))
+            off = pbytes.find(mzx, off + 1)
+    ret.sort()
+    return ret
+
+def buildBlob(size, keys):
+    rand = random.Random(0x5a4d)
+    pe = buildPe64(10, 1)
+
+    parts = []
+    offsets = []
+    step = size / (len(keys) + 1)
+    for i, key in enumerate(keys):
+        filler = ''.join([ chr(rand.randint(0, 255)) for j in xrange(step - len(pe)) ])
+        parts.append(filler)
+        offsets.append( (sum([ len(p) for p in parts ]), key) )
+        parts.append(pe_carve.xorstatic(pe, key))
+
+    return ''.join(parts), offsets
+
+class PECarveTest(unittest.TestCase):
+
+    def test_pe_carve_xor(self):
+        keys = [ 0, 1, 0x4d, 0x5a, 0xff ]
+        blob, offsets = buildBlob(0x40000, keys)
+
+        carved = list(pe_carve.carve(blob))
+        for off, key in offsets:
+            self.assertTrue( (off, key) in carved )
+
+        self.assertEqual( carved, legacyCarve(blob) )
+        self.assertEqual( list(pe_carve.carve(blob, offsets[1][0])), legacyCarve(blob, offsets[1][0]) )
+
+        off, key = offsets[3]
+        pe = pe_carve.CarvedPE(blob, off, chr(key))
+        self.assertEqual( pe.getSectionByName('.pdata').VirtualSize, 120 )
+        self.assertEqual( pe.getFileSize(), len(buildPe64(10, 1)) )
+
+    def test_pe_carve_chunks(self):
+        blob, offsets = buildBlob(0x20000, [ 0x41, 0x42, 0x43 ])
+
+        # Chunk boundaries may split an MZ header
+        mzoff = offsets[1][0]
+        chunks = list(pe_carve.carveChunks(blob, chunksize=mzoff + 1))
+        self.assertEqual( len(chunks[0]), 2 )
+        self.assertEqual( sum(chunks, []), legacyCarve(blob) )
+
+        fd, fpath = tempfile.mkstemp()
+        try:
+            os.write(fd, blob)
+            os.close(fd)
+            self.assertEqual( sum(pe_carve.carveFile(fpath, chunksize=0x1000), []), offsets )
+        finally:
+            os.unlink(fpath)
+
+    def test_pe_carve_random(self):
+        # No false positives / negatives on random bytes
+        blob = random.Random(0x4d5a).getrandbits(0x40000 * 8)
+        blob = ('%.*x' % (0x40000 * 2, blob)).decode('hex')
+        self.assertEqual( list(pe_carve.carve(blob)), legacyCarve(blob) )
+
+    def test_pe_carve_xorbytes(self):
+        self.assertEqual( pe_carve.xorbytes('MZ', '\x01'), 'L[' )
+        self.assertEqual( pe_carve.xorbytes('MZMZ', '\x00\x01'), 'M[M[' )
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_pe_carve_bench(self):
+        blob = os.urandom(0x100000)
+
+        start = time.time()
+        legacy = legacyCarve(blob)
+        legacytime = time.time() - start
+
+        start = time.time()
+        carved = list(pe_carve.carve(blob))
+        carvetime = time.time() - start
+
+        self.assertEqual( carved, legacy )
+        print('carve 1MB: legacy %.3fs single pass %.3fs' % (legacytime, carvetime))
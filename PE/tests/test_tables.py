@@ -0,0 +1,165 @@
+import os
+import time
+import struct
+import tempfile
+import unittest
+
+import PE
+import vstruct
+import vstruct.defs.pe as vs_pe
+
+def buildPe64(funccount, pagecount):
+    '''
+    Build a minimal PE32+ dll with a large .pdata and .reloc section.
+    '''
+    pdata = ''.join([ struct.pack('<III', i * 16, i * 16 + 12, 0x100) for i in xrange(funccount) ])
+
+    relocs = []
+    for i in xrange(pagecount):
+        fixups = [ (10 << 12) | (j * 8) for j in xrange(0x100) ]
+        relocs.append(struct.pack('<LL', 0x1000 + (i * 0x1000), 8 + (len(fixups) * 2)))
+        relocs.append(struct.pack('<%dH' % len(fixups), *fixups))
+    reloc = ''.join(relocs)
+
+    secdefs = [ ('.pdata', pdata), ('.reloc', reloc) ]
+
+    nt = vs_pe.IMAGE_NT_HEADERS64()
+    hdrsize = 0x40 + len(nt) + (len(vs_pe.IMAGE_SECTION_HEADER()) * len(secdefs))
+    fileoff = (hdrsize + 0x1ff) & ~0x1ff
+    rva = 0x1000
+
+    sections = []
+    body = []
+    for name, bytez in secdefs:
+        s = vs_pe.IMAGE_SECTION_HEADER()
+        s.Name = name
+        s.VirtualSize = len(bytez)
+        s.VirtualAddress = rva
+        s.SizeOfRawData = len(bytez)
+        s.PointerToRawData = fileoff
+        sections.append(s)
+        body.append(bytez)
+        fileoff += len(bytez)
+        rva += (len(bytez) + 0xfff) & ~0xfff
+
+    dos = vs_pe.IMAGE_DOS_HEADER()
+    dos.e_magic = 0x5a4d
+    dos.e_lfanew = 0x40
+
+    nt.Signature = 'PE\x00\x00'
+    nt.FileHeader.Machine = PE.IMAGE_FILE_MACHINE_AMD64
+    nt.FileHeader.NumberOfSections = len(sections)
+    nt.FileHeader.SizeOfOptionalHeader = len(nt.OptionalHeader)
+    nt.OptionalHeader.Magic = '\x0b\x02'
+    nt.OptionalHeader.ImageBase = 0x180000000
+    nt.OptionalHeader.SectionAlignment = 0x1000
+    nt.OptionalHeader.FileAlignment = 0x200
+    nt.OptionalHeader.SizeOfImage = rva
+    nt.OptionalHeader.NumberOfRvaAndSizes = 16
+    nt.OptionalHeader.DataDirectory[PE.IMAGE_DIRECTORY_ENTRY_BASERELOC].VirtualAddress = sections[1].VirtualAddress
+    nt.OptionalHeader.DataDirectory[PE.IMAGE_DIRECTORY_ENTRY_BASERELOC].Size = len(reloc)
+
+    hdr = dos.vsEmit().ljust(0x40, '\x00') + nt.vsEmit() + ''.join([ s.vsEmit() for s in sections ])
+    return hdr.ljust(sections[0].PointerToRawData, '\x00') + ''.join(body)
+
+def legacyPdata(pe):
+    # The slice-the-remaining-buffer parser
+    sec = pe.getSectionByName('.pdata')
+    ret = []
+    rbytes = pe.readAtRva(sec.VirtualAddress, sec.VirtualSize)
+    while len(rbytes):
+        f = vs_pe.IMAGE_RUNTIME_FUNCTION_ENTRY()
+        f.vsParse(rbytes)
+        rbytes = rbytes[len(f):]
+        ret.append(f)
+    return ret
+
+def legacyRelocs(pe):
+    ret = []
+    edir = pe.getDataDirectory(PE.IMAGE_DIRECTORY_ENTRY_BASERELOC)
+    relbytes = pe.readAtRva(edir.VirtualAddress, edir.Size)
+    while relbytes:
+        pageva, chunksize = struct.unpack("<LL", relbytes[:8])
+        relcnt = (chunksize - 8) / 2
+        rels = struct.unpack("<%dH" % relcnt, relbytes[8:chunksize])
+        for r in rels:
+            ret.append((pageva + (r & 0xfff), r >> 12))
+        relbytes = relbytes[chunksize:]
+    return ret
+
+class PETablesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fd, cls.fpath = tempfile.mkstemp(suffix='.dll')
+        os.write(cls.fd, buildPe64(20000, 200))
+        os.close(cls.fd)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.unlink(cls.fpath)
+
+    def test_pe_tables_mapped(self):
+        pe = PE.peFromFileName(self.fpath)
+        mpe = PE.peFromFileName(self.fpath, mapped=True)
+
+        self.assertTrue( mpe.fdmap != None )
+        self.assertTrue( mpe.pe32p )
+        self.assertEqual( mpe.filesize, pe.filesize )
+        self.assertEqual( [ s.vsEmit() for s in mpe.getSections() ],
+                          [ s.vsEmit() for s in pe.getSections() ] )
+
+        self.assertEqual( mpe.readAtOffset(0, 0x40), pe.readAtOffset(0, 0x40) )
+        self.assertEqual( mpe.readAtOffset(pe.filesize - 4, 8), None )
+        self.assertEqual( len(mpe.readAtOffset(pe.filesize - 4, 8, shortok=True)), 4 )
+        self.assertEqual( len(pe.readAtOffset(pe.filesize - 4, 8, shortok=True)), 4 )
+
+    def test_pe_tables_pdata(self):
+        pe = PE.peFromFileName(self.fpath, mapped=True)
+        pdata = pe.getPdataEntries()
+        self.assertEqual( len(pdata), 20000 )
+        self.assertEqual( pdata[-1].BeginAddress, 19999 * 16 )
+        legacy = legacyPdata(pe)
+        self.assertEqual( [ f.vsEmit() for f in pdata ],
+                          [ f.vsEmit() for f in legacy ] )
+
+        funcs = pe.getRuntimeFunctions()
+        self.assertEqual( funcs, [ (f.BeginAddress, f.EndAddress, f.UnwindInfoAddress) for f in legacy ] )
+
+        lazy = pe.getPdataEntries(lazy=True)
+        self.assertEqual( len(lazy), 20000 )
+        self.assertEqual( lazy[-1].BeginAddress, 19999 * 16 )
+        self.assertEqual( lazy[5].vsGetStruct().vsEmit(), legacy[5].vsEmit() )
+        self.assertEqual( [ f.vsEmit() for f in lazy ], [ f.vsEmit() for f in legacy ] )
+
+    def test_pe_tables_relocs(self):
+        pe = PE.peFromFileName(self.fpath, mapped=True)
+        relocs = pe.getRelocations()
+        self.assertEqual( len(relocs), 200 * 0x100 )
+        self.assertEqual( relocs[0], (0x1000, 10) )
+        self.assertEqual( relocs, legacyRelocs(pe) )
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_pe_tables_bench(self):
+        pe = PE.peFromFileName(self.fpath)
+
+        start = time.time()
+        legacyPdata(pe)
+        legacyRelocs(pe)
+        legacytime = time.time() - start
+
+        start = time.time()
+        pe = PE.peFromFileName(self.fpath, mapped=True)
+        pe.getPdataEntries()
+        pe.parseRelocations()
+        tabletime = time.time() - start
+
+        start = time.time()
+        pe.getRuntimeFunctions()
+        functime = time.time() - start
+
+        start = time.time()
+        pe.getPdataEntries(lazy=True)
+        lazytime = time.time() - start
+
+        print('pe64 tables: legacy %.3fs offsets %.3fs pdata tuples %.3fs views %.3fs' % (legacytime, tabletime, functime, lazytime))
@@ -71,6 +71,7 @@ class ArchitectureModule:
     """
     _default_call = None
     _plat_def_calls = {}
+    _arch_align = 1     # instruction alignment ( used to step over invalid bytes )
     def __init__(self, archname, maxinst=32):
         self._arch_id = getArchByName(archname)
         self._arch_name = archname
@@ -123,6 +124,53 @@ class ArchitectureModule:
         '''
         raise ArchNotImplemented('archParseOpcode')
 
+    def archParseOpcodes(self, bytez, offset=0, va=0, count=None, endva=None):
+        '''
+        Linear sweep disassemble the given bytes, yielding a tuple of
+        (va, size, op) for each instruction.  Bytes which do not decode
+        are reported inline (rather than raising) as an op of None
+        with a size of the arch instruction alignment.
+
+        offset  - Offset into bytes to begin opcode parsing
+        va      - Virtual address of the byte at offset
+        count   - Maximum number of tuples to yield (default: no limit)
+        endva   - Stop at the first instruction starting at/after endva
+
+        Example:
+            for va, size, op in a.archParseOpcodes(bytez, va=0x41414141):
+                if op == None:
+                    print 'invalid: 0x%.8x' % va
+        '''
+        parse = self.archParseOpcode
+        align = self._arch_align
+
+        maxoff = len(bytez)
+        if endva != None:
+            maxoff = min(maxoff, offset + (endva - va))
+
+        while offset < maxoff:
+
+            if count != None:
+                if count <= 0:
+                    break
+                count -= 1
+
+            try:
+                op = parse(bytez, offset, va)
+                size = op.size
+            except Exception:
+                op = None
+                size = 0
+
+            if size <= 0:
+                op = None
+                size = align
+
+            yield (va, size, op)
+
+            offset += size
+            va += size
+
     def archGetRegisterGroups(self):
         '''
         Returns a tuple of tuples of registers for different register groups.
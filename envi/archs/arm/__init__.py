@@ -10,6 +10,8 @@ from envi.archs.arm.disasm import *
 
 class ArmModule(envi.ArchitectureModule):
 
+    _arch_align = 4
+
     def __init__(self, name='armv6'):
         envi.ArchitectureModule.__init__(self, name, maxinst=4)
         self._arch_reg = self.archGetRegCtx()
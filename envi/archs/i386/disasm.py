@@ -59,6 +59,10 @@ i386_prefixes[0x67] = PREFIX_ADDR_SIZE
 # The scale byte index into this for multiplier imm
 scale_lookup = (1, 2, 4, 8)
 
+# Pre-computed (mod, reg, rm) splits for each modrm byte.  A SIB byte
+# splits the same way into (scale, index, base).
+modrm_lookup = [ ((b >> 6) & 0x3, (b >> 3) & 0x7, b & 0x7) for b in range(256) ]
+
 # A set of instructions that are considered privileged (mark with IF_PRIV)
 # FIXME this should be part of the opcdode tables!
 priv_lookup = {
@@ -615,6 +619,129 @@ MODE_16 = 0
 MODE_32 = 1
 MODE_64 = 2
 
+###########################################################################
+#
+# Flattened opcode tables for the fast decoder
+#
+# Each of the opcode86 tables is lazily flattened into a 256 entry list
+# indexed directly by the opcode byte (overflow tables and the index
+# shift/mask/sub are resolved up front).  Each entry is a tuple of:
+#
+# (opdesc, consume, iflags, plan)
+#
+# where consume is True if the byte is eaten by the table, iflags are the
+# envi instruction flags (less the arch) and plan is a tuple of per operand
+# (kind, operflags, addrmeth, sizelist, operval) tuples (or None if the
+# generic decoder must handle the opcode).  Bytes which do not index into
+# the table have a None entry.
+#
+# Each decoder keeps its own copy of the tables for each operand size mode
+# with the plans resolved to (kind, operflags, tsize, arg) tuples, where
+# arg is the shared operand, the modrm byte -> register operand list, the
+# immediate struct or the ameth_ method ( see i386Disasm._dis_getFastTable ).
+
+FAST_EMBED  = 0     # operand embedded in the opcode
+FAST_MODRM  = 1     # modrm defines reg/memory (E/M/R)
+FAST_MODREG = 2     # modrm reg field defines general-purpose reg (G)
+FAST_IMM    = 3     # immediate data follows (I)
+FAST_PCREL  = 4     # immediate relative to eip (J)
+FAST_AMETH  = 5     # everything else goes through the ameth_ methods
+
+fast_kinds = {
+    0:                      FAST_EMBED,
+    opcode86.ADDRMETH_E:    FAST_MODRM,
+    opcode86.ADDRMETH_M:    FAST_MODRM,
+    opcode86.ADDRMETH_R:    FAST_MODRM,
+    opcode86.ADDRMETH_G:    FAST_MODREG,
+    opcode86.ADDRMETH_I:    FAST_IMM,
+    opcode86.ADDRMETH_J:    FAST_PCREL,
+}
+
+fast_tables = [ None for t in all_tables ]
+fast_plans = {}
+
+# Resolved operand kinds ( see i386Disasm._dis_getFastTable() )
+FAST_OPER   = 6     # a shared operand object ( embedded reg / imm )
+
+# Unsigned immediate / signed pc relative structs by size
+fast_immstructs = {}
+fast_relstructs = {}
+for _size, _fmt in ( (1, 'B'), (2, '<H'), (4, '<I'), (8, '<Q') ):
+    fast_immstructs[_size] = struct.Struct(_fmt)
+    fast_relstructs[_size] = struct.Struct(_fmt.lower())
+
+# The modrm memory forms without a sib / absolute address ( [reg],
+# [reg + disp8] and [reg + disp32] ) as (reg, dispstruct, size) by
+# modrm byte ( or None for the forms extended_parse_modrm() handles )
+fast_memforms = []
+for _mod, _reg, _rm in modrm_lookup:
+    if _mod == 3 or _rm == 4 or (_mod == 0 and _rm == 5):
+        fast_memforms.append(None)
+    elif _mod == 0:
+        fast_memforms.append((_rm, None, 1))
+    elif _mod == 1:
+        fast_memforms.append((_rm, fast_relstructs[1], 2))
+    else:
+        fast_memforms.append((_rm, fast_relstructs[4], 5))
+
+def _fastOpcodePlan(opdesc):
+    plan = []
+    for i in operand_range:
+        operflags = opdesc[i]
+        if operflags == 0:
+            break
+
+        opertype = operflags & opcode86.OPTYPE_MASK
+        addrmeth = operflags & opcode86.ADDRMETH_MASK
+
+        sizelist = opcode86.OPERSIZE.get(opertype)
+        if sizelist == None:
+            return None
+
+        kind = fast_kinds.get(addrmeth, FAST_AMETH)
+        plan.append((kind, operflags, addrmeth, sizelist, opdesc[5+i]))
+
+    return tuple(plan)
+
+def _fastOpcodeEntry(opdesc, consume):
+    # Cache the plan by table entry ( they are often repeated )
+    key = id(opdesc)
+    plan = fast_plans.get(key)
+    if plan == None:
+        plan = (opdesc, _fastOpcodePlan(opdesc))
+        fast_plans[key] = plan
+
+    iflags = iflag_lookup.get(opdesc[1], 0)
+    if priv_lookup.get(opdesc[6], False):
+        iflags |= envi.IF_PRIV
+
+    return (opdesc, consume, iflags, plan[1])
+
+def getFastTable(tabnum):
+    '''
+    Return the flattened (256 entry) version of the given opcode table.
+    '''
+    ftab = fast_tables[tabnum]
+    if ftab != None:
+        return ftab
+
+    ftab = []
+    for obyte in range(256):
+        tabdesc = all_tables[tabnum]
+        if obyte > tabdesc[4]:
+            tabdesc = all_tables[tabdesc[5]]
+
+        tabidx = ((obyte - tabdesc[3]) >> tabdesc[1]) & tabdesc[2]
+        if tabidx >= len(tabdesc[0]):
+            ftab.append(None)
+            continue
+
+        opdesc = tabdesc[0][tabidx]
+        ftab.append(_fastOpcodeEntry(opdesc, tabdesc[2] == 0xff))
+
+    fast_tables[tabnum] = ftab
+    return ftab
+
 class i386Disasm:
 
     def __init__(self, mode=MODE_32):
@@ -646,6 +773,16 @@ class i386Disasm:
         self._dis_amethods[opcode86.ADDRMETH_X>>16] = self.ameth_x
         self._dis_amethods[opcode86.ADDRMETH_Y>>16] = self.ameth_y
 
+        # Shared (immutable) register and immediate operands for the fast
+        # decoder by (reg, tsize) and (imm, tsize)
+        self._dis_regopers = {}
+        self._dis_immopers = {}
+
+        # The fast decoder tables with resolved operand plans by [mode][tabnum]
+        # and the modrm byte -> register operand lists by tsize
+        self._dis_fasttables = ( [ None for t in all_tables ], [ None for t in all_tables ] )
+        self._dis_modrmopers = {}
+
         # Offsets used to add in addressing method parsers
         self.ROFFSETMMX   = getRegOffset(i386regs, "mm0")
         self.ROFFSETSIMD  = getRegOffset(i386regs, "xmm0")
@@ -657,11 +794,7 @@ class i386Disasm:
 
     def parse_modrm(self, byte, prefixes=0):
         # Pass in a string with an offset for speed rather than a new string
-        mod = (byte >> 6) & 0x3
-        reg = (byte >> 3) & 0x7
-        rm = byte & 0x7
-        #print "MOD/RM",hex(byte),mod,reg,rm
-        return (mod,reg,rm)
+        return modrm_lookup[byte]
 
     def byteRegOffset(self, val, prefixes=0):
         # NOTE: This is used for high byte metas in 32 bit mode only
@@ -748,10 +881,7 @@ class i386Disasm:
         """
         Return a tuple of (size, scale, index, base, imm)
         """
-        byte = ord(bytez[offset])
-        scale = (byte >> 6) & 0x3
-        index = (byte >> 3) & 0x7
-        base  = byte & 0x7
+        scale, index, base = modrm_lookup[ord(bytez[offset])]
         imm = None
 
         size = 1
@@ -797,7 +927,292 @@ class i386Disasm:
         #print "SIZELIST",repr(sizelist)
         return sizelist[mode]
 
+    def _dis_getRegOper(self, reg, tsize):
+        oper = self._dis_regopers.get((reg, tsize))
+        if oper is None:
+            oper = i386RegOper(reg, tsize)
+            oper._dis_regctx = self._dis_regctx
+            self._dis_regopers[(reg, tsize)] = oper
+        return oper
+
+    def _dis_getImmOper(self, imm, tsize):
+        oper = self._dis_immopers.get((imm, tsize))
+        if oper is None:
+            oper = i386ImmOper(imm, tsize)
+            oper._dis_regctx = self._dis_regctx
+            self._dis_immopers[(imm, tsize)] = oper
+        return oper
+
+    def _dis_getModrmOpers(self, tsize):
+        '''
+        Return a tuple of (rmopers, regopers, learmopers) lists which map
+        each modrm byte to the shared register operand for the rm field
+        ( or None for the memory forms ) and the reg field.  The lea rm
+        operands are not shared with other instructions ( since lea
+        clears _is_deref ).
+        '''
+        ret = self._dis_modrmopers.get(tsize)
+        if ret != None:
+            return ret
+
+        def fastreg(reg):
+            if tsize == 1:
+                return self.byteRegOffset(reg)
+            if tsize == 2:
+                return reg + RMETA_LOW16
+            return reg
+
+        rmopers = []
+        regopers = []
+        learmopers = []
+        for mod, reg, rm in modrm_lookup:
+            rmoper = None
+            leaoper = None
+            if mod == 3:
+                rmoper = self._dis_getRegOper(fastreg(rm), tsize)
+                leaoper = i386RegOper(fastreg(rm), tsize)
+                leaoper._dis_regctx = self._dis_regctx
+                leaoper._is_deref = False
+            rmopers.append(rmoper)
+            learmopers.append(leaoper)
+            regopers.append(self._dis_getRegOper(fastreg(reg), tsize))
+
+        ret = (rmopers, regopers, learmopers)
+        self._dis_modrmopers[tsize] = ret
+        return ret
+
+    def _dis_resolvePlan(self, plan, mode, lea=False):
+        # Resolve everything which only depends on the table entry and
+        # the operand size mode into (kind, operflags, tsize, arg) tuples
+        ret = []
+        for kind, operflags, addrmeth, sizelist, operval in plan:
+            tsize = sizelist[mode]
+            arg = None
+
+            if kind == FAST_EMBED:
+                if operflags & opcode86.OP_REG:
+                    kind = FAST_OPER
+                    arg = self._dis_getRegOper(operval, tsize)
+                elif operflags & opcode86.OP_IMM:
+                    kind = FAST_OPER
+                    arg = self._dis_getImmOper(operval, tsize)
+                else:
+                    arg = operval
+
+            elif kind == FAST_MODRM:
+                if lea:
+                    arg = self._dis_getModrmOpers(tsize)[2]
+                else:
+                    arg = self._dis_getModrmOpers(tsize)[0]
+
+            elif kind == FAST_MODREG:
+                arg = self._dis_getModrmOpers(tsize)[1]
+
+            elif kind == FAST_IMM:
+                arg = fast_immstructs.get(tsize)
+
+            elif kind == FAST_PCREL:
+                arg = fast_relstructs.get(tsize)
+
+            else:
+                arg = self._dis_amethods[addrmeth >> 16]
+                if arg == None:
+                    # Leave it to the generic decoder ( which raises )
+                    return None
+
+            # Anything we have no struct for goes to the generic decoder
+            if arg == None and kind in (FAST_IMM, FAST_PCREL):
+                return None
+
+            ret.append((kind, operflags, tsize, arg))
+
+        return tuple(ret)
+
+    def _dis_getFastTable(self, mode, tabnum):
+        '''
+        Return the flattened opcode table ( see getFastTable() ) with the
+        operand plans resolved for this decoder and operand size mode.
+        '''
+        ftab = self._dis_fasttables[mode][tabnum]
+        if ftab != None:
+            return ftab
+
+        plans = {}
+        ftab = []
+        for opent in getFastTable(tabnum):
+            if opent == None:
+                ftab.append(None)
+                continue
+
+            opdesc, consume, iflags, plan = opent
+            if plan != None:
+                lea = opdesc[1] == opcode86.INS_LEA
+                key = (id(plan), lea)
+                rplan = plans.get(key)
+                if rplan == None:
+                    rplan = self._dis_resolvePlan(plan, mode, lea=lea)
+                    plans[key] = rplan
+                plan = rplan
+
+            ftab.append((opdesc, consume, iflags, plan))
+
+        self._dis_fasttables[mode][tabnum] = ftab
+        return ftab
+
     def disasm(self, bytez, offset, va):
+        '''
+        The table driven i386 decoder.  This produces the same opcodes as
+        _dis_generic() ( which it falls back to for anything unusual ) but
+        uses the flattened opcode tables with operand plans resolved per
+        operand size mode, so register operands (embedded or from modrm)
+        are looked up rather than decoded, and the simple modrm memory
+        forms are decoded inline.
+        '''
+        startoff = offset
+        prefixes = 0
+
+        dis_prefixes = self._dis_prefixes
+        while True:
+            obyte = ord(bytez[offset])
+            p = dis_prefixes[obyte]
+            if p == None:
+                break
+            if obyte == 0x66 and ord(bytez[offset+1]) == 0x0f:
+                break
+            prefixes |= p
+            offset += 1
+
+        mode = MODE_32
+        if prefixes & PREFIX_OP_SIZE:
+            mode = MODE_16
+        fasttables = self._dis_fasttables[mode]
+
+        tabnum = 0
+        while True:
+            obyte = ord(bytez[offset])
+
+            ftab = fasttables[tabnum]
+            if ftab == None:
+                ftab = self._dis_getFastTable(mode, tabnum)
+
+            opent = ftab[obyte]
+            if opent == None:
+                return self._dis_generic(bytez, startoff, va)
+
+            opdesc, consume, iflags, plan = opent
+
+            nexttable = opdesc[0]
+            if nexttable != 0:
+                # See the note about 66 0f in _dis_generic()
+                if obyte == 0x66 and ord(bytez[offset+1]) == 0x0f:
+                    offset += 1
+                offset += 1
+                tabnum = nexttable
+                continue
+
+            if consume:
+                offset += 1
+            break
+
+        optype = opdesc[1]
+        if optype == 0:
+            raise envi.InvalidInstruction(bytez=bytez[startoff:startoff+16], va=va)
+
+        if plan == None:
+            return self._dis_generic(bytez, startoff, va)
+
+        regctx = self._dis_regctx
+        operands = []
+        operoffset = 0
+
+        try:
+
+            for kind, operflags, tsize, arg in plan:
+
+                if kind == FAST_OPER:
+                    operands.append(arg)
+                    continue
+
+                if kind == FAST_MODRM:
+                    modrm = ord(bytez[offset])
+                    oper = arg[modrm]
+                    if oper is not None:
+                        operands.append(oper)
+                        operoffset += 1
+                        continue
+
+                    # ( short input is left to extended_parse_modrm to fail on )
+                    memform = fast_memforms[modrm]
+                    if memform == None or offset + memform[2] > len(bytez):
+                        osize, oper = self.extended_parse_modrm(bytez, offset, tsize, prefixes=prefixes)
+                    else:
+                        reg, dispstruct, osize = memform
+                        disp = 0
+                        if dispstruct != None:
+                            disp = dispstruct.unpack_from(bytez, offset+1)[0]
+                        oper = i386RegMemOper(reg, tsize, disp=disp)
+
+                elif kind == FAST_MODREG:
+                    operands.append(arg[ord(bytez[offset])])
+                    continue
+
+                elif kind == FAST_IMM:
+                    imm = arg.unpack_from(bytez, offset+operoffset)[0]
+                    operoffset += tsize
+
+                    # Sign extend to the size of the other operand ( see _dis_generic )
+                    if operflags & opcode86.OP_SIGNED and len(operands) and tsize != operands[-1].tsize:
+                        otsize = operands[-1].tsize
+                        imm = e_bits.sign_extend(imm, tsize, otsize)
+                        tsize = otsize
+
+                    if imm <= 0xff or imm >= e_bits.u_maxes[tsize] - 0xff:
+                        operands.append(self._dis_getImmOper(imm, tsize))
+                    else:
+                        oper = i386ImmOper(imm, tsize)
+                        oper._dis_regctx = regctx
+                        operands.append(oper)
+                    continue
+
+                elif kind == FAST_PCREL:
+                    imm = arg.unpack_from(bytez, offset+operoffset)[0]
+                    osize = tsize
+                    oper = i386PcRelOper(imm, tsize)
+
+                elif kind == FAST_EMBED:
+                    self.ameth_0(operflags, arg, tsize, prefixes)
+                    continue
+
+                else:
+                    osize, oper = arg(bytez, offset, tsize, prefixes, operflags)
+
+                # NOTE: "is not" avoids the operand __ne__ ( it is hot )
+                if oper is not None:
+                    oper._dis_regctx = regctx
+                    operands.append(oper)
+
+                operoffset += osize
+
+        except struct.error, e:
+            # Catch struct unpack errors due to insufficient data length
+            raise envi.InvalidInstruction(bytez=bytez[startoff:startoff+16])
+
+        iflags |= self._dis_oparch
+
+        if prefixes & PREFIX_REP_MASK:
+            iflags |= envi.IF_REPEAT
+
+        # Lea will have a reg-mem/sib operand with _is_deref True, but should be false
+        # ( the register forms come from the lea only operand list )
+        if optype == opcode86.INS_LEA:
+            operands[1]._is_deref = False
+
+        return i386Opcode(va, optype, opdesc[6], prefixes, (offset-startoff)+operoffset, operands, iflags)
+
+    def _dis_generic(self, bytez, offset, va):
+        '''
+        The generic (table walking) i386 decoder.
+        '''
 
         # Stuff for opcode parsing
         tabdesc = all_tables[0] # A tuple (optable, shiftbits, mask byte, sub, max)
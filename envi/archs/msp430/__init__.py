@@ -15,6 +15,8 @@ import disasm
 
 class Msp430Module(envi.ArchitectureModule):
 
+    _arch_align = 2
+
     def __init__(self):
         envi.ArchitectureModule.__init__(self, "msp430", maxinst=4)
         self._arch_dis = disasm.Msp430Disasm()
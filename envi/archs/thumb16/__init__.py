@@ -5,6 +5,8 @@ import disasm as th_disasm
 
 class Thumb16Module(ArmModule):
 
+    _arch_align = 2
+
     def __init__(self):
         ArmModule.__init__(self, name='thumb16')
         self._arch_dis = th_disasm.Thumb16Disasm()
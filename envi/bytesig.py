@@ -6,6 +6,21 @@ signature matching.
 
 Currently used by vivisect function entry sig db and others.
 """
+import re
+
+def _maskedClass(byte, mask):
+    # Return a regex for the bytes which match byte under mask (or None)
+    if byte & ~mask:
+        return None
+
+    if mask == 0xff:
+        return '\\x%.2x' % byte
+
+    if mask == 0:
+        return '[\\x00-\\xff]'
+
+    vals = [ '\\x%.2x' % x for x in xrange(256) if x & mask == byte ]
+    return '[%s]' % ''.join(vals)
 
 class SignatureTree:
     """
@@ -25,6 +40,10 @@ class SignatureTree:
         self.basenode = (0, [], [None] * 256)
         self.sigs = {} # track duplicates
 
+        # The compiled scanner for scanSignatures() (built on demand)
+        self._scan_re = None
+        self._scan_first = None
+
     def _addChoice(self, siginfo, node):
 
         todo = [(node, siginfo),]
@@ -90,6 +109,78 @@ class SignatureTree:
 
         siginfo = (byteord, maskord, val)
         self._addChoice(siginfo, self.basenode)
+        self._scan_re = None
+
+    def _compileScanner(self):
+        # Build one regex for every signature.  Each match consumes a
+        # single byte (the union of the possible first bytes, which lets
+        # the regex engine skip ahead quickly) and the rest of each
+        # signature is checked with look behind/ahead assertions.
+        firsts = [ [] for i in xrange(256) ]
+        firstbytes = set()
+        alts = []
+
+        for siginfo in self.basenode[1]:
+            bytes, masks, val = siginfo
+            if not bytes:
+                continue
+
+            classes = [ _maskedClass(b, m) for b, m in zip(bytes, masks) ]
+            if None in classes:
+                continue # this signature can never match
+
+            for x in xrange(256):
+                if x & masks[0] == bytes[0]:
+                    firsts[x].append(siginfo)
+                    firstbytes.add(x)
+
+            alt = '(?<=%s)' % classes[0]
+            if len(classes) > 1:
+                alt += '(?=%s)' % ''.join(classes[1:])
+            alts.append(alt)
+
+        self._scan_first = firsts
+        if not alts:
+            self._scan_re = False
+            return
+
+        first = ''.join([ '\\x%.2x' % x for x in sorted(firstbytes) ])
+        self._scan_re = re.compile('[%s](?:%s)' % (first, '|'.join(alts)), re.DOTALL)
+
+    def _getScanValue(self, bytes, offset, endoff):
+        # Find the (first added) signature which matches at offset
+        for sbytes, smasks, sobj in self._scan_first[ord(bytes[offset])]:
+            if offset + len(sbytes) > endoff:
+                continue
+
+            for i in xrange(1, len(sbytes)):
+                if ord(bytes[offset + i]) & smasks[i] != sbytes[i]:
+                    break
+            else:
+                return sobj
+
+    def scanSignatures(self, bytes, offset=0, endoff=None):
+        """
+        Scan the given bytes (from offset up to endoff) for every offset
+        where a signature matches in a single pass.  Yields (offset, val)
+        tuples in offset order.
+
+        Example:
+            for off, val in sigtree.scanSignatures(bytes):
+                print 'sig %r at %d' % (val, off)
+        """
+        if self._scan_re == None:
+            self._compileScanner()
+
+        if not self._scan_re:
+            return
+
+        if endoff == None:
+            endoff = len(bytes)
+
+        for match in self._scan_re.finditer(bytes, offset, endoff):
+            off = match.start()
+            yield (off, self._getScanValue(bytes, off, endoff))
 
     def isSignature(self, bytes, offset=0):
         return self.getSignature(bytes, offset=offset) != None
@@ -42,7 +42,7 @@ class CodeFlowContext(object):
 
         self._cf_recurse = recurse
         self._cf_exptable = exptable
-        self._cf_blocks = [] 
+        self._cf_blocks = {}    # in-progress block va -> count
         self._dynamic_branch_handlers = []
 
 
@@ -121,134 +121,199 @@ class CodeFlowContext(object):
         '''
         self._fcalls[fva] = calls_from
 
-    def addCodeFlow(self, va, arch=envi.ARCH_DEFAULT):
+    def _cf_run(self, cfgen):
         '''
-        Do code flow disassembly from the specified address.  Returnes a list
-        of the procedural branch targets discovered during code flow...
+        Drive a code flow generator (see _cf_flow) using an explicit stack
+        of in-progress functions rather than recursion.  Each entry point
+        yielded by the top generator is fully analyzed before that
+        generator is resumed ( so we still do the deepest funcs first ).
+        '''
+        cfstack = [ cfgen, ]
+        try:
+            while cfstack:
+                try:
+                    va, arch = cfstack[-1].next()
+                except StopIteration:
+                    cfstack.pop()
+                    continue
 
-        Set persist=True to store 'opdone' and never disassemble the same thing twice
+                # Check if this is already a known function.
+                if self._funcs.get(va) != None:
+                    continue
+
+                cfstack.append( self._cf_entry(va, arch) )
+
+        finally:
+            # Only non-empty if something raised, let everybody clean up
+            while cfstack:
+                cfstack.pop().close()
+
+    def _cf_entry(self, va, arch):
         '''
-        opdone = {}
-        if self._cf_persist != None:
-            opdone = self._cf_persist
+        The code flow generator for a single function entry point.
+        '''
+        # Add this function to known functions
+        self._funcs[va] = True
 
         calls_from = {}
-        optodo = [ ((0, va), arch), ]
-        startva = va
-        self._cf_blocks.append( va )
-        cf_eps = set()
-        while len(optodo):
+        for todo in self._cf_flow(va, arch, calls_from):
+            yield todo
 
-            todo,arch = optodo.pop()
+        calls_from = calls_from.keys()
+        self._fcalls[va] = calls_from
 
-            if self._cf_noflow.get( todo ):
-                self._cb_noflow( *todo )
-                continue
+        # Finally, notify the callback of a new function
+        self._cb_function(va, {'CallsFrom':calls_from})
 
-            pva, va = todo
-            if opdone.get(va):
-                continue
+    def _cf_flow(self, va, arch, calls_from):
+        '''
+        Do the code flow disassembly from the specified address, filling in
+        the calls_from dict.  This is a generator which yields (va, arch)
+        tuples for procedure entry points which must be analyzed before
+        code flow continues.
+        '''
+        opdone = {}
+        if self._cf_persist != None:
+            opdone = self._cf_persist
 
-            opdone[va] = True
+        cf_blocks = self._cf_blocks
 
-            try:
-                op = self._mem.parseOpcode(va, arch=arch)
-            except envi.InvalidInstruction, e:
-                print 'parseOpcode error at 0x%.8x: %s' % (va,e)
-                continue 
-            except Exception, e:
-                print 'parseOpcode error at 0x%.8x: %s' % (va,e)
-                continue
+        optodo = [ ((0, va), arch), ]
+        startva = va
+        cf_blocks[va] = cf_blocks.get(va, 0) + 1
+        cf_eps = set()
+        try:
+            while len(optodo):
 
-            branches = op.getBranches()
-            # The opcode callback may filter branches...
-            branches = self._cb_opcode(va, op, branches)
+                todo,arch = optodo.pop()
 
-            while len(branches):
+                if self._cf_noflow.get( todo ):
+                    self._cb_noflow( *todo )
+                    continue
 
-                bva, bflags = branches.pop()
-                                
-                # look for dynamic branches (ie. branches which don't have a known target).  assume at least one branch
-                if bva == None:
-                    self._cb_dynamic_branch(va, op, bflags, branches)
+                pva, va = todo
+                if opdone.get(va):
+                    continue
 
-                # add block as part of our call stack
-                self._cf_blocks.append( bva )
+                opdone[va] = True
 
                 try:
-                    # Handle a table branch by adding more branches...
-                    if bflags & envi.BR_TABLE:
-                        if self._cf_exptable:
-                            ptrbase = bva
-                            bdest = self._mem.readMemoryFormat(ptrbase, '<P')[0]
-                            tabdone = {}
-                            while self._mem.isValidPointer(bdest):
-
-                                if self._cb_branchtable(bva, ptrbase, bdest) == False:
-                                    break
-
-                                if not tabdone.get(bdest):
-                                    tabdone[bdest] = True
-                                    branches.append((bdest, envi.BR_COND))
-
-                                ptrbase += self._mem.psize
+                    op = self._mem.parseOpcode(va, arch=arch)
+                except envi.InvalidInstruction, e:
+                    print 'parseOpcode error at 0x%.8x: %s' % (va,e)
+                    continue 
+                except Exception, e:
+                    print 'parseOpcode error at 0x%.8x: %s' % (va,e)
+                    continue
+
+                branches = op.getBranches()
+                # The opcode callback may filter branches...
+                branches = self._cb_opcode(va, op, branches)
+
+                while len(branches):
+
+                    bva, bflags = branches.pop()
+                                    
+                    # look for dynamic branches (ie. branches which don't have a known target).  assume at least one branch
+                    if bva == None:
+                        self._cb_dynamic_branch(va, op, bflags, branches)
+
+                    # add block as part of our call stack ( bva may be
+                    # updated below, so pop the va we pushed )
+                    pushva = bva
+                    cf_blocks[pushva] = cf_blocks.get(pushva, 0) + 1
+
+                    try:
+                        # Handle a table branch by adding more branches...
+                        if bflags & envi.BR_TABLE:
+                            if self._cf_exptable:
+                                ptrbase = bva
                                 bdest = self._mem.readMemoryFormat(ptrbase, '<P')[0]
-                        continue
+                                tabdone = {}
+                                while self._mem.isValidPointer(bdest):
 
-                    if bflags & envi.BR_DEREF:
+                                    if self._cb_branchtable(bva, ptrbase, bdest) == False:
+                                        break
 
-                        if not self._mem.probeMemory(bva, self._mem.psize, e_mem.MM_READ):
+                                    if not tabdone.get(bdest):
+                                        tabdone[bdest] = True
+                                        branches.append((bdest, envi.BR_COND))
+
+                                    ptrbase += self._mem.psize
+                                    bdest = self._mem.readMemoryFormat(ptrbase, '<P')[0]
                             continue
 
-                        # Before we update bva, lets check if its in noret...
-                        if self._cf_noret.get( bva ):
-                            self.addNoFlow( va, va + len(op) )
+                        if bflags & envi.BR_DEREF:
 
-                        bva = self._mem.readMemoryFormat(bva, '<P')[0]
+                            if not self._mem.probeMemory(bva, self._mem.psize, e_mem.MM_READ):
+                                continue
 
-                    if not self._mem.probeMemory(bva, 1, e_mem.MM_EXEC):
-                        continue
+                            # Before we update bva, lets check if its in noret...
+                            if self._cf_noret.get( bva ):
+                                self.addNoFlow( va, va + len(op) )
 
-                    if bflags & envi.BR_PROC:
+                            bva = self._mem.readMemoryFormat(bva, '<P')[0]
 
-                        # Record that the current code flow has a call from it
-                        # to the branch target...
-                        nextva = va + len(op)
+                        if not self._mem.probeMemory(bva, 1, e_mem.MM_EXEC):
+                            continue
 
-                        if bva != nextva: # NOTE: avoid call 0 constructs
+                        if bflags & envi.BR_PROC:
 
-                            # Now we decend so we do deepest func callbacks first!
-                            if self._cf_recurse:
-                                if bva in self._cf_blocks:
-                                    # the function that we want to make prodcedural
-                                    # called us so we can't call to make it procedural
-                                    # until its done
-                                    cf_eps.add(bva)
-                                else:
-                                    self.addEntryPoint( bva )
+                            # Record that the current code flow has a call from it
+                            # to the branch target...
+                            nextva = va + len(op)
 
-                            if self._cf_noret.get( bva ):
-                                # then our next va is noflow!
-                                self._cf_noflow[ (va, nextva) ] = True
+                            if bva != nextva: # NOTE: avoid call 0 constructs
 
-                            calls_from[bva] = True
+                                # Now we decend so we do deepest func callbacks first!
+                                if self._cf_recurse:
+                                    if cf_blocks.get(bva):
+                                        # the function that we want to make prodcedural
+                                        # called us so we can't call to make it procedural
+                                        # until its done
+                                        cf_eps.add(bva)
+                                    else:
+                                        yield (bva, envi.ARCH_DEFAULT)
 
-                            # We only go up to procedural branches, not across
-                            continue
-                finally:
-                    self._cf_blocks.pop()
+                                if self._cf_noret.get( bva ):
+                                    # then our next va is noflow!
+                                    self._cf_noflow[ (va, nextva) ] = True
+
+                                calls_from[bva] = True
+
+                                # We only go up to procedural branches, not across
+                                continue
+                    finally:
+                        self._cf_popblock(pushva)
 
-                if not opdone.get(bva):
-                    optodo.append( ((va, bva), bflags) )
+                    if not opdone.get(bva):
+                        optodo.append( ((va, bva), bflags) )
 
+        finally:
+            # remove our local blocks from the in-progress blocks
+            self._cf_popblock(startva)
 
-        # remove our local blocks from global block stack
-        self._cf_blocks.pop()
         while cf_eps:
             fva = cf_eps.pop()
             if not self._mem.isFunction(fva):
-                self.addEntryPoint(fva, arch=arch)
+                yield (fva, arch)
 
+    def _cf_popblock(self, va):
+        count = self._cf_blocks.get(va, 0) - 1
+        if count > 0:
+            self._cf_blocks[va] = count
+        else:
+            self._cf_blocks.pop(va, None)
+
+    def addCodeFlow(self, va, arch=envi.ARCH_DEFAULT):
+        '''
+        Do code flow disassembly from the specified address.  Returnes a list
+        of the procedural branch targets discovered during code flow...
+
+        Set persist=True to store 'opdone' and never disassemble the same thing twice
+        '''
+        calls_from = {}
+        self._cf_run( self._cf_flow(va, arch, calls_from) )
         return calls_from.keys()
 
     def addEntryPoint(self, va, arch=envi.ARCH_DEFAULT):
@@ -264,13 +329,23 @@ class CodeFlowContext(object):
         if self._funcs.get(va) != None:
             return
 
-        # Add this function to known functions
-        self._funcs[va] = True
-        calls_from = self.addCodeFlow(va, arch=arch)
-        self._fcalls[va] = calls_from
-        
-        # Finally, notify the callback of a new function
-        self._cb_function(va, {'CallsFrom':calls_from})
+        self._cf_run( self._cf_entry(va, arch) )
+
+    def addEntryPoints(self, vas, arch=envi.ARCH_DEFAULT, prio=None):
+        '''
+        Analyze a list of procedure entry points.  If specified, prio(va)
+        is used as a sort key and entry points are analyzed in order of
+        highest priority first ( to make partial results useful early ).
+
+        Example:
+            cf.addEntryPoints( vas, prio=lambda va: exports.get(va, 0) )
+        '''
+        if prio != None:
+            vas = sorted(vas, key=prio, reverse=True)
+
+        for va in vas:
+            self.addEntryPoint(va, arch=arch)
+
     def addDynamicBranchHandler(self, cb):
         '''
         Add a callback handler for dynamic branches the code-flow resolver 
@@ -1,5 +1,7 @@
 import re
+import bisect
 import struct
+import itertools
 import collections
 
 import envi
@@ -21,6 +23,10 @@ MM_READ_WRITE = MM_READ | MM_WRITE
 MM_READ_EXEC  =  MM_READ | MM_EXEC
 MM_RWX = MM_READ | MM_WRITE | MM_EXEC
 
+# Memory objects take a new (globally unique) generation whenever their
+# set of maps changes, so snapshots may tell if the maps still match.
+mapgens = itertools.count()
+
 pnames = ['No Access', 'Execute', 'Write', None, 'Read']
 def getPermName(perm):
     '''
@@ -299,6 +305,33 @@ class IMemory:
         b = self.readMemory(va, 16)
         return self.imem_archs[ arch >> 16 ].archParseOpcode(b, 0, va)
 
+    def parseOpcodes(self, va, count=None, endva=None, arch=envi.ARCH_DEFAULT):
+        '''
+        Linear sweep disassemble from the specified virtual address using
+        a single memory read, yielding (va, size, op) tuples.  Invalid
+        bytes are reported inline as an op of None ( see the arch module
+        archParseOpcodes() ).  The sweep stops at the end of readable
+        memory, after count instructions or at endva.
+
+        Example:
+            for va, size, op in m.parseOpcodes(0x7c773803, count=20):
+                print '0x%.8x: %r' % (va, op)
+        '''
+        archmod = self.imem_archs[ arch >> 16 ]
+
+        size = self.getMaxReadSize(va)
+        if endva != None:
+            # Read a max instruction past the end so the last one decodes
+            size = min(size, (endva - va) + archmod._arch_maxinst)
+        elif count != None:
+            size = min(size, count * archmod._arch_maxinst)
+
+        if size <= 0:
+            return []
+
+        b = self.readMemory(va, size)
+        return archmod.archParseOpcodes(b, 0, va, count=count, endva=endva)
+
 class MemoryCache(IMemory):
     '''
     An object which acts like "copy on write" cache for another memory
@@ -377,6 +410,130 @@ class MemoryCache(IMemory):
         #Write all of the "dirty" pages back to the underlying memory object.
         #'''
 
+class MemoryPages:
+    '''
+    A writable, page granular backing for the bytes of a memory map.
+
+    Writes are done in place to bytearray pages which are only created
+    for pages which have been touched.  Untouched pages are served
+    directly from the original bytes.  Copies made with copy() share
+    every page with their parent, and a shared page is only duplicated
+    when one side writes to it (copy on write).
+
+    Once getBytes() has been called, the whole contents are also kept
+    in one bytearray which later writes update in place.
+    '''
+    def __init__(self, bytez, pagesize=4096):
+        self._base = bytez
+        self._size = len(bytez)
+        self._pagesize = pagesize
+        self._pages = {}        # page index -> bytearray
+        self._owned = set()     # page indexes we may write in place
+        self._flat = None       # bytearray of the whole contents
+        self._view = None       # read only buffer over _flat
+
+    def __len__(self):
+        return self._size
+
+    def copy(self):
+        '''
+        Return a copy of this object which shares all of our pages.
+        '''
+        ret = MemoryPages(self._base, pagesize=self._pagesize)
+        ret._size = self._size
+        ret._pages = dict(self._pages)
+        # Every page is now shared with the copy...
+        self._owned = set()
+        return ret
+
+    def getDirtyPages(self):
+        '''
+        Returns a list of (offset, bytes) tuples for each touched page.
+        '''
+        ps = self._pagesize
+        return [ (pidx * ps, str(page)) for pidx, page in sorted(self._pages.items()) ]
+
+    def getBytes(self):
+        '''
+        Return the entire contents without copying them.  Until the
+        first write this is the original bytes, after that it is a
+        (read only) buffer over a bytearray which writes update in
+        place, so the result always reflects the current contents.
+        '''
+        if not self._pages:
+            return self._base
+
+        if self._flat == None:
+            ps = self._pagesize
+            flat = bytearray(self._base)
+            for pidx, page in self._pages.iteritems():
+                pva = pidx * ps
+                flat[pva:pva+len(page)] = page
+            self._flat = flat
+            self._view = buffer(flat)
+
+        return self._view
+
+    def read(self, offset, size):
+        if not self._pages:
+            return self._base[offset:offset+size]
+
+        if self._view != None:
+            return self._view[offset:offset+size]
+
+        ps = self._pagesize
+        base = self._base
+        pages = self._pages
+
+        ret = []
+        end = min(offset + size, self._size)
+        while offset < end:
+            pidx, poff = divmod(offset, ps)
+            chunk = min(ps - poff, end - offset)
+            page = pages.get(pidx)
+            if page == None:
+                ret.append(base[offset:offset+chunk])
+            else:
+                ret.append(str(page[poff:poff+chunk]))
+            offset += chunk
+
+        return ''.join(ret)
+
+    def write(self, offset, bytez):
+        '''
+        Write the bytes at the given offset.  A write which hangs off
+        the end grows the contents (without touching the base bytes).
+        '''
+        ps = self._pagesize
+        pages = self._pages
+        owned = self._owned
+
+        boff = 0
+        end = offset + len(bytez)
+        self._size = max(self._size, end)
+
+        if self._flat != None:
+            self._flat[offset:end] = bytez
+
+        while offset < end:
+            pidx, poff = divmod(offset, ps)
+            chunk = min(ps - poff, end - offset)
+
+            page = pages.get(pidx)
+            if pidx not in owned:
+                if page == None:
+                    pva = pidx * ps
+                    page = bytearray(self._base[pva:pva+ps])
+                else:
+                    page = bytearray(page)
+                pages[pidx] = page
+                owned.add(pidx)
+
+            page[poff:poff+chunk] = bytez[boff:boff+chunk]
+
+            boff += chunk
+            offset += chunk
+
 class MemoryObject(IMemory):
 
     def __init__(self, arch=None):
@@ -388,6 +545,16 @@ class MemoryObject(IMemory):
         IMemory.__init__(self, arch=arch)
         self._map_defs = []
 
+        # A sorted index of the map defs for bisect lookups
+        self._map_index = []
+        self._map_starts = []
+        self._map_last = None
+
+        # Indexes (into _map_defs) of maps with page backed writes
+        self._map_ids = {}
+        self._map_dirty = set()
+        self._map_gen = mapgens.next()
+
     #FIXME MemoryObject: def allocateMemory(self, size, perms=MM_RWX, suggestaddr=0):
 
     def addMemoryMap(self, va, perms, fname, bytez):
@@ -397,16 +564,59 @@ class MemoryObject(IMemory):
         msize = len(bytez)
         mmap = (va, msize, perms, fname)
         hlpr = [va, va+msize, mmap, bytez]
+        self._map_ids[id(hlpr)] = len(self._map_defs)
         self._map_defs.append(hlpr)
+
+        idx = bisect.bisect_right(self._map_starts, va)
+        self._map_starts.insert(idx, va)
+        self._map_index.insert(idx, hlpr)
+        self._map_last = None
+        self._map_gen = mapgens.next()
         return
 
+    def _initMapIndex(self):
+        '''
+        Rebuild the sorted map index from the current map defs.
+        '''
+        self._map_index = sorted(self._map_defs, key=lambda mdef: mdef[0])
+        self._map_starts = [ mdef[0] for mdef in self._map_index ]
+        self._map_last = None
+        self._map_ids = dict([ (id(mdef), idx) for idx, mdef in enumerate(self._map_defs) ])
+
+    def _getMapDef(self, va):
+        '''
+        Return the [va, maxva, mmap, bytes] map def list which contains
+        the given va (or None).  The last hit is cached to make runs of
+        accesses to the same map cheap.
+        '''
+        mdef = self._map_last
+        if mdef != None and va >= mdef[0] and va < mdef[1]:
+            return mdef
+
+        idx = bisect.bisect_right(self._map_starts, va) - 1
+        if idx < 0:
+            return None
+
+        mdef = self._map_index[idx]
+        if va >= mdef[1]:
+            return None
+
+        self._map_last = mdef
+        return mdef
+
     def getMemorySnap(self):
         '''
         Take a memory snapshot which may be restored later.
 
+        Snapshots share unmodified pages with the memory object, so
+        the cost of taking (and restoring) one scales with the number
+        of pages which have been written rather than the image size.
+
         Example: snap = mem.getMemorySnap()
         '''
-        return [ list(mdef) for mdef in self._map_defs ]
+        mdefs = self._map_defs
+        dirty = [ (idx, mdefs[idx][3].copy()) for idx in self._map_dirty ]
+        return (list(mdefs), self._map_gen, dirty)
 
     def setMemorySnap(self, snap):
         '''
@@ -414,43 +624,77 @@ class MemoryObject(IMemory):
 
         Example: mem.setMemorySnap(snap)
         '''
-        self._map_defs = [list(md) for md in snap]
+        mdefs, mgen, dirty = snap
+
+        if mgen == self._map_gen:
+            # Only the written maps need to be put back...
+            mdefs = self._map_defs
+            revert = self._map_dirty
+
+        else:
+            # The maps have changed (or the snap is from another memory
+            # object) so start over from (clean) copies of the map defs.
+            self._map_defs = [ list(mdef) for mdef in mdefs ]
+            self._map_gen = mgen
+            self._initMapIndex()
+            mdefs = self._map_defs
+            revert = [ idx for idx, mdef in enumerate(mdefs) if isinstance(mdef[3], MemoryPages) ]
+
+        for idx in revert:
+            mbytes = mdefs[idx][3]
+            if isinstance(mbytes, MemoryPages):
+                mdefs[idx][3] = mbytes._base
+
+        for idx, mbytes in dirty:
+            mdefs[idx][3] = mbytes.copy()
+
+        self._map_dirty = set([ idx for idx, mbytes in dirty ])
 
     def getMemoryMap(self, va):
         """
         Get the va,size,perms,fname tuple for this memory map
         """
-        for mva, mmaxva, mmap, mbytes in self._map_defs:
-            if va >= mva and va < mmaxva:
-                return mmap
-        return None
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            return None
+        return mdef[2]
 
     def getMemoryMaps(self):
         return [ mmap for mva, mmaxva, mmap, mbytes in self._map_defs ]
 
     def readMemory(self, va, size):
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            raise envi.SegmentationViolation(va)
 
-        for mva, mmaxva, mmap, mbytes in self._map_defs:
-            if va >= mva and va < mmaxva:
-                mva, msize, mperms, mfname = mmap
-                if not mperms & MM_READ:
-                    raise envi.SegmentationViolation(va)
-                offset = va - mva
-                return mbytes[offset:offset+size]
-        raise envi.SegmentationViolation(va)
+        mva, mmaxva, mmap, mbytes = mdef
+        if not mmap[2] & MM_READ:
+            raise envi.SegmentationViolation(va)
+
+        offset = va - mva
+        if isinstance(mbytes, MemoryPages):
+            return mbytes.read(offset, size)
+        return mbytes[offset:offset+size]
 
     def writeMemory(self, va, bytes):
-        for mapdef in self._map_defs:
-            mva, mmaxva, mmap, mbytes = mapdef
-            if va >= mva and va < mmaxva:
-                mva, msize, mperms, mfname = mmap
-                if not mperms & MM_WRITE:
-                    raise envi.SegmentationViolation(va)
-                offset = va - mva
-                mapdef[3] = mbytes[:offset] + bytes + mbytes[offset+len(bytes):]
-                return
-
-        raise envi.SegmentationViolation(va)
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            raise envi.SegmentationViolation(va)
+
+        mva, mmaxva, mmap, mbytes = mdef
+        if not mmap[2] & MM_WRITE:
+            raise envi.SegmentationViolation(va)
+
+        offset = va - mva
+
+        # Switch the map to a page backing and write in place
+        # ( writes which hang off the end of the map grow the bytes )
+        if not isinstance(mbytes, MemoryPages):
+            mbytes = MemoryPages(mbytes)
+            mdef[3] = mbytes
+            self._map_dirty.add(self._map_ids.get(id(mdef)))
+
+        mbytes.write(offset, bytes)
 
     def getByteDef(self, va):
         """
@@ -459,13 +703,20 @@ class MemoryObject(IMemory):
         string object *AND* an offset of va into the 
         buffer.  Used internally for optimized memory
         handling.  Returns (offset, bytes)
+
+        NOTE: for a map which has been written to, bytes is a read only
+              buffer ( index and slice it like a string ) which reflects
+              later writes.
         """
-        for mapdef in self._map_defs:
-            mva, mmaxva, mmap, mbytes = mapdef
-            if va >= mva and va < mmaxva:
-                offset = va - mva
-                return (offset, mbytes)
-        raise envi.SegmentationViolation(va)
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            raise envi.SegmentationViolation(va)
+
+        mbytes = mdef[3]
+        if isinstance(mbytes, MemoryPages):
+            mbytes = mbytes.getBytes()
+
+        return (va - mdef[0], mbytes)
 
 class MemoryFile:
     '''
@@ -3,6 +3,7 @@ A home for the page lookup construct.  Basically it is a
 python object which implements a similar lookup mechanism
 to the i386 page table lookups...
 '''
+import bisect
 import collections
 
 # FIXME move functions in here too so there is procedural "speed" way
@@ -70,3 +71,194 @@ class MapLookup:
     def __getslice__(self, start, end):
         print 'GET SLICE'
 
+
+class IntervalLookup:
+
+    '''
+    A MapLookup compatible object which stores each assigned range
+    as a single interval rather than a slot per byte.  Intervals
+    are kept sorted and non-overlapping so lookups are a bisect
+    away and memory use scales with the number of ranges.
+
+    Overlapping sets behave like the per-byte MapLookup: a new
+    range replaces whatever bytes it covers and leaves the
+    remainder of any older range in place.
+
+    The unassigned ranges ( gaps ) within the maps are tracked
+    as well, so they may be walked without checking each byte.
+    '''
+
+    def __init__(self):
+        self._map_starts = []
+        self._map_ends = []
+
+        self._starts = []
+        self._ends = []
+        self._objs = []
+
+        self._gap_starts = []
+        self._gap_ends = []
+
+    def initMapLookup(self, va, size, obj=None):
+        idx = bisect.bisect_right(self._map_starts, va)
+        self._map_starts.insert(idx, va)
+        self._map_ends.insert(idx, va + size)
+        self._addGap(va, va + size)
+        if obj != None:
+            self.setMapLookup(va, size, obj)
+
+    def _addGap(self, va, vamax):
+        # Mark a range unassigned ( merging with adjacent gaps )
+        if vamax <= va:
+            return
+
+        gstarts = self._gap_starts
+        gends = self._gap_ends
+
+        lo = bisect.bisect_left(gends, va)
+        hi = bisect.bisect_right(gstarts, vamax, lo)
+        if lo < hi:
+            va = min(va, gstarts[lo])
+            vamax = max(vamax, gends[hi-1])
+
+        gstarts[lo:hi] = [va]
+        gends[lo:hi] = [vamax]
+
+    def _delGap(self, va, vamax):
+        # Mark a range assigned ( splitting any gaps it covers )
+        gstarts = self._gap_starts
+        gends = self._gap_ends
+
+        lo = bisect.bisect_right(gends, va)
+        hi = bisect.bisect_left(gstarts, vamax, lo)
+        if lo >= hi:
+            return
+
+        nstarts = []
+        nends = []
+        if gstarts[lo] < va:
+            nstarts.append(gstarts[lo])
+            nends.append(va)
+
+        if gends[hi-1] > vamax:
+            nstarts.append(vamax)
+            nends.append(gends[hi-1])
+
+        gstarts[lo:hi] = nstarts
+        gends[lo:hi] = nends
+
+    def isMapLookup(self, va):
+        '''
+        Returns True if the va falls within an initialized map.
+        '''
+        idx = bisect.bisect_right(self._map_starts, va) - 1
+        return idx >= 0 and va < self._map_ends[idx]
+
+    def setMapLookup(self, va, size, obj):
+        if not self.isMapLookup(va):
+            raise Exception('Address (0x%.8x) not in maps!' % va)
+
+        starts = self._starts
+        ends = self._ends
+        objs = self._objs
+
+        vamax = va + size
+
+        # Find the span [lo:hi] of intervals which overlap the range
+        lo = bisect.bisect_right(starts, va) - 1
+        if lo < 0 or ends[lo] <= va:
+            lo += 1
+        hi = bisect.bisect_left(starts, vamax, lo)
+
+        nstarts = []
+        nends = []
+        nobjs = []
+
+        # Keep the head of a partially covered interval
+        if lo < hi and starts[lo] < va:
+            nstarts.append(starts[lo])
+            nends.append(va)
+            nobjs.append(objs[lo])
+
+        if obj != None and size > 0:
+            nstarts.append(va)
+            nends.append(vamax)
+            nobjs.append(obj)
+
+        # Keep the tail of a partially covered interval
+        if lo < hi and ends[hi-1] > vamax:
+            nstarts.append(vamax)
+            nends.append(ends[hi-1])
+            nobjs.append(objs[hi-1])
+
+        starts[lo:hi] = nstarts
+        ends[lo:hi] = nends
+        objs[lo:hi] = nobjs
+
+        if obj != None:
+            if size > 0:
+                self._delGap(va, vamax)
+        else:
+            midx = bisect.bisect_right(self._map_starts, va) - 1
+            self._addGap(va, min(vamax, self._map_ends[midx]))
+
+    def getMapLookup(self, va):
+        idx = bisect.bisect_right(self._starts, va) - 1
+        if idx < 0 or va >= self._ends[idx]:
+            return None
+        return self._objs[idx]
+
+    def getPrevMapLookup(self, va):
+        '''
+        Return the object from the closest assigned range which
+        covers va or ends before it (or None).
+        '''
+        idx = bisect.bisect_right(self._starts, va) - 1
+        if idx < 0:
+            return None
+        return self._objs[idx]
+
+    def iterMapLookups(self, va, size):
+        '''
+        Yield (startva, endva, obj) tuples for each assigned range
+        which overlaps the given range (in address order).
+        '''
+        vamax = va + size
+
+        starts = self._starts
+        ends = self._ends
+        objs = self._objs
+
+        idx = bisect.bisect_right(starts, va) - 1
+        if idx < 0 or ends[idx] <= va:
+            idx += 1
+
+        while idx < len(starts) and starts[idx] < vamax:
+            yield starts[idx], ends[idx], objs[idx]
+            idx += 1
+
+    def iterMapGaps(self, va=None, size=None):
+        '''
+        Yield (startva, endva) tuples for each unassigned range within
+        the initialized maps which overlaps the given range ( or all of
+        them if va is None ).  Ranges are clipped to the given range.
+
+        NOTE: the gaps of adjacent maps are merged, query by map to keep
+              them apart.
+        '''
+        gstarts = self._gap_starts
+        gends = self._gap_ends
+
+        if va == None:
+            for gap in zip(gstarts, gends):
+                yield gap
+            return
+
+        vamax = va + size
+        idx = bisect.bisect_right(gends, va)
+        while idx < len(gstarts) and gstarts[idx] < vamax:
+            yield max(gstarts[idx], va), min(gends[idx], vamax)
+            idx += 1
+
+    def __len__(self):
+        return len(self._starts)
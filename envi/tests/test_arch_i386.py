@@ -4,6 +4,7 @@ import envi.memcanvas as e_memcanvas
 import envi.memcanvas.renderers as e_rend
 import envi.archs.i386 as e_i386
 import vivisect
+import os
 import platform
 import unittest
 
@@ -264,3 +265,115 @@ class i386InstructionSet(unittest.TestCase):
         opercheck = [{'disp': -287454021, 'tsize': 8, '_is_deref': True, 'reg': 2}, {'disp': -287454021, 'tsize': 16, '_is_deref': True, 'reg': 2}]
         self.checkOpcode( opbytez, 0x4000, oprepr, opcheck, opercheck, oprepr )
 
+
+    def _cmpOpcode(self, dis, bytez, va):
+        try:
+            fop = dis.disasm(bytez, 0, va)
+        except Exception as e:
+            fop = e
+        try:
+            gop = dis._dis_generic(bytez, 0, va)
+        except Exception as e:
+            gop = e
+
+        if isinstance(gop, Exception):
+            self.assertEqual((bytez, type(fop)), (bytez, type(gop)))
+            return
+
+        self.assertFalse(isinstance(fop, Exception), '%r: %r' % (bytez, fop))
+        self.assertEqual(fop, gop)
+        self.assertEqual((bytez, repr(fop)), (bytez, repr(gop)))
+        for attr in ('prefixes', 'size', 'iflags', 'opcode', 'mnem'):
+            self.assertEqual((bytez, attr, getattr(fop, attr)), (bytez, attr, getattr(gop, attr)))
+
+        self.assertEqual(len(fop.opers), len(gop.opers))
+        for foper, goper in zip(fop.opers, gop.opers):
+            self.assertEqual((bytez, foper.__class__), (bytez, goper.__class__))
+            fvars = dict(vars(foper))
+            gvars = dict(vars(goper))
+            fvars.pop('_dis_regctx', None)
+            gvars.pop('_dis_regctx', None)
+            self.assertEqual((bytez, fvars), (bytez, gvars))
+
+    def test_envi_i386_disasm_fast_matches_generic(self):
+        '''
+        The table driven decoder must agree with the generic decoder for
+        every first opcode byte under the common prefixes / escapes.
+        '''
+        import random
+        rand = random.Random(0x386)
+        dis = e_i386.i386Disasm()
+        leads = ['', '\x0f', '\x66\x0f', '\xf2\x0f', '\xf3\x0f', '\x0f\x38',
+                 '\x0f\x3a', '\x66\x0f\x38', '\x66\x0f\x3a', '\x66', '\xf0', '\x2e']
+        for lead in leads:
+            for b in range(256):
+                for i in range(6):
+                    tail = ''.join([chr(rand.randint(0, 255)) for j in range(15)])
+                    self._cmpOpcode(dis, lead + chr(b) + tail, 0x41410000)
+
+        # sweep the modrm byte space for a few operand shapes
+        for opc in ('\x01', '\x8b', '\x8d', '\xc7', '\xf7', '\xff', '\x0f\xaf', '\x0f\xb6'):
+            for modrm in range(256):
+                tail = ''.join([chr(rand.randint(0, 255)) for j in range(10)])
+                self._cmpOpcode(dis, opc + chr(modrm) + tail, 0x1000)
+
+                # ( and fail the same way on short input )
+                for i in range(4):
+                    self._cmpOpcode(dis, opc + chr(modrm) + tail[:i], 0x1000)
+
+        # operand size prefixed forms
+        for opc in ('\x66\x8b', '\x66\x8d', '\x66\xc7', '\x66\x81', '\x66\x83'):
+            for modrm in range(256):
+                tail = ''.join([chr(rand.randint(0, 255)) for j in range(10)])
+                self._cmpOpcode(dis, opc + chr(modrm) + tail, 0x1000)
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_envi_i386_disasm_fast_bench(self):
+        import time
+        import random
+        rand = random.Random(0x386)
+        dis = e_i386.i386Disasm()
+        bytez = ''.join([chr(rand.randint(0, 255)) for i in range(0x4000)])
+
+        # A typical compiled instruction mix
+        code = ('55' '89e5' '83ec18' '8b4508' '8b550c' '01d0' '8945fc' '8d45f0' '50'
+                'e800000000' '83c404' '85c0' '7405' 'b801000000' '3b45fc' '0f8c00000000'
+                '8b048500100000' 'c745f800000000' '31c0' '8b5df8' '89ec' '5d' 'c3').decode('hex')
+
+        def sweep(parse, bytez):
+            count = 0
+            offset = 0
+            start = time.time()
+            while offset < len(bytez) - 16:
+                try:
+                    op = parse(bytez, offset, offset)
+                    offset += op.size
+                except Exception:
+                    offset += 1
+                count += 1
+            return count / max(time.time() - start, 0.000001)
+
+        generic = sweep(dis._dis_generic, bytez)
+        fast = sweep(dis.disasm, bytez)
+        print('i386 disasm (random): generic %d ops/sec fast %d ops/sec' % (generic, fast))
+
+        generic = sweep(dis._dis_generic, code * 400)
+        fast = sweep(dis.disasm, code * 400)
+        print('i386 disasm (code): generic %d ops/sec fast %d ops/sec' % (generic, fast))
+
+    def test_envi_i386_parseopcodes(self):
+        import random
+        rand = random.Random(0x386)
+        bytez = ''.join([chr(rand.randint(0, 255)) for i in range(0x1000)])
+
+        offset = 0
+        for va, size, op in self._arch.archParseOpcodes(bytez, 0, 0x1000):
+            self.assertEqual(va, 0x1000 + offset)
+            try:
+                sop = self._arch.archParseOpcode(bytez, offset, va)
+            except Exception:
+                sop = None
+            self.assertEqual(repr(op), repr(sop))
+            offset += size
+
+        self.assertEqual(offset, len(bytez))
@@ -0,0 +1,85 @@
+import os
+import time
+import random
+import unittest
+
+import envi.bytesig as e_bytesig
+import vivisect.vamp.msvc as v_msvc
+import vivisect.analysis.i386 as viv_i386
+
+def bruteScan(sigtree, bytez):
+    # One getSignature() call per offset
+    ret = []
+    for i in xrange(len(bytez)):
+        try:
+            val = sigtree.getSignature(bytez, i)
+        except IndexError:
+            continue
+        if val != None:
+            ret.append((i, val))
+    return ret
+
+def i386Tree():
+    sigtree = e_bytesig.SignatureTree()
+    for sigstr, maskstr in viv_i386.sigs:
+        sigtree.addSignature(sigstr.decode('hex'), maskstr.decode('hex'), val=sigstr)
+    return sigtree
+
+def randomCode(size, sigs):
+    rand = random.Random(0x558bec)
+    parts = []
+    while size > 0:
+        parts.append(''.join([ chr(rand.randint(0, 255)) for i in xrange(rand.randint(1, 200)) ]))
+        parts.append(rand.choice(sigs))
+        size -= len(parts[-1]) + len(parts[-2])
+    return ''.join(parts)
+
+class EnviByteSigTest(unittest.TestCase):
+
+    def test_envi_bytesig_scan(self):
+        sigtree = i386Tree()
+        bytez = randomCode(0x10000, [ s.decode('hex') for s, m in viv_i386.sigs ] + [ '\x6a\x41\x68ABCD\xe8' ])
+
+        scanned = list(sigtree.scanSignatures(bytez))
+        self.assertTrue( len(scanned) > 100 )
+        self.assertEqual( scanned, bruteScan(sigtree, bytez) )
+
+        # Offsets and an end offset
+        self.assertEqual( list(sigtree.scanSignatures(bytez, 100, 2000)),
+                          [ t for t in bruteScan(sigtree, bytez[:2000]) if t[0] >= 100 ] )
+        self.assertEqual( list(sigtree.scanSignatures('\x55\x8b\xec', 0, 2)), [] )
+        self.assertEqual( list(sigtree.scanSignatures('\x90\x55\x8b\xec')), [ (1, '558bec') ] )
+
+    def test_envi_bytesig_scan_values(self):
+        msvc = v_msvc.VisualStudioVamp()
+        sigs = [ s.decode('hex') for s, m, n in v_msvc.sigs ]
+        bytez = randomCode(0x4000, sigs)
+
+        scanned = list(msvc.scanSignatures(bytez))
+        self.assertEqual( scanned, bruteScan(msvc, bytez) )
+
+        # Signatures added later must recompile the scanner
+        msvc.addSignature('\xcc\xcc\xcc\xcc', val='int3')
+        self.assertEqual( list(msvc.scanSignatures('\x90\xcc\xcc\xcc\xcc')), [ (1, 'int3') ] )
+
+        # Masks may make a signature impossible
+        sigtree = e_bytesig.SignatureTree()
+        sigtree.addSignature('\x41', '\x0f')
+        self.assertEqual( list(sigtree.scanSignatures('\x41\x01')), [] )
+        self.assertEqual( list(e_bytesig.SignatureTree().scanSignatures('\x41')), [] )
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_envi_bytesig_bench(self):
+        sigtree = i386Tree()
+        bytez = randomCode(0x40000, [ s.decode('hex') for s, m in viv_i386.sigs ])
+
+        start = time.time()
+        brute = bruteScan(sigtree, bytez)
+        brutetime = time.time() - start
+
+        start = time.time()
+        scanned = list(sigtree.scanSignatures(bytez))
+        scantime = time.time() - start
+
+        self.assertEqual( scanned, brute )
+        print('bytesig 256k: getSignature %.3fs scan %.3fs' % (brutetime, scantime))
@@ -0,0 +1,84 @@
+import struct
+import unittest
+
+import envi
+import envi.memory as e_mem
+import envi.codeflow as e_codeflow
+
+class TestMemory(e_mem.MemoryObject):
+
+    def isFunction(self, va):
+        return False
+
+class TestCodeFlow(e_codeflow.CodeFlowContext):
+
+    def __init__(self, mem):
+        e_codeflow.CodeFlowContext.__init__(self, mem)
+        self.fvas = []
+
+    def _cb_function(self, fva, fmeta):
+        self.fvas.append(fva)
+
+def getCallChain(count, base=0x41410000):
+    '''
+    Build a memory object with a chain of count functions which
+    each call the next one ( "call <next>; ret" in 8 bytes ).
+    '''
+    bytez = ''
+    for i in xrange(count - 1):
+        bytez += '\xe8' + struct.pack('<i', 3) + '\xc3\xcc\xcc'
+    bytez += '\xc3' + ('\xcc' * 16)
+
+    mem = TestMemory(arch=envi.ARCH_I386)
+    mem.addMemoryMap(base, e_mem.MM_RWX, 'code', bytez)
+    return mem
+
+class CodeFlowTest(unittest.TestCase):
+
+    def test_envi_codeflow_deep(self):
+        # Deeper than the python recursion limit
+        base = 0x41410000
+        mem = getCallChain(5000, base=base)
+        cf = TestCodeFlow(mem)
+        cf.addEntryPoint(base)
+
+        # deepest function callbacks come first
+        fvas = [ base + (i * 8) for i in xrange(5000) ]
+        fvas.reverse()
+        self.assertEqual(cf.fvas, fvas)
+        self.assertEqual(cf.getCallsFrom(base), [ base + 8 ])
+        self.assertEqual(cf._cf_blocks, {})
+
+    def test_envi_codeflow_codeflow(self):
+        base = 0x41410000
+        mem = getCallChain(3, base=base)
+        cf = TestCodeFlow(mem)
+        self.assertEqual(cf.addCodeFlow(base), [ base + 8 ])
+        self.assertEqual(cf.fvas, [ base + 16, base + 8 ])
+
+    def test_envi_codeflow_prio(self):
+        base = 0x41410000
+        mem = TestMemory(arch=envi.ARCH_I386)
+        mem.addMemoryMap(base, e_mem.MM_RWX, 'code', '\xc3' * 24)
+
+        prio = { base + 3:10, base + 6:5 }
+        cf = TestCodeFlow(mem)
+        cf.addEntryPoints([ base + i for i in xrange(8) ], prio=lambda va: prio.get(va, 0))
+        self.assertEqual(cf.fvas, [ base + 3, base + 6, base, base + 1, base + 2, base + 4, base + 5, base + 7 ])
+
+    def test_envi_codeflow_deref(self):
+        # call [ptr] ; ret  ( ptr -> ret )
+        base = 0x41410000
+        bytez = '\xff\x15' + struct.pack('<I', base + 16) + '\xc3'
+        bytez = bytez.ljust(16, '\xcc') + struct.pack('<I', base + 32)
+        bytez = bytez.ljust(32, '\xcc') + '\xc3' + ('\xcc' * 15)
+
+        mem = TestMemory(arch=envi.ARCH_I386)
+        mem.addMemoryMap(base, e_mem.MM_RWX, 'code', bytez)
+        mem.psize = 4
+
+        cf = TestCodeFlow(mem)
+        cf.addEntryPoint(base)
+        self.assertEqual(cf.fvas, [ base + 32, base ])
+        self.assertEqual(cf.getCallsFrom(base), [ base + 32 ])
+        self.assertEqual(cf._cf_blocks, {})
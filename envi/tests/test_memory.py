@@ -1,5 +1,8 @@
+import os
+import time
 import unittest
 
+import envi
 import envi.memory as e_mem
 
 class EnviMemoryTest(unittest.TestCase):
@@ -18,3 +21,202 @@ class EnviMemoryTest(unittest.TestCase):
         self.assertEqual(mem.readMemory(0x41410040, 3), 'BBB')
         # Test a cross page read
         self.assertEqual(mem.readMemory(0x41410000 + (cache.pagesize - 2), 4), 'BBBB')
+
+    def test_envi_memory_mapindex(self):
+        mem = e_mem.MemoryObject()
+        # add them out of order to make sure the index sorts
+        for i in reversed(xrange(10000)):
+            mem.addMemoryMap(0x10000 + (i * 0x2000), e_mem.MM_RWX, 'map%d' % i, chr(i & 0xff) * 0x1000)
+
+        self.assertEqual(mem.getMemoryMap(0x10000), (0x10000, 0x1000, e_mem.MM_RWX, 'map0'))
+        self.assertEqual(mem.getMemoryMap(0x10fff)[3], 'map0')
+        self.assertIsNone(mem.getMemoryMap(0x11000))
+        self.assertIsNone(mem.getMemoryMap(0xffff))
+        self.assertEqual(mem.getMemoryMap(0x10000 + (9999 * 0x2000) + 10)[3], 'map9999')
+        self.assertIsNone(mem.getMemoryMap(0x10000 + (10000 * 0x2000)))
+
+        self.assertEqual(mem.readMemory(0x10000 + (300 * 0x2000), 4), chr(300 & 0xff) * 4)
+        self.assertRaises(envi.SegmentationViolation, mem.readMemory, 0x11000, 4)
+
+        mem.writeMemory(0x10000 + (5000 * 0x2000) + 10, 'VISI')
+        off, bytez = mem.getByteDef(0x10000 + (5000 * 0x2000) + 8)
+        self.assertEqual(bytez[off:off+6], chr(5000 & 0xff) * 2 + 'VISI')
+
+        # the index must survive a snapshot round trip
+        snap = mem.getMemorySnap()
+        mem.writeMemory(0x10000 + 10, 'QQQQ')
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x10000 + 10, 4), '\x00' * 4)
+        self.assertEqual(mem.readMemory(0x10000 + (5000 * 0x2000) + 10, 4), 'VISI')
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_envi_memory_mapindex_bench(self):
+
+        def lookups(mapcount):
+            mem = e_mem.MemoryObject()
+            for i in xrange(mapcount):
+                mem.addMemoryMap(i * 0x2000, e_mem.MM_RWX, 'map%d' % i, 'A' * 0x1000)
+
+            vas = [ (i % mapcount) * 0x2000 + 4 for i in xrange(0, 20000, 7) ]
+            start = time.time()
+            for va in vas:
+                mem.getMemoryMap(va)
+                mem.readMemory(va, 4)
+            return time.time() - start
+
+        small = lookups(10)
+        large = lookups(10000)
+
+        # A linear map scan would be ~1000x slower with 10k maps
+        print('map lookups: 10 maps %.3fs 10000 maps %.3fs' % (small, large))
+
+    def test_envi_memory_pages(self):
+        mem = e_mem.MemoryObject()
+        mem.addMemoryMap(0x41410000, e_mem.MM_RWX, 'stack', 'B'*16384)
+
+        # cross page write
+        mem.writeMemory(0x41410ffe, 'VISI')
+        self.assertEqual(mem.readMemory(0x41410ffc, 8), 'BBVISIBB')
+
+        off, bytez = mem.getByteDef(0x41410ffe)
+        self.assertEqual(len(bytez), 16384)
+        self.assertEqual(bytez[off:off+4], 'VISI')
+
+        # later writes are done in place ( and seen through the bytes
+        # from getByteDef ) rather than re-joining the map
+        flat = mem._getMapDef(0x41410000)[3]._flat
+        mem.writeMemory(0x41412002, 'QQ')
+        mem.writeMemory(0x41413ffe, 'RR')
+        self.assertEqual(bytez[0x2000:0x2004], 'BBQQ')
+        off, bytez = mem.getByteDef(0x41410000)
+        self.assertEqual(len(bytez), 16384)
+        self.assertEqual(str(bytez), 'B' * 0xffe + 'VISI' + 'B' * 0x1000 + 'QQ' + 'B' * 0x1ffa + 'RR')
+        self.assertTrue(mem.getByteDef(0x41410000)[1] is bytez)
+        self.assertTrue(mem._getMapDef(0x41410000)[3]._flat is flat)
+        self.assertEqual(mem.readMemory(0x41412000, 4), 'BBQQ')
+
+        # a "rep stosb" style write into the whole map
+        for i in xrange(0, 16384, 4):
+            mem.writeMemory(0x41410000 + i, 'AAAA')
+        self.assertEqual(mem.readMemory(0x41410000, 16384), 'A' * 16384)
+
+    def test_envi_memory_pages_snap(self):
+        mem = e_mem.MemoryObject()
+        mem.addMemoryMap(0x41410000, e_mem.MM_RWX, 'stack', 'B'*16384)
+        mem.writeMemory(0x41410000, 'AAAA')
+
+        snap = mem.getMemorySnap()
+        mem.writeMemory(0x41410000, 'CCCC')
+        mem.writeMemory(0x41412000, 'DDDD')
+        self.assertEqual(mem.readMemory(0x41410000, 4), 'CCCC')
+
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x41410000, 4), 'AAAA')
+        self.assertEqual(mem.readMemory(0x41412000, 4), 'BBBB')
+
+        # restoring twice must not leak writes into the snapshot
+        mem.writeMemory(0x41410000, 'EEEE')
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x41410000, 4), 'AAAA')
+
+    def test_envi_memory_snap_dirty(self):
+        mem = e_mem.MemoryObject()
+        for i in xrange(100):
+            mem.addMemoryMap(0x10000 * i, e_mem.MM_RWX, 'map%d' % i, 'B'*16384)
+
+        mem.writeMemory(0x20004, 'AAAA')
+        snap = mem.getMemorySnap()
+
+        # only the touched page of the touched map is carried by the snapshot
+        mdefs, mgen, dirty = snap
+        self.assertEqual(len(dirty), 1)
+        self.assertEqual([ off for off, bytez in dirty[0][1].getDirtyPages() ], [0])
+
+        mem.writeMemory(0x30004, 'CCCC')
+        mem.writeMemory(0x20004, 'DDDD')
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x20000, 8), 'BBBBAAAA')
+        self.assertEqual(mem.readMemory(0x30000, 8), 'BBBBBBBB')
+
+        # a snap still restores after new maps are added
+        mem.addMemoryMap(0x41410000, e_mem.MM_RWX, 'new', 'Q'*16)
+        mem.writeMemory(0x20004, 'EEEE')
+        mem.setMemorySnap(snap)
+        self.assertIsNone(mem.getMemoryMap(0x41410000))
+        self.assertEqual(mem.readMemory(0x20000, 8), 'BBBBAAAA')
+
+        # and into a different memory object
+        mem2 = e_mem.MemoryObject()
+        mem2.setMemorySnap(snap)
+        self.assertEqual(mem2.readMemory(0x20000, 8), 'BBBBAAAA')
+        mem2.writeMemory(0x20000, 'FFFF')
+        self.assertEqual(mem.readMemory(0x20000, 8), 'BBBBAAAA')
+
+    def test_envi_memory_snap_addmap(self):
+        mem = e_mem.MemoryObject()
+        mem.addMemoryMap(0x1000, e_mem.MM_RWX, 'old', 'B'*16)
+        mem.writeMemory(0x1000, 'AA')
+        snap = mem.getMemorySnap()
+
+        # adding a map must not change the snapshot
+        mem.addMemoryMap(0x2000, e_mem.MM_RWX, 'new', 'Q'*16)
+        mem.writeMemory(0x1000, 'CC')
+        self.assertEqual(len(snap[0]), 1)
+
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.getMemoryMaps(), [ (0x1000, 16, e_mem.MM_RWX, 'old') ])
+        self.assertIsNone(mem.getMemoryMap(0x2000))
+        self.assertEqual(mem.readMemory(0x1000, 4), 'AABB')
+
+        # once restored the maps match again ( and only writes revert )
+        mem.writeMemory(0x1000, 'DD')
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x1000, 4), 'AABB')
+        self.assertEqual(len(mem.getMemoryMaps()), 1)
+
+    def test_envi_memory_write_past_end(self):
+        mem = e_mem.MemoryObject()
+        mem.addMemoryMap(0x1000, e_mem.MM_RWX, 'small', 'B'*16)
+        mem.writeMemory(0x100e, 'VISI')
+        self.assertEqual(mem.readMemory(0x100c, 8), 'BBVISI')
+
+        # a snapshot must revert writes which grew the map
+        mem = e_mem.MemoryObject()
+        mem.addMemoryMap(0x1000, e_mem.MM_RWX, 'small', 'B'*16)
+        snap = mem.getMemorySnap()
+        mem.writeMemory(0x100e, 'VISI')
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x1000, 20), 'B'*16)
+
+        mem.writeMemory(0x1000, 'AA')
+        snap = mem.getMemorySnap()
+        mem.writeMemory(0x100e, 'VISI')
+        self.assertEqual(str(mem.getByteDef(0x1000)[1]), 'AA' + 'B'*12 + 'VISI')
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x1000, 20), 'AA' + 'B'*14)
+
+    def test_envi_memory_parseopcodes(self):
+        mem = e_mem.MemoryObject(arch=envi.ARCH_I386)
+        # push ebp; mov ebp,esp; xor eax,eax; ret; <invalid>
+        code = '55' '89e5' '31c0' 'c3' 'ffff'
+        mem.addMemoryMap(0x41410000, e_mem.MM_RWX, 'code', code.decode('hex'))
+
+        ops = list(mem.parseOpcodes(0x41410000))
+        self.assertEqual([(va, size) for va, size, op in ops],
+                         [(0x41410000, 1), (0x41410001, 2), (0x41410003, 2),
+                          (0x41410005, 1), (0x41410006, 1), (0x41410007, 1)])
+        self.assertEqual(repr(ops[2][2]), 'xor eax,eax')
+        self.assertEqual(ops[4][2], None)
+        self.assertEqual(ops[5][2], None)
+
+        for va, size, op in ops:
+            if op != None:
+                self.assertEqual(op, mem.parseOpcode(va))
+
+        ops = list(mem.parseOpcodes(0x41410000, count=2))
+        self.assertEqual([repr(op) for va, size, op in ops], ['push ebp', 'mov ebp,esp'])
+
+        ops = list(mem.parseOpcodes(0x41410001, endva=0x41410003))
+        self.assertEqual([repr(op) for va, size, op in ops], ['mov ebp,esp'])
+
+        self.assertEqual(list(mem.parseOpcodes(0x51410000)), [])
@@ -0,0 +1,95 @@
+import unittest
+
+import envi.pagelookup as e_page
+
+class EnviPageLookupTest(unittest.TestCase):
+
+    def test_envi_intervallookup_basic(self):
+        lkup = e_page.IntervalLookup()
+        lkup.initMapLookup(0x41410000, 0x1000)
+        lkup.initMapLookup(0x10000, 0x100)
+
+        self.assertIsNone(lkup.getMapLookup(0x41410000))
+        self.assertRaises(Exception, lkup.setMapLookup, 0x20000, 4, 'nope')
+
+        lkup.setMapLookup(0x41410010, 4, 'a')
+        lkup.setMapLookup(0x41410020, 8, 'b')
+
+        self.assertIsNone(lkup.getMapLookup(0x4141000f))
+        self.assertEqual(lkup.getMapLookup(0x41410010), 'a')
+        self.assertEqual(lkup.getMapLookup(0x41410013), 'a')
+        self.assertIsNone(lkup.getMapLookup(0x41410014))
+        self.assertEqual(lkup.getMapLookup(0x41410027), 'b')
+        self.assertEqual(len(lkup), 2)
+
+        lkup.setMapLookup(0x41410020, 8, None)
+        self.assertIsNone(lkup.getMapLookup(0x41410020))
+        self.assertEqual(len(lkup), 1)
+
+    def test_envi_intervallookup_overlap(self):
+        lkup = e_page.IntervalLookup()
+        lkup.initMapLookup(0x1000, 0x1000)
+
+        # Overwrite the middle of a range like the per-byte lookup would
+        lkup.setMapLookup(0x1000, 16, 'a')
+        lkup.setMapLookup(0x1004, 4, 'b')
+
+        self.assertEqual(lkup.getMapLookup(0x1003), 'a')
+        self.assertEqual(lkup.getMapLookup(0x1004), 'b')
+        self.assertEqual(lkup.getMapLookup(0x1008), 'a')
+        self.assertEqual(lkup.getMapLookup(0x100f), 'a')
+
+        ranges = list(lkup.iterMapLookups(0x1000, 0x100))
+        self.assertEqual(ranges, [(0x1000, 0x1004, 'a'),
+                                  (0x1004, 0x1008, 'b'),
+                                  (0x1008, 0x1010, 'a')])
+
+        # Span several ranges with a single set
+        lkup.setMapLookup(0x1002, 8, 'c')
+        ranges = list(lkup.iterMapLookups(0x1000, 0x100))
+        self.assertEqual(ranges, [(0x1000, 0x1002, 'a'),
+                                  (0x1002, 0x100a, 'c'),
+                                  (0x100a, 0x1010, 'a')])
+
+    def test_envi_intervallookup_prev(self):
+        lkup = e_page.IntervalLookup()
+        lkup.initMapLookup(0x1000, 0x1000)
+
+        lkup.setMapLookup(0x1010, 4, 'a')
+        lkup.setMapLookup(0x1020, 4, 'b')
+
+        self.assertIsNone(lkup.getPrevMapLookup(0x100f))
+        self.assertEqual(lkup.getPrevMapLookup(0x1010), 'a')
+        self.assertEqual(lkup.getPrevMapLookup(0x101f), 'a')
+        self.assertEqual(lkup.getPrevMapLookup(0x1800), 'b')
+
+        self.assertEqual(list(lkup.iterMapLookups(0x1012, 0x10)), [(0x1010, 0x1014, 'a'), (0x1020, 0x1024, 'b')])
+        self.assertEqual(list(lkup.iterMapLookups(0x1014, 0xc)), [])
+
+    def test_envi_intervallookup_gaps(self):
+        lkup = e_page.IntervalLookup()
+        lkup.initMapLookup(0x1000, 0x100)
+        lkup.initMapLookup(0x3000, 0x10)
+
+        self.assertEqual(list(lkup.iterMapGaps()), [(0x1000, 0x1100), (0x3000, 0x3010)])
+
+        lkup.setMapLookup(0x1000, 4, 'a')
+        lkup.setMapLookup(0x1010, 4, 'b')
+        lkup.setMapLookup(0x1014, 4, 'c')
+        lkup.setMapLookup(0x3000, 0x10, 'd')
+        self.assertEqual(list(lkup.iterMapGaps()), [(0x1004, 0x1010), (0x1018, 0x1100)])
+
+        # Clipped to the requested range
+        self.assertEqual(list(lkup.iterMapGaps(0x1008, 0x10)), [(0x1008, 0x1010)])
+        self.assertEqual(list(lkup.iterMapGaps(0x3000, 0x10)), [])
+
+        # Removing ranges merges the gaps back together
+        lkup.setMapLookup(0x1010, 4, None)
+        self.assertEqual(list(lkup.iterMapGaps(0x1000, 0x100)), [(0x1004, 0x1014), (0x1018, 0x1100)])
+        lkup.setMapLookup(0x1014, 4, None)
+        lkup.setMapLookup(0x1000, 2, None)
+        self.assertEqual(list(lkup.iterMapGaps(0x1000, 0x100)), [(0x1000, 0x1002), (0x1004, 0x1100)])
+
+        # Overwriting a range changes nothing
+        lkup.setMapLookup(0x1002, 2, 'e')
+        self.assertEqual(list(lkup.iterMapGaps(0x1000, 0x100)), [(0x1000, 0x1002), (0x1004, 0x1100)])
@@ -0,0 +1,514 @@
+'''
+Visgraph supports backing the graph objects with a (file based) sqlite db.
+
+This implements the same API as visgraph.dbcore.DbGraphStore but needs no
+database server.
+
+Example:
+    import visgraph.dbsqlite as vg_dbsqlite
+
+    g = vg_dbsqlite.SqliteGraphStore('callgraph.db')
+    n1, n2 = g.addNodes([ {'name':'main'}, {'name':'printf'} ])
+    g.addEdge(n1, n2, einfo={'type':'call'})
+'''
+
+import sqlite3
+import collections
+import visgraph.graphcore as vg_graphcore
+
+init_db = '''
+    CREATE TABLE IF NOT EXISTS vg_edges (
+        eid     INTEGER PRIMARY KEY AUTOINCREMENT,
+        n1      INTEGER,
+        n2      INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS vg_edges_idx_n1 ON vg_edges (n1);
+    CREATE INDEX IF NOT EXISTS vg_edges_idx_n2 ON vg_edges (n2);
+
+    CREATE TABLE IF NOT EXISTS vg_edge_props (
+        eid     INTEGER NOT NULL,
+        pname   TEXT NOT NULL,
+        intval  INTEGER,
+        strval  TEXT,
+        PRIMARY KEY (eid, pname)
+    );
+    CREATE INDEX IF NOT EXISTS vg_edge_pname_intval ON vg_edge_props (pname, intval);
+    CREATE INDEX IF NOT EXISTS vg_edge_pname_strval ON vg_edge_props (pname, strval);
+
+    CREATE TABLE IF NOT EXISTS vg_nodes (
+        nid     INTEGER PRIMARY KEY AUTOINCREMENT
+    );
+
+    CREATE TABLE IF NOT EXISTS vg_node_props (
+        nid     INTEGER NOT NULL,
+        pname   TEXT NOT NULL,
+        intval  INTEGER,
+        strval  TEXT,
+        PRIMARY KEY (nid, pname)
+    );
+    CREATE INDEX IF NOT EXISTS vg_node_pname_intval ON vg_node_props (pname, intval);
+    CREATE INDEX IF NOT EXISTS vg_node_pname_strval ON vg_node_props (pname, strval);
+'''
+
+drop_db = '''
+    DROP TABLE IF EXISTS vg_edges;
+    DROP TABLE IF EXISTS vg_edge_props;
+    DROP TABLE IF EXISTS vg_nodes;
+    DROP TABLE IF EXISTS vg_node_props;
+'''
+
+# Stay well under the sqlite limit on variables per statement
+maxvars = 500
+
+def initGraphDb(dbpath):
+    '''
+    (Re)initialize an empty graph database in the given file.
+    '''
+    db = sqlite3.connect(dbpath)
+    db.executescript(drop_db)
+    db.executescript(init_db)
+    db.commit()
+    db.close()
+
+def _propVals(value):
+    # Return the (intval, strval) columns for a property value
+    if isinstance(value, bool):
+        value = int(value)
+
+    if isinstance(value, int) or isinstance(value, long):
+        return value, None
+
+    return None, value
+
+def _chunks(vals):
+    vals = list(vals)
+    for i in xrange(0, len(vals), maxvars):
+        yield vals[i:i+maxvars]
+
+class SqliteGraphStore:
+    '''
+    A SqliteGraphStore object may be used for all the standard management
+    of node and edge information but may not be used for path queries.
+
+    Use the buildSubGraph() API to pull path serchable graphs out of
+    the SqliteGraphStore.
+
+    NOTE: set autocommit = False ( and call commit() ) or use the
+          addNodes() / addEdges() APIs for large numbers of inserts.
+    '''
+    def __init__(self, dbpath=':memory:', db=None):
+
+        if db == None:
+            db = sqlite3.connect(dbpath)
+            db.text_factory = str
+            db.execute('PRAGMA synchronous=NORMAL')
+            if dbpath != ':memory:':
+                db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(init_db)
+            db.commit()
+
+        self.dbpath = dbpath
+        self.db = db
+        self.autocommit = True
+
+    def _doSelect(self, query, *args):
+        return self.db.execute(query, args).fetchall()
+
+    def _doInsert(self, query, *args):
+        self.db.execute(query, args)
+        if self.autocommit:
+            self.db.commit()
+
+    def _doCommit(self):
+        self.db.commit()
+
+    def commit(self):
+        '''
+        Commit any changes made while autocommit is False.
+        '''
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def addNode(self, nodeid=None, ninfo=None, **kwargs):
+        if nodeid != None:
+            raise Exception('SqliteGraphStore Manages nodeid!')
+
+        if ninfo != None:
+            kwargs.update(ninfo)
+
+        return self.addNodes([ kwargs, ])[0]
+
+    def addNodes(self, ninfos):
+        '''
+        Add a node for each of the given property dicts ( in a single
+        transaction ) and return the list of new node ids.
+
+        Example:
+            nids = g.addNodes([ {'name':'foo'}, {'name':'bar'} ])
+        '''
+        nids = []
+        props = []
+
+        c = self.db.cursor()
+        for ninfo in ninfos:
+            c.execute('INSERT INTO vg_nodes DEFAULT VALUES')
+            nid = c.lastrowid
+            nids.append(nid)
+            for key,val in ninfo.items():
+                intval, strval = _propVals(val)
+                props.append( (nid, key, intval, strval) )
+
+        q = 'INSERT OR REPLACE INTO vg_node_props (nid, pname, intval, strval) VALUES (?,?,?,?)'
+        c.executemany(q, props)
+        c.close()
+
+        if self.autocommit:
+            self.db.commit()
+
+        return nids
+
+    def delEdge(self, eid):
+        '''
+        Delete an edge from the graph database.
+
+        Example: g.delEdge(eid)
+        '''
+        self.db.execute('DELETE FROM vg_edge_props WHERE eid = ?', (eid,))
+        self._doInsert('DELETE FROM vg_edges WHERE eid = ?', eid)
+
+    def delNode(self, nid):
+        '''
+        Delete the given node (and his edges) from the graph dbase.
+
+        Example: g.delNode(nid)
+
+        NOTE: this will delete any edges which go to or from nid!
+        '''
+        q = '''
+        DELETE FROM
+            vg_edge_props
+        WHERE
+            eid IN (SELECT eid FROM vg_edges WHERE n1 = ? OR n2 = ?)
+        '''
+        self.db.execute(q, (nid, nid))
+        self.db.execute('DELETE FROM vg_edges WHERE n1 = ? OR n2 = ?', (nid, nid))
+        self.db.execute('DELETE FROM vg_node_props WHERE nid = ?', (nid,))
+        self._doInsert('DELETE FROM vg_nodes WHERE nid = ?', nid)
+
+    def setNodeProp(self, nid, pname, value):
+        intval, strval = _propVals(value)
+        q = 'INSERT OR REPLACE INTO vg_node_props (nid, pname, intval, strval) VALUES (?,?,?,?)'
+        self._doInsert(q, nid, pname, intval, strval)
+
+    def getNodeProp(self, nid, pname, default=None):
+        q = 'SELECT intval,strval FROM vg_node_props WHERE nid=? AND pname=?'
+        res = self._doSelect(q, nid, pname)
+        if len(res) == 0:
+            return default
+        intval, strval = res[0]
+        if intval != None:
+            return intval
+        return strval
+
+    def delNodeProp(self, nid, pname):
+        q = 'DELETE FROM vg_node_props WHERE nid=? AND pname=?'
+        self._doInsert(q, nid, pname)
+
+    def getNodeProps(self, nid):
+        ret = {}
+        q = 'SELECT pname,intval,strval FROM vg_node_props WHERE nid=?'
+        for pname,intval,strval in self._doSelect(q, nid):
+            if intval != None:
+                ret[pname] = intval
+            else:
+                ret[pname] = strval
+        return ret
+
+    def getNodesProps(self, nids):
+        ret = collections.defaultdict(dict)
+        q = 'SELECT nid,pname,intval,strval FROM vg_node_props WHERE nid IN (%s)'
+        for chunk in _chunks(nids):
+            cq = q % ','.join( ['?',] * len(chunk) )
+            for nid,pname,intval,strval in self._doSelect(cq, *chunk):
+                if intval != None:
+                    ret[nid][pname] = intval
+                else:
+                    ret[nid][pname] = strval
+        return ret.items()
+
+    def addEdge(self, fromid, toid, eid=None, einfo=None):
+        if eid != None:
+            raise Exception('SqliteGraphStore Manages eid!')
+        return self.addEdges([ (fromid, toid, einfo), ])[0]
+
+    def addEdges(self, edges):
+        '''
+        Add a list of (fromid, toid, einfo) edges ( in a single
+        transaction ) and return the list of new edge ids.
+
+        Example:
+            eids = g.addEdges([ (n1, n2, {'type':'call'}), (n2, n3, None) ])
+        '''
+        eids = []
+        props = []
+
+        c = self.db.cursor()
+        for fromid, toid, einfo in edges:
+            if fromid == None:
+                raise Exception('Invalid from id (None)!')
+            if toid == None:
+                raise Exception('Invalid to id (None)!')
+
+            c.execute('INSERT INTO vg_edges (n1, n2) VALUES (?, ?)', (fromid, toid))
+            eid = c.lastrowid
+            eids.append(eid)
+            if einfo != None:
+                for key,val in einfo.items():
+                    intval, strval = _propVals(val)
+                    props.append( (eid, key, intval, strval) )
+
+        q = 'INSERT OR REPLACE INTO vg_edge_props (eid, pname, intval, strval) VALUES (?,?,?,?)'
+        c.executemany(q, props)
+        c.close()
+
+        if self.autocommit:
+            self.db.commit()
+
+        return eids
+
+    def _getRefs(self, col, nids):
+        q = '''
+        SELECT
+            vg_edges.eid, vg_edges.n1, vg_edges.n2,
+            vg_edge_props.pname, vg_edge_props.intval, vg_edge_props.strval
+        FROM
+            vg_edges
+        LEFT JOIN
+            vg_edge_props
+        ON
+            vg_edges.eid = vg_edge_props.eid
+        WHERE
+            vg_edges.%s IN (%s)
+        '''
+        refs = collections.OrderedDict()
+        for chunk in _chunks(nids):
+            cq = q % (col, ','.join( ['?',] * len(chunk) ))
+            for eid, n1, n2, pname, intval, strval in self._doSelect(cq, *chunk):
+                r = refs.get(eid)
+                if r == None:
+                    r = (eid, n1, n2, {})
+                    refs[eid] = r
+
+                # edges with no props at all
+                if pname == None:
+                    continue
+
+                if intval != None:
+                    r[3][pname] = intval
+                else:
+                    r[3][pname] = strval
+
+        return refs.values()
+
+    def getRefsFrom(self, nodeid):
+        '''
+        Return a list of edges which originate with us.
+
+        Example: for eid, fromid, toid, einfo in g.getRefsFrom(id)
+        '''
+        return self._getRefs('n1', [ nodeid, ])
+
+    def getRefsTo(self, nodeid):
+        '''
+        Return a list of edges which we reference.
+
+        Example: for eid, fromid, toid, einfo in g.getRefsTo(id)
+        '''
+        return self._getRefs('n2', [ nodeid, ])
+
+    def getRefsFromBulk(self, nids):
+        '''
+        Return a list of edges which originate with us.
+        Supply a list of edges to get refs.
+
+        Example: for eid, fromid, toid, einfo in g.getRefsFromBulk(nids)
+        '''
+        return self._getRefs('n1', nids)
+
+    def getRefsToBulk(self, nids):
+        '''
+        Return a list of edges which we reference.
+        Supply a list of edges to gets refs.
+
+        Example: for eid, fromid, toid, einfo in g.getRefsToBulk(nids)
+        '''
+        return self._getRefs('n2', nids)
+
+    def setEdgeProp(self, eid, pname, value):
+        intval, strval = _propVals(value)
+        q = 'INSERT OR REPLACE INTO vg_edge_props (eid, pname, intval, strval) VALUES (?,?,?,?)'
+        self._doInsert(q, eid, pname, intval, strval)
+
+    def getEdgeProp(self, eid, pname, default=None):
+        q = 'SELECT intval,strval FROM vg_edge_props WHERE eid=? AND pname=?'
+        res = self._doSelect(q, eid, pname)
+        if len(res) == 0:
+            return default
+        intval, strval = res[0]
+        if intval != None:
+            return intval
+        return strval
+
+    def getEdge(self, eid):
+        '''
+        Get the edge tuple ( eid, n1, n2, nprops ) for the given edge by id.
+        '''
+        q = 'SELECT eid,n1,n2 FROM vg_edges WHERE eid=?'
+        res = self._doSelect( q, eid )
+        if not res:
+            raise Exception('Invalid Edge Id: %s' % eid)
+        e,n1,n2 = res[0]
+        return (eid, n1, n2, self.getEdgeProps( eid ) )
+
+    def getEdgeProps(self, eid):
+        '''
+        Retrieve the properties dictionary for the given edge id.
+        '''
+        ret = {}
+        q = 'SELECT pname,intval,strval FROM vg_edge_props WHERE eid=?'
+        for pname,intval,strval in self._doSelect(q, eid):
+            if intval != None:
+                ret[pname] = intval
+            else:
+                ret[pname] = strval
+        return ret
+
+    def _searchProps(self, table, idcol, propname, propval):
+        if propval == None:
+            q = 'SELECT %s FROM %s WHERE pname=?' % (idcol, table)
+            return [ row[0] for row in self._doSelect(q, propname) ]
+
+        intval, strval = _propVals(propval)
+        if intval != None:
+            q = 'SELECT %s FROM %s WHERE pname=? AND intval=?' % (idcol, table)
+            return [ row[0] for row in self._doSelect(q, propname, intval) ]
+
+        q = 'SELECT %s FROM %s WHERE pname=? AND strval=?' % (idcol, table)
+        return [ row[0] for row in self._doSelect(q, propname, strval) ]
+
+    def searchNodes(self, propname, propval=None):
+        '''
+        Return a list of the nid's of nodes which have a property with
+        the following name (and optionally, value).  ( uses the property
+        indexes )
+
+        Example:
+            for nid in g.searchNodes('woot', 10)
+                print g.getNodeProp(nid, 'name')
+        '''
+        return self._searchProps('vg_node_props', 'nid', propname, propval)
+
+    def searchEdges(self, propname, propval=None):
+        '''
+        Return a list of the eid's of edges which have a property with
+        the following name (and optionally, value).
+
+        Example:
+            for eid in g.searchEdges('type', 'call')
+                eid, n1, n2, eprops = g.getEdge(eid)
+        '''
+        return self._searchProps('vg_edge_props', 'eid', propname, propval)
+
+    def getNodeCount(self):
+        return self._doSelect('SELECT COUNT(*) FROM vg_nodes')[0][0]
+
+    def getEdgeCount(self):
+        return self._doSelect('SELECT COUNT(*) FROM vg_edges')[0][0]
+
+    def buildSubGraph(self):
+        '''
+        Return a subgraph which may be used to populate from the DB and
+        do path searching.
+        '''
+        return SqliteSubGraph(self.dbpath, db=self.db)
+
+class SqliteSubGraph(SqliteGraphStore, vg_graphcore.Graph):
+
+    '''
+    A subgraph in the database is basically a forward cached instance of selected
+    nodes and edges in an in-memory graph (visgraph.graphcore.Graph).  This object
+    may then be used for traditional path tracing without going back to the database.
+
+    Nodes and edges added through the subgraph are added to the database
+    as well.
+    '''
+
+    def __init__(self, dbpath=':memory:', db=None):
+        vg_graphcore.Graph.__init__(self)
+        SqliteGraphStore.__init__(self, dbpath, db=db)
+
+    def addNode(self, nodeid=None, ninfo=None, **kwargs):
+        # Do *both*
+        nid = SqliteGraphStore.addNode(self, nodeid=nodeid, ninfo=ninfo, **kwargs)
+        if ninfo != None:
+            kwargs.update(ninfo)
+        vg_graphcore.Graph.addNode(self, nid=nid, nprops=kwargs)
+        return nid
+
+    def addEdge(self, fromid, toid, einfo=None):
+        eid = SqliteGraphStore.addEdge(self, fromid, toid, einfo=einfo)
+        eprops = {}
+        if einfo != None:
+            eprops.update(einfo)
+        self._useEdges([ (eid, fromid, toid, eprops), ])
+        return eid
+
+    def _useNode(self, nid):
+        node = vg_graphcore.Graph.getNode(self, nid)
+        if node == None:
+            node = vg_graphcore.Graph.addNode(self, nid=nid)
+        return node
+
+    def _useEdges(self, edges):
+        for eid, n1, n2, eprops in edges:
+            if vg_graphcore.Graph.hasEdge(self, eid):
+                continue
+            node1 = self._useNode(n1)
+            node2 = self._useNode(n2)
+            vg_graphcore.Graph.addEdge(self, node1, node2, eid=eid, eprops=eprops)
+
+    def useEdges(self, **kwargs):
+        '''
+        Pull some edges from the SqliteGraphStore backing this subgraph into
+        the actual visgraph.graphcore.Graph instance so path traversal is
+        possible.
+
+        Example:
+            g.useEdges(type='call')
+        '''
+        eids = set()
+        for key,val in kwargs.items():
+            eids.update( self.searchEdges(key, val) )
+
+        self._useEdges([ self.getEdge(eid) for eid in eids ])
+
+    def expandNode(self, nid, maxdepth=1):
+        '''
+        Add *all* the edges (and adjacent nodes) by traversing this nodes
+        edges to the specified depth... ( one bulk query per depth )
+        '''
+        self._useNode(nid)
+
+        done = set([nid])
+        nids = [nid]
+        for depth in xrange(maxdepth):
+            edges = self.getRefsFromBulk(nids)
+            self._useEdges(edges)
+
+            nids = [ n2 for eid, n1, n2, eprops in edges if n2 not in done ]
+            done.update(nids)
+            if not nids:
+                break
@@ -7,11 +7,20 @@ Each "leaf" node may be tracked back for it's entire path by
 tracking back to parents.
 '''
 
+class PathProps(dict):
+    '''
+    The properties dict of a path node.  The cached path counts ( see
+    getPathCounts() ) are kept here, outside of the properties.
+    '''
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.pathcounts = {}
+
 def newPathNode(parent=None, **kwargs):
     '''
     Create a new path node with the given properties
     '''
-    ret = (parent, [], kwargs)
+    ret = (parent, [], PathProps(kwargs))
     if parent != None:
         parent[1].append(ret)
     return ret
@@ -140,6 +149,60 @@ def setNodeProp(pnode, key, value):
     '''
     pnode[2][key] = value
 
+    # Drop the (now stale) path counts for key from pnode and every
+    # node below it ( a node only has counts if its parent does )
+    todo = [ pnode, ]
+    while todo:
+        node = todo.pop()
+        pcounts = getattr(node[2], 'pathcounts', None)
+        if pcounts == None or pcounts.pop(key, None) == None:
+            continue
+        todo.extend(node[1])
+
+def getPathCounts(pnode, key):
+    '''
+    Return a dict of { value: count, } for the number of times each
+    value of the given property appears in the path to pnode.
+
+    The counts are cached in each path node ( created by newPathNode() )
+    and built from the parent's counts ( which are shared as-is by nodes
+    without the property ), so loop checks while walking paths do not
+    need to walk to the root.
+
+    NOTE: the returned dict is shared, do not modify it.
+
+    Example:
+        if getPathCounts(pnode, 'nid').get(nid, 0) > 2:
+            continue
+    '''
+    todo = []
+    counts = None
+    while pnode != None:
+        props = pnode[2]
+        pcounts = getattr(props, 'pathcounts', None)
+        if pcounts == None:
+            pcounts = {}
+
+        counts = pcounts.get(key)
+        if counts != None:
+            break
+
+        todo.append( (props, pcounts) )
+        pnode = pnode[0]
+
+    if counts == None:
+        counts = {}
+
+    while todo:
+        props, pcounts = todo.pop()
+        val = props.get(key)
+        if val != None:
+            counts = dict(counts)
+            counts[val] = counts.get(val, 0) + 1
+        pcounts[key] = counts
+
+    return counts
+
 def isPathLoop(pnode, key, value):
     '''
     Assuming you have some identifier property (such as graph node id)
@@ -150,6 +213,9 @@ def isPathLoop(pnode, key, value):
         if searchPathLoop(pnode, 'nid', 5):
             continue
     '''
+    if value != None:
+        return value in getPathCounts(pnode, key)
+
     parent = pnode
     while parent != None:
         parent, kids, props = parent
@@ -163,6 +229,9 @@ def getPathLoopCount(pnode, key, value):
     many times "key" has the specified value.  This will be how many instances
     of a loop have been encountered.
     '''
+    if value != None:
+        return getPathCounts(pnode, key).get(value, 0)
+
     count = 0
     parent = pnode
     while parent != None:
@@ -0,0 +1,133 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import visgraph.dbsqlite as vg_dbsqlite
+import visgraph.graphcore as vg_graphcore
+
+class SqliteGraphStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def getDbPath(self, name='graph.db'):
+        return os.path.join(self.tmpdir, name)
+
+    def test_visgraph_dbsqlite_nodes(self):
+        g = vg_dbsqlite.SqliteGraphStore(self.getDbPath())
+
+        n1 = g.addNode(name='foo', size=10)
+        n2 = g.addNode(ninfo={'name':'bar', 'root':True})
+        self.assertNotEqual(n1, n2)
+
+        self.assertEqual(g.getNodeProps(n1), {'name':'foo', 'size':10})
+        self.assertEqual(g.getNodeProp(n2, 'root'), 1)
+        self.assertEqual(g.getNodeProp(n2, 'size', 99), 99)
+
+        g.setNodeProp(n1, 'size', 20)
+        g.setNodeProp(n1, 'name', 'baz')
+        self.assertEqual(g.getNodeProps(n1), {'name':'baz', 'size':20})
+
+        g.delNodeProp(n1, 'size')
+        self.assertEqual(g.getNodeProps(n1), {'name':'baz'})
+
+        self.assertEqual(dict(g.getNodesProps([n1, n2])), {n1:{'name':'baz'}, n2:{'name':'bar', 'root':1}})
+        self.assertEqual(g.searchNodes('name', 'bar'), [n2])
+        self.assertEqual(sorted(g.searchNodes('name')), [n1, n2])
+
+        g.close()
+
+        # persisted to the file
+        g = vg_dbsqlite.SqliteGraphStore(self.getDbPath())
+        self.assertEqual(g.getNodeProps(n2), {'name':'bar', 'root':1})
+        self.assertEqual(g.getNodeCount(), 2)
+        g.close()
+
+    def test_visgraph_dbsqlite_edges(self):
+        g = vg_dbsqlite.SqliteGraphStore()
+
+        n1, n2, n3 = g.addNodes([ {'name':'a'}, {'name':'b'}, {'name':'c'} ])
+        e1, e2, e3 = g.addEdges([ (n1, n2, {'type':'call'}), (n1, n3, None), (n2, n3, {'type':'jmp', 'count':3}) ])
+
+        self.assertEqual(g.getEdge(e1), (e1, n1, n2, {'type':'call'}))
+        self.assertEqual(g.getEdgeProp(e3, 'count'), 3)
+
+        # edges without props are still refs
+        self.assertEqual(sorted(g.getRefsFrom(n1)), [ (e1, n1, n2, {'type':'call'}), (e2, n1, n3, {}) ])
+        self.assertEqual(sorted(g.getRefsTo(n3)), [ (e2, n1, n3, {}), (e3, n2, n3, {'type':'jmp', 'count':3}) ])
+        self.assertEqual(len(g.getRefsFromBulk([n1, n2])), 3)
+        self.assertEqual(len(g.getRefsToBulk([n2, n3])), 3)
+        self.assertEqual(g.getRefsFromBulk([]), [])
+
+        g.setEdgeProp(e2, 'type', 'fall')
+        self.assertEqual(sorted(g.searchEdges('type')), [e1, e2, e3])
+        self.assertEqual(g.searchEdges('type', 'fall'), [e2])
+
+        g.delEdge(e1)
+        self.assertEqual(g.getRefsFrom(n1), [ (e2, n1, n3, {'type':'fall'}) ])
+
+        g.delNode(n3)
+        self.assertEqual(g.getRefsFromBulk([n1, n2]), [])
+        self.assertEqual(g.getEdgeCount(), 0)
+        self.assertEqual(g.getNodeCount(), 2)
+
+    def test_visgraph_dbsqlite_subgraph(self):
+        g = vg_dbsqlite.SqliteGraphStore()
+        nids = g.addNodes([ {'idx':i} for i in xrange(5) ])
+        g.addEdges([ (nids[i], nids[i+1], {'type':'next'}) for i in xrange(4) ])
+        g.addEdge(nids[0], nids[4], einfo={'type':'skip'})
+
+        sg = g.buildSubGraph()
+        sg.expandNode(nids[0], maxdepth=2)
+        self.assertEqual(sorted([ nid for nid, nprops in sg.getNodes() ]), [ nids[0], nids[1], nids[2], nids[4] ])
+
+        paths = list(sg.pathSearch(nids[0], nids[2]))
+        self.assertEqual(len(paths), 1)
+
+        sg = g.buildSubGraph()
+        sg.useEdges(type='skip')
+        self.assertEqual([ (n1, n2) for eid, n1, n2, eprops in sg.getEdges() ], [ (nids[0], nids[4]) ])
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_visgraph_dbsqlite_bench(self):
+        count = 5000
+
+        # in memory graphcore.Graph
+        start = time.time()
+        mg = vg_graphcore.Graph()
+        for i in xrange(count):
+            mg.addNode(nid=i, idx=i, name='node%d' % i)
+        for i in xrange(count - 1):
+            mg.addEdgeByNids(i, i + 1, type='next')
+        memtime = time.time() - start
+
+        # one transaction per insert
+        start = time.time()
+        g = vg_dbsqlite.SqliteGraphStore(self.getDbPath('single.db'))
+        for i in xrange(500):
+            g.addNode(idx=i, name='node%d' % i)
+        singletime = (time.time() - start) * (count / 500)
+        g.close()
+
+        start = time.time()
+        g = vg_dbsqlite.SqliteGraphStore(self.getDbPath('batch.db'))
+        nids = g.addNodes([ {'idx':i, 'name':'node%d' % i} for i in xrange(count) ])
+        g.addEdges([ (nids[i], nids[i+1], {'type':'next'}) for i in xrange(count - 1) ])
+        batchtime = time.time() - start
+
+        start = time.time()
+        refs = g.getRefsFromBulk(nids)
+        found = g.searchNodes('name', 'node%d' % (count / 2))
+        querytime = time.time() - start
+
+        self.assertEqual(len(refs), count - 1)
+        self.assertEqual(found, [ nids[count / 2] ])
+        self.assertEqual(len(mg.getEdges()), count - 1)
+        g.close()
+
+        print('graph %d nodes: memory %.3fs sqlite single %.3fs batch %.3fs query %.3fs' % (count, memtime, singletime, batchtime, querytime))
@@ -0,0 +1,112 @@
+import os
+import time
+import unittest
+
+import visgraph.pathcore as vg_pathcore
+
+def walkLoopCount(pnode, key, value):
+    # the reference ( walk to the root ) loop count
+    count = 0
+    while pnode != None:
+        if pnode[2].get(key) == value:
+            count += 1
+        pnode = pnode[0]
+    return count
+
+def enumLoopPaths(depth, loopcnt, loopcount):
+    '''
+    Enumerate the paths through a chain of depth nodes where every node
+    also loops back to the start of the chain.  Returns the path count.
+    '''
+    count = 0
+    root = vg_pathcore.newPathNode(nid=0)
+    todo = [ root, ]
+    while todo:
+        pnode = todo.pop()
+        nid = vg_pathcore.getNodeProp(pnode, 'nid')
+        if nid == depth - 1:
+            count += 1
+            vg_pathcore.trimPath(pnode)
+            continue
+
+        for tonid in (nid + 1, 0):
+            if loopcount(pnode, 'nid', tonid) > loopcnt:
+                continue
+            todo.append( vg_pathcore.newPathNode(pnode, nid=tonid) )
+
+    return count
+
+class PathCoreTest(unittest.TestCase):
+
+    def test_visgraph_pathcore_loopcount(self):
+        root = vg_pathcore.newPathNode(nid=1)
+        pnode = root
+        nids = [2, 3, 1, 4, 2, 1, 5]
+        nodes = [root, ]
+        for nid in nids:
+            pnode = vg_pathcore.newPathNode(pnode, nid=nid, eid=None)
+            nodes.append(pnode)
+
+        # a node without the key
+        pnode = vg_pathcore.newPathNode(pnode, eid=3)
+        nodes.append(pnode)
+
+        for pnode in nodes:
+            for nid in xrange(7):
+                self.assertEqual(vg_pathcore.getPathLoopCount(pnode, 'nid', nid),
+                                 walkLoopCount(pnode, 'nid', nid))
+                self.assertEqual(vg_pathcore.isPathLoop(pnode, 'nid', nid),
+                                 walkLoopCount(pnode, 'nid', nid) > 0)
+
+        self.assertEqual(vg_pathcore.getPathLoopCount(nodes[-1], 'nid', 1), 3)
+        self.assertEqual(vg_pathcore.getPathLoopCount(nodes[-1], 'eid', None), 8)
+        self.assertEqual(vg_pathcore.getPathCounts(nodes[-1], 'eid'), {3:1})
+
+        # props without the key share the parent's counts
+        self.assertIs(vg_pathcore.getPathCounts(nodes[-1], 'nid'),
+                      vg_pathcore.getPathCounts(nodes[-2], 'nid'))
+
+        # setting the prop updates the node's own counts
+        vg_pathcore.setNodeProp(nodes[-1], 'nid', 6)
+        self.assertEqual(vg_pathcore.getPathLoopCount(nodes[-1], 'nid', 6), 1)
+
+        # and the counts of the nodes below it
+        vg_pathcore.setNodeProp(root, 'nid', 6)
+        vg_pathcore.setNodeProp(nodes[3], 'nid', None)
+        for pnode in nodes:
+            for nid in xrange(7):
+                self.assertEqual(vg_pathcore.getPathLoopCount(pnode, 'nid', nid),
+                                 walkLoopCount(pnode, 'nid', nid))
+        self.assertEqual(vg_pathcore.getPathLoopCount(nodes[-1], 'nid', 6), 2)
+
+        # the counts are not props
+        self.assertEqual(root[2], {'nid':6})
+        self.assertEqual(vg_pathcore.getNodeProp(nodes[-1], '_pathcounts'), None)
+
+        # nodes built by hand just don't cache their counts
+        pnode = (nodes[-1], [], {'nid':1})
+        self.assertEqual(vg_pathcore.getPathLoopCount(pnode, 'nid', 1), 2)
+        vg_pathcore.setNodeProp(pnode, 'nid', 2)
+        self.assertEqual(vg_pathcore.getPathLoopCount(pnode, 'nid', 1), 1)
+
+    def test_visgraph_pathcore_loop_paths(self):
+        for depth, loopcnt in ( (12, 0), (12, 1), (8, 2) ):
+            fast = enumLoopPaths(depth, loopcnt, vg_pathcore.getPathLoopCount)
+            slow = enumLoopPaths(depth, loopcnt, walkLoopCount)
+            self.assertEqual(fast, slow)
+
+        self.assertEqual(fast, 57)
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_visgraph_pathcore_deep_bench(self):
+        # a deep chain makes the walk-to-root loop check quadratic
+        start = time.time()
+        slow = enumLoopPaths(150, 1, walkLoopCount)
+        slowtime = time.time() - start
+
+        start = time.time()
+        fast = enumLoopPaths(150, 1, vg_pathcore.getPathLoopCount)
+        fasttime = time.time() - start
+
+        self.assertEqual(fast, slow)
+        print('deep paths: walk %.3fs counted %.3fs' % (slowtime, fasttime))
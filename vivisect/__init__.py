@@ -10,6 +10,7 @@ import sys
 import time
 import Queue
 import string
+import bisect
 import struct
 import weakref
 import hashlib
@@ -39,6 +40,7 @@ import vstruct.cparse as vs_cparse
 import vstruct.primitives as vs_prims
 
 import vivisect.base as viv_base
+import vivisect.parallel as viv_parallel
 import vivisect.parsers as viv_parsers
 import vivisect.codegraph as viv_codegraph
 import vivisect.impemu.lookup as viv_imp_lookup
@@ -115,6 +117,9 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         # Extended *function* analysis modules
         self.fmods = {}
         self.fmodlist = []
+        # Function modules which may be run by parallel workers
+        self.fmodpar = set()
+        self._fmod_deferred = None
 
         self.chan_lookup = {}
         self.nextchanid = 1
@@ -124,6 +129,23 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         self.sigtree = e_bytesig.SignatureTree()
         self.siglist = []
 
+        # A bounded LRU cache of parsed opcodes by (va, arch)
+        self._op_cache = collections.OrderedDict()
+        self._op_cache_max = 0x10000
+        self._op_cache_hits = 0
+        self._op_cache_misses = 0
+
+        # Function code block graphs by fva ( see getCodeBlockGraph() )
+        # and the fvas of the cached graphs which include each block va
+        self._fgraph_cache = {}
+        self._fgraph_blocks = {}
+
+        # Emulators ready for reuse by (logwrite, logread) and the pool
+        # "generation" ( bumped when workspace memory changes )
+        self._emu_pool = collections.defaultdict(list)
+        self._emu_pool_max = 8
+        self._emu_pool_gen = 0
+
         self._initEventHandlers()
 
         # Some core meta types that exist
@@ -207,6 +229,55 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
 
         return eclass(self, logwrite=logwrite, logread=logread)
 
+    def getPooledEmulator(self, logwrite=False, logread=False):
+        """
+        Get a WorkspaceEmulator from the workspace emulator pool (or a
+        new one if the pool is empty).  Pooled emulators are reset to
+        their freshly constructed state, which is much cheaper than
+        building a new one with getEmulator().  Hand the emulator back
+        with releaseEmulator() once you are done with it.
+
+        Example:
+            emu = vw.getPooledEmulator()
+            try:
+                emu.runFunction(fva, maxhit=1)
+            finally:
+                vw.releaseEmulator(emu)
+        """
+        key = (logwrite, logread)
+        try:
+            emu = self._emu_pool[key].pop()
+            emu.resetEmulator()
+        except IndexError:
+            emu = self.getEmulator(logwrite=logwrite, logread=logread)
+
+        emu._viv_pool = (self._emu_pool_gen, key)
+        return emu
+
+    def releaseEmulator(self, emu):
+        """
+        Return an emulator from getPooledEmulator() to the pool.
+        """
+        poolinfo = getattr(emu, '_viv_pool', None)
+        if poolinfo == None:
+            return
+
+        # Workspace memory has changed since this one was built
+        gen, key = poolinfo
+        if gen != self._emu_pool_gen:
+            return
+
+        pool = self._emu_pool[key]
+        if len(pool) < self._emu_pool_max:
+            pool.append(emu)
+
+    def clearEmulatorPool(self):
+        """
+        Drop all the pooled emulators (used when workspace memory changes).
+        """
+        self._emu_pool_gen += 1
+        self._emu_pool.clear()
+
     def addLibraryDependancy(self, libname):
         """
         Add a *normalized* library name to the import search
@@ -362,19 +433,36 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         Called as new APIs (thunks) are discovered, checks to see
         if they wrap a NoReturnApi. Updates if it is a no ret API thunk
         '''
-        noretva = self.getMeta('NoReturnApisVa', {})
+        if self.isNoReturnVa(va):
+            return
 
+        isnoret = False
         for funcre, c in self.getMeta('NoReturnApisRegex', {}).items():
             if c.match(apiname):
-                self.cfctx.addNoReturnAddr( va )
-                noretva[va] = True 
+                isnoret = True
 
         for funcname in self.getMeta('NoReturnApis', {}).keys():
             if funcname.lower() == apiname.lower():
-                self.cfctx.addNoReturnAddr( va )
-                noretva[va] = True 
+                isnoret = True
 
-        self.setMeta('NoReturnApisVa', noretva)
+        # Use an event so the update is replayed (by parallel analysis
+        # and when the workspace is loaded)
+        if isnoret:
+            self.setMeta('NoReturnApiVa:0x%.8x' % va, va)
+
+    def _mcb_NoReturnApiVa(self, name, va):
+        '''
+        callback from setMeta with namespace
+        NoReturnApiVa:
+        that indicates a thunk va is a no return API.
+        '''
+        self.cfctx.addNoReturnAddr( va )
+
+        noretva = self.metadata.get('NoReturnApisVa')
+        if noretva == None:
+            noretva = {}
+            self.metadata['NoReturnApisVa'] = noretva
+        noretva[va] = True
 
     def addAnalysisModule(self, modname):
         """
@@ -400,17 +488,26 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         __import__(modname)
         return sys.modules[modname]
 
-    def addFuncAnalysisModule(self, modname):
+    def addFuncAnalysisModule(self, modname, parallel=False):
         """
         Snap in a per-function analysis module (by name) which
         will be triggered during the creation of a new function
         (makeFunction).
+
+        Set parallel=True for modules which only read the workspace
+        and fire events ( they may be run in worker processes when
+        viv.analysis.parallel.workers is set ).  Parallel modules run
+        after the function's callers have been code flowed, so nothing
+        which code flow or the analysis of another function depends on
+        ( thunks, no return apis, function apis ) may be parallel.
         """
         if self.fmods.has_key(modname):
             return
         mod = self.loadModule(modname)
         self.fmods[modname] = mod
         self.fmodlist.append(modname)
+        if parallel:
+            self.fmodpar.add(modname)
 
     def delFuncAnalysisModule(self, modname):
         '''
@@ -424,6 +521,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         x = self.fmods.pop(modname, None)
         if x != None:
             self.fmodlist.remove(modname)
+            self.fmodpar.discard(modname)
 
     def createEventChannel(self):
         chanid = self.chanids.next()
@@ -595,24 +693,43 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         if self.verbose: self.vprint('...analyzing exports.')
 
         starttime = time.time()
-        for eva in self.getEntryPoints():
-            if self.isFunction(eva):
-                continue
-            if not self.probeMemory(eva, 1, e_mem.MM_EXEC):
-                continue
-            self.makeFunction(eva)
 
-        # Now lets engage any extended analysis modules.  If any modules return
-        # true, they managed to change things and we should run again...
-        for mname in self.amodlist:
-            mod = self.amods.get(mname)
-            if self.verbose: self.vprint("Extended Analysis: %s" % mod.__name__)
-            try:
-                mod.analyze(self)
-            except Exception, e:
-                if self.verbose:
-                    traceback.print_exc()
-                self.verbprint("Extended Analysis Exception %s: %s" % (mod.__name__,e))
+        # In parallel mode, function modules from fmodpar are deferred
+        # and run by worker processes once each analysis phase is done.
+        workers = self.config.viv.analysis.parallel.workers
+        if workers and self.fmodpar and viv_parallel.canFork():
+            self._fmod_deferred = []
+
+        try:
+            evas = self.getEntryPoints()
+            if self.config.viv.analysis.entrypoints.prioritize:
+                evas.sort(key=self.getEntryPointPriority, reverse=True)
+
+            for eva in evas:
+                if self.isFunction(eva):
+                    continue
+                if not self.probeMemory(eva, 1, e_mem.MM_EXEC):
+                    continue
+                self.makeFunction(eva)
+
+            self._analyzeDeferredFunctions(workers)
+
+            # Now lets engage any extended analysis modules.  If any modules return
+            # true, they managed to change things and we should run again...
+            for mname in self.amodlist:
+                mod = self.amods.get(mname)
+                if self.verbose: self.vprint("Extended Analysis: %s" % mod.__name__)
+                try:
+                    mod.analyze(self)
+                except Exception, e:
+                    if self.verbose:
+                        traceback.print_exc()
+                    self.verbprint("Extended Analysis Exception %s: %s" % (mod.__name__,e))
+
+                self._analyzeDeferredFunctions(workers)
+
+        finally:
+            self._fmod_deferred = None
 
         endtime = time.time()
         if self.verbose: 
@@ -621,6 +738,48 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         self._fireEvent(VWE_AUTOANALFIN, (endtime, starttime))
 
 
+    def _analyzeDeferredFunctions(self, workers):
+        '''
+        Run the parallel function analysis modules for any functions
+        deferred during the current analysis phase, and fire the
+        resulting events (in function order).  Events which an earlier
+        function's worker already fired ( such as both making the same
+        location ) are only fired once.
+        '''
+        fvas = self._fmod_deferred
+        if not fvas:
+            return
+
+        self._fmod_deferred = []
+
+        fmnames = [ fmname for fmname in self.fmodlist if fmname in self.fmodpar ]
+        if self.verbose: self.vprint('...analyzing %d functions (%d workers)' % (len(fvas), workers))
+
+        seen = set()
+        for fva, events in viv_parallel.analyzeFunctions(self, fvas, fmnames, workers):
+            fired = []
+            for event, einfo in events:
+                key = (event, repr(einfo))
+                if key in seen:
+                    continue
+                self._fireEvent(event, einfo)
+                fired.append(key)
+            seen.update(fired)
+
+    def _runFuncAnalysisModules(self, fva, fmnames):
+        '''
+        Run the named function analysis modules (in order) for fva.
+        '''
+        for fmname in fmnames:
+            fmod = self.fmods.get(fmname)
+            try:
+                fmod.analyzeFunction(self, fva)
+            except Exception, e:
+                if self.verbose:
+                    traceback.print_exc()
+                self.verbprint("Function Analysis Exception for 0x%x   %s: %s" % (fva, fmod.__name__, e))
+                self.setFunctionMeta(fva, "%s fail" % fmod.__name__, traceback.format_exc())
+
     def printDiscoveredStats(self):
         disc, undisc = self.getDiscoveredInfo()
         self.vprint("Percentage of discovered executable surface area: %.1f%% (%s / %s)" % (disc*100.0/(disc+undisc), disc, disc+undisc))
@@ -635,15 +794,9 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
             if not self.isExecutable(mva):
                 continue
 
-            off = 0
-            while off < msz:
-                loc = self.getLocation(mva+off)
-                if loc == None:
-                    off += 1
-                    undisc += 1
-                else:
-                    off += loc[L_SIZE]
-                    disc += loc[L_SIZE]
+            usize = sum([ usize for uva, usize in self.iterUndefinedRanges(mva) ])
+            undisc += usize
+            disc += msz - usize
         return disc, undisc
 
     def getImports(self):
@@ -701,34 +854,81 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         ret = []
         size = self.psize
 
+        # Sorted (merged) bounds of the memory maps to check pointers against
+        bounds = []
+        for mva, msize, mperm, mname in sorted(self.getMemoryMaps()):
+            if bounds and bounds[-1][1] == mva:
+                bounds[-1][1] = mva + msize
+            else:
+                bounds.append([mva, mva + msize])
+
         for mva, msize, mperm, mname in self.getMemoryMaps():
 
-            offset, bytes = self.getByteDef(mva)
+            moff, bytes = self.getByteDef(mva)
             maxsize = len(bytes) - size
 
-            while offset + size < maxsize:
-                dbg = 0
-                va = mva + offset
+            # Only walk the undefined ranges of the map
+            for uva, usize in self.iterUndefinedRanges(mva):
 
-                loctup = self.getLocation(va)
-                if loctup != None:
-                    offset += loctup[L_SIZE]
-                    continue
+                offset = moff + (uva - mva)
+                uoffmax = min(offset + usize, maxsize - size)
 
-                x = e_bits.parsebytes(bytes, offset, size)
-                if self.isValidPointer(x):
-                    ret.append((va, x))
-                    offset += size
-                    continue
-                        
+                # Take the first pointer and skip the bytes it covers
+                nextoff = offset
+                while offset < uoffmax:
+                    chunkmax = min(uoffmax, offset + 0x100000)
+                    for poff, x in self._findPointerOffsets(bytes, offset, chunkmax, bounds):
+                        if poff < nextoff:
+                            continue
+
+                        ret.append((mva + poff - moff, x))
+                        nextoff = poff + size
 
-                offset += 1
+                    offset = chunkmax
 
         if cache:
             self.setTransMeta('findPointers', ret)
 
         return ret
 
+    def _findPointerOffsets(self, bytes, offset, maxoff, bounds):
+        '''
+        Return a sorted list of (offset, ptr) tuples for each offset in
+        [offset, maxoff) where the (little endian, possibly unaligned)
+        pointer sized value is inside bounds ( a sorted list of
+        [va, maxva] ranges ).  The values for each alignment are
+        unpacked in one operation.
+        '''
+        size = self.psize
+        fmt = e_bits.le_fmt_chars[size]
+        if size > 8 or fmt == None:
+            # No struct format for this pointer size...
+            ret = []
+            for off in xrange(offset, maxoff):
+                x = e_bits.parsebytes(bytes, off, size)
+                if self.isValidPointer(x):
+                    ret.append((off, x))
+            return ret
+
+        starts = [ bva for bva, bvamax in bounds ]
+        lo = bounds[0][0]
+        hi = bounds[-1][1]
+
+        ret = []
+        for align in xrange(min(size, maxoff - offset)):
+            aoff = offset + align
+            count = (maxoff - aoff + size - 1) / size
+            words = struct.unpack_from('<%d%s' % (count, fmt[1:]), bytes, aoff)
+
+            hits = [ (aoff + (i * size), x) for i, x in enumerate(words) if lo <= x < hi ]
+            if len(bounds) > 1:
+                hits = [ (off, x) for off, x in hits if x < bounds[ bisect.bisect_right(starts, x) - 1 ][1] ]
+
+            ret.extend(hits)
+
+        ret.sort()
+        return ret
+
     def isProbablyString(self, va):
         plen = 0 # pascal string length
         dlen = 0 # delphi string length
@@ -804,13 +1004,15 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         if self.iscode.get(va):
             return False
         self.iscode[va] = True
-        emu = self.getEmulator()
+        emu = self.getPooledEmulator()
         wat = v_emucode.watcher(self, va)
         emu.setEmulationMonitor(wat)
         try:
             emu.runFunction(va, maxhit=1)
         except Exception, e:
             return False
+        finally:
+            self.releaseEmulator(emu)
  
         if wat.looksgood():
             return True
@@ -827,8 +1029,8 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         Example: op = m.parseOpcode(0x7c773803)
 
         note: differs from the IMemory interface by checking loclist
+        note: parsed opcodes are cached (see getOpcodeCacheStats())
         '''
-        b = self.readMemory(va, 16)
         if arch == envi.ARCH_DEFAULT:
             loctup = self.getLocation(va)
             # XXX - in the case where we've set a location on what should be an 
@@ -836,8 +1038,51 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
             # so that at least parse opcode wont fail
             if loctup != None and loctup[ L_TINFO ] and loctup[ L_LTYPE ] == LOC_OP:
                 arch = loctup[ L_TINFO ]
+            else:
+                arch = self.imem_archs[0].getArchId()
+
+        arch &= envi.ARCH_MASK
+
+        key = (va, arch)
+        op = self._op_cache.pop(key, None)
+        if op != None:
+            self._op_cache_hits += 1
+            self._op_cache[key] = op
+            return op
+
+        self._op_cache_misses += 1
 
-        return self.imem_archs[ (arch & envi.ARCH_MASK) >> 16 ].archParseOpcode(b, 0, va)
+        b = self.readMemory(va, 16)
+        op = self.imem_archs[ arch >> 16 ].archParseOpcode(b, 0, va)
+
+        self._op_cache[key] = op
+        if len(self._op_cache) > self._op_cache_max:
+            self._op_cache.popitem(last=False)
+
+        return op
+
+    def clearOpcodeCache(self):
+        '''
+        Drop all the cached opcodes (used when workspace memory changes).
+        '''
+        self._op_cache.clear()
+
+    def setOpcodeCacheSize(self, size):
+        '''
+        Set the maximum number of parsed opcodes to keep in the cache.
+        '''
+        self._op_cache_max = size
+        while len(self._op_cache) > size:
+            self._op_cache.popitem(last=False)
+
+    def getOpcodeCacheStats(self):
+        '''
+        Return a (hits, misses) tuple for the parseOpcode cache.
+
+        Example:
+            hits, misses = vw.getOpcodeCacheStats()
+        '''
+        return (self._op_cache_hits, self._op_cache_misses)
 
     def makeOpcode(self, va, op=None, arch=envi.ARCH_DEFAULT):
         """
@@ -1195,6 +1440,39 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
             ret = []
         return ret
 
+    def getCodeBlockGraph(self, fva, revloop=False):
+        """
+        Return the code block graph (visgraph HierGraph) for the given
+        function ( as built by vivisect.tools.graphutil.buildFunctionGraph ).
+
+        Graphs are cached until the code blocks, xrefs, locations, or meta
+        for the function ( or any other code block in the graph ) change.
+
+        NOTE: the returned graph is shared, do *not* modify it.  Use
+              buildFunctionGraph() to get a private copy.
+
+        Example:
+            g = vw.getCodeBlockGraph(fva)
+            for nid, nprops in g.getNodes():
+                print hex(nprops.get('cbva'))
+        """
+        graphs = self._fgraph_cache.get(fva)
+        if graphs == None:
+            graphs = {}
+            self._fgraph_cache[fva] = graphs
+
+        g = graphs.get(revloop)
+        if g == None:
+            import vivisect.tools.graphutil as viv_graph
+            g = viv_graph.buildFunctionGraph(self, fva, revloop=revloop)
+            graphs[revloop] = g
+
+            # the graph may include blocks from other functions
+            for cbva, nprops in g.getNodes():
+                self._fgraph_blocks.setdefault(cbva, set()).add(fva)
+
+        return g
+
     def makeFunctionThunk(self, fva, thname):
         """
         Inform the workspace that a given function is considered a "thunk" to another.
@@ -1327,6 +1605,15 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
     def delMemoryMap(self, va):
         raise "OMG"
 
+    def writeMemory(self, va, bytes):
+        """
+        Write bytes into the workspace memory maps (cached opcodes
+        are discarded since they may no longer match memory).
+        """
+        e_mem.MemoryObject.writeMemory(self, va, bytes)
+        self.clearOpcodeCache()
+        self.clearEmulatorPool()
+
     def addSegment(self, va, size, name, filename):
         """
         Add a "segment" to the workspace.  A segment is generally some meaningful
@@ -1685,10 +1972,11 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         is found in the memory map)
         """
         offset,bytes = self.getByteDef(va)
-        foff = bytes.find('\x00', offset)
-        if foff == -1:
-            return foff
-        return (foff - offset) + 1
+        # ( bytes may be a buffer, which has no find() )
+        match = re.compile('\x00').search(bytes, offset)
+        if match == None:
+            return -1
+        return (match.start() - offset) + 1
 
     def uniStringSize(self, va):
         """
@@ -1697,10 +1985,11 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         is found in the memory map)
         """
         offset,bytes = self.getByteDef(va)
-        foff = bytes.find('\x00\x00', offset)
-        if foff == -1:
-            return foff
-        return (foff - offset) + 2
+        # ( bytes may be a buffer, which has no find() )
+        match = re.compile('\x00\x00').search(bytes, offset)
+        if match == None:
+            return -1
+        return (match.start() - offset) + 2
 
     def addLocation(self, va, size, ltype, tinfo=None):
         """
@@ -1757,6 +2046,29 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         """
         return self.locmap.getMapLookup(va)
 
+    def iterUndefinedRanges(self, mapva=None):
+        """
+        Yield (va, size) tuples for each range of bytes which has no
+        location, either in the memory map containing mapva or in all
+        the memory maps (in address order).
+
+        Example:
+            for va, size in vw.iterUndefinedRanges(mapva):
+                print 'undefined: 0x%.8x (%d)' % (va, size)
+        """
+        if mapva == None:
+            maps = self.getMemoryMaps()
+            maps.sort()
+        else:
+            mapdef = self.getMemoryMap(mapva)
+            if mapdef == None:
+                raise envi.SegmentationViolation(mapva)
+            maps = [ mapdef ]
+
+        for mva, msize, mperm, mname in maps:
+            for uva, uvamax in self.locmap.iterMapGaps(mva, msize):
+                yield (uva, uvamax - uva)
+
     def getLocationRange(self, va, size):
         """
         A "location range" is a list of location tuples where
@@ -1765,23 +2077,23 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         """
         ret = []
         endva = va+size
-        undefva = None
-        while va < endva:
-            ltup = self.getLocation(va)
-            if ltup == None:
-                if undefva == None:
-                    undefva = va
-                va += 1
-            else:
-                if undefva != None:
-                    ret.append((undefva, va-undefva, LOC_UNDEF, None))
-                    undefva = None
-                ret.append(ltup)
-                va += ltup[L_SIZE]
+        for lva, lvamax, ltup in self.locmap.iterMapLookups(va, size):
+            if va >= endva:
+                break
+
+            # We may have skipped past this one already
+            if lvamax <= va:
+                continue
+
+            if lva > va:
+                ret.append((va, lva-va, LOC_UNDEF, None))
+
+            ret.append(ltup)
+            va = max(va, lva) + ltup[L_SIZE]
 
         # Mop up any hanging udefs
-        if undefva != None:
-            ret.append((undefva, va-undefva, LOC_UNDEF, None))
+        if va < endva:
+            ret.append((va, endva-va, LOC_UNDEF, None))
 
         return ret
 
@@ -1858,18 +2170,9 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         you find one or hit the edge of the segment.
         """
         va -= 1
-        ret = self.locmap.getMapLookup(va)
-        if ret != None:
-            return ret
         if adjacent:
-            return None
-        va -= 1
-        while va > 0:
-            ret = self.locmap.getMapLookup(va)
-            if ret != None:
-                return ret
-            va -= 1
-        return None
+            return self.locmap.getMapLookup(va)
+        return self.locmap.getPrevMapLookup(va)
 
     def vaByName(self, name):
         return self.va_by_name.get(name, None)
@@ -2115,6 +2418,17 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         '''
         return [ x for x, in self.getVaSetRows('EntryPoints') ]
 
+    def getEntryPointPriority(self, va):
+        '''
+        Return a sort key used to order entry point analysis ( when
+        the viv.analysis.entrypoints.prioritize option is set ).
+        Exports come first, then entry points with the most xrefs.
+
+        Example:
+            evas.sort(key=vw.getEntryPointPriority, reverse=True)
+        '''
+        return (self.getExport(va) != None, len(self.getXrefsTo(va)))
+
     def setFileMeta(self, fname, key, value):
         """
         Store a piece of file specific metadata (python primatives are best for values)
@@ -121,7 +121,14 @@ def buildFunctionApi(vw, fva, emu, emumon):
 
 def analyzeFunction(vw, fva):
 
-    emu = vw.getEmulator()
+    emu = vw.getPooledEmulator()
+    try:
+        _analyzeFunction(vw, fva, emu)
+    finally:
+        vw.releaseEmulator(emu)
+
+def _analyzeFunction(vw, fva, emu):
+
     emumon = AnalysisMonitor(vw, fva)
 
     emu.setEmulationMonitor(emumon)
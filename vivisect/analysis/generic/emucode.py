@@ -4,9 +4,12 @@ if they are code by emulation behaviorial analysis.
 
 (This module works best very late in the analysis passes)
 """
+import Queue
+
 import envi
 import vivisect
 import vivisect.reports as viv_rep
+import vivisect.parallel as viv_parallel
 from envi.archs.i386.opconst import *
 import vivisect.impemu.monitor as viv_imp_monitor
 
@@ -14,6 +17,15 @@ from vivisect.const import *
 
 verbose = False
 
+# Trial verdicts
+EMU_SKIP = 0    # The emulation failed
+EMU_DATA = 1    # Does not look like code (maybe a string)
+EMU_FUNC = 2    # Looks like a function
+EMU_CODE = 3    # Looks like code (only used for greedy code)
+
+# Only fork workers for at least this many trials
+min_parallel = 32
+
 class watcher(viv_imp_monitor.EmulationMonitor):
 
     def __init__(self, vw, tryva):
@@ -98,50 +110,180 @@ class watcher(viv_imp_monitor.EmulationMonitor):
             self.hasret = True
             emu.stopEmu()
 
+class EmuCodeQueue:
+    '''
+    Track the candidate addresses for emulation (names, pointer targets
+    and REF_PTR xref targets which are still undefined).  Everything is
+    gathered once, after that only the events fired since the last call
+    to getCandidates() are examined ( from a workspace event channel,
+    which must be released with close() ).
+    '''
+    def __init__(self, vw):
+        self.vw = vw
+        self.tried = set()
+        self.cands = set()
+        self.chanid = None
+
+    def close(self):
+        '''
+        Release the workspace event channel.
+        '''
+        if self.chanid != None:
+            self.vw.deleteEventChannel(self.chanid)
+            self.chanid = None
+
+    def _addCandidate(self, va):
+        if va not in self.tried:
+            self.cands.add(va)
+
+    def _gatherCandidates(self):
+        vw = self.vw
+        for va, name in vw.getNames():
+            self._addCandidate(va)
+
+        for addr, va in vw.findPointers():
+            self._addCandidate(va)
+
+        for fromva, tova, reftype, rflags in vw.getXrefs(rtype=REF_PTR):
+            self._addCandidate(tova)
+
+    def getCandidates(self):
+        '''
+        Return a sorted list of the new candidates which are undefined,
+        executable and not dead data.  Each candidate is only returned
+        once.
+        '''
+        vw = self.vw
+
+        if self.chanid == None:
+            self.chanid = vw.createEventChannel()
+            self._gatherCandidates()
+
+        else:
+            regather = False
+            while True:
+                try:
+                    event, einfo = vw.waitForEvent(self.chanid, timeout=0)
+                except Queue.Empty:
+                    break
+
+                if event == VWE_SETNAME:
+                    self._addCandidate(einfo[0])
+
+                elif event == VWE_ADDXREF:
+                    if einfo[2] == REF_PTR:
+                        self._addCandidate(einfo[1])
+
+                elif event in (VWE_DELLOCATION, VWE_ADDMMAP):
+                    # Undefined space grew, there may be new pointers
+                    regather = True
+
+            if regather:
+                self._gatherCandidates()
+
+        ret = []
+        for va in self.cands:
+            if vw.getLocation(va) != None:
+                continue
+            if vw.isDeadData(va):
+                continue
+
+            # Make sure it's executable
+            if not vw.isExecutable(va):
+                continue
+
+            ret.append(va)
+
+        self.cands = set()
+        self.tried.update(ret)
+
+        ret.sort()
+        return ret
+
+class EmuCodeTrials:
+    '''
+    Run emulation trials for candidate code addresses ( using reset
+    emulators from the workspace emulator pool ).
+    '''
+    def __init__(self, vw):
+        self.vw = vw
+
+    def getVerdict(self, va):
+        '''
+        Emulate from va and return one of the EMU_* verdicts.
+        '''
+        vw = self.vw
+        emu = vw.getPooledEmulator()
+
+        wat = watcher(vw, va)
+        emu.setEmulationMonitor(wat)
+        try:
+            emu.runFunction(va, maxhit=1)
+        except Exception, e:
+            return EMU_SKIP
+        finally:
+            vw.releaseEmulator(emu)
+
+        if wat.looksgood():
+            return EMU_FUNC
+
+        # flag to tell us to be greedy w/ finding code
+        # XXX - visi is going to hate this..
+        if wat.iscode() and vw.greedycode:
+            return EMU_CODE
+
+        return EMU_DATA
+
 def analyze(vw):
 
     flist = vw.getFunctions()
 
-    tried = {}
+    workers = vw.config.viv.analysis.parallel.workers
+
+    queue = EmuCodeQueue(vw)
+    try:
+        _analyzeQueue(vw, queue, workers)
+    finally:
+        queue.close()
+
+    dlist = vw.getFunctions()
+
+    vw.verbprint("emucode: %d new functions defined (now total: %d)" % (len(dlist)-len(flist), len(dlist)))
+
+def _analyzeQueue(vw, queue, workers):
+    trials = None
+
     vasetrows = []
     while True:
         docode = []
         bcode  = []
-       
-        vatodo = []
-        vatodo = [ va for va, name in vw.getNames() if vw.getLocation(va) == None ]
-        vatodo.extend( [ va for addr, va in vw.findPointers() if vw.getLocation(va) == None ] ) 
-        vatodo.extend( [tova for fromva, tova, reftype, rflags in vw.getXrefs(rtype=REF_PTR) if vw.getLocation(tova) == None] )
 
-        for va in set(vatodo):
-            if vw.getLocation(va) != None:
-                continue
-            if vw.isDeadData(va):
-                continue
+        vatodo = queue.getCandidates()
+        if not vatodo:
+            break
 
-            # Make sure it's executable
-            if not vw.isExecutable(va):
-                continue
+        if trials == None:
+            trials = EmuCodeTrials(vw)
 
-            # Skip it if we've tried it already.
-            if tried.get(va):
-                continue
+        # The trials only read the workspace, so they may be run in
+        # worker processes.  Verdicts are applied here in va order.
+        if workers and len(vatodo) >= min_parallel:
+            verdicts = viv_parallel.mapWorkspace(vw, trials.getVerdict, vatodo, workers)
+        else:
+            verdicts = [ trials.getVerdict(va) for va in vatodo ]
 
-            tried[va] = True
-            emu = vw.getEmulator()
-            wat = watcher(vw, va)
-            emu.setEmulationMonitor(wat)
-            try:
-                emu.runFunction(va, maxhit=1)
-            except Exception, e:
-                continue
-            if wat.looksgood():
+        for va, verdict in zip(vatodo, verdicts):
+
+            if verdict == EMU_FUNC:
                 docode.append(va)
-            # flag to tell us to be greedy w/ finding code
-            # XXX - visi is going to hate this..
-            elif wat.iscode() and vw.greedycode:
+
+            elif verdict == EMU_CODE:
                 bcode.append(va)
-            else:
+
+            elif verdict == EMU_DATA:
+                if vw.getLocation(va) != None:
+                    continue
+
                 if vw.isProbablyString(va):
                     vw.makeString(va)
                 elif vw.isProbablyUnicode(va):
@@ -150,7 +292,6 @@ def analyze(vw):
         if len(docode) == 0:
             break
 
-        docode.sort()
         for va in docode:
             if vw.getLocation(va) != None:
                 continue
@@ -161,13 +302,7 @@ def analyze(vw):
                 continue
             vasetrows.append((va,))
     
-        bcode.sort()
         for va in bcode:
             if vw.getLocation(va) != None:
                 continue
             vw.makeCode(va)
-
-    dlist = vw.getFunctions()
-
-    vw.verbprint("emucode: %d new functions defined (now total: %d)" % (len(dlist)-len(flist), len(dlist)))
-
@@ -19,30 +19,29 @@ def analyze(vw):
     brute force find other function entry points based on the
     entry signatures db.
     """
-    # FIXME make the below code an undefined space iterator
-    # and use in findPointers too
     for mapva,mapsize,mapflags,fname in vw.getMemoryMaps():
 
         # Segment permissions check for likely code stuff at all
         if not mapflags & e_mem.MM_EXEC:
             continue
 
-        i = 0
-        maxsize = mapsize - 4
-        while i < maxsize:
-            va = mapva + i
-            loctup = vw.getLocation(va)
-            if loctup != None:
-                i += loctup[vivisect.L_SIZE]
-                continue
+        # Scan the whole map for signature matches in one pass
+        offset, bytez = vw.getByteDef(mapva)
+        maxva = mapva + mapsize - 4
+        for sigoff, sigval in vw.sigtree.scanSignatures(bytez, offset, offset + mapsize):
+
+            va = mapva + (sigoff - offset)
+            if va >= maxva:
+                break
 
-            i+=1
+            # Skip anything which is already defined
+            if vw.getLocation(va) != None:
+                continue
 
             try:
 
-                if vw.isFunctionSignature(va):
-                    #print "MATCH MATCH MATCH: 0x%.8x" % va
-                    vw.makeFunction(va)
+                #print "MATCH MATCH MATCH: 0x%.8x" % va
+                vw.makeFunction(va)
 
             except vivisect.InvalidLocation, msg:
                 if vw.verbose: vw.vprint("InvalidLocation: %s" % msg)
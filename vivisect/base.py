@@ -86,6 +86,16 @@ vaset_xlate = {
     str:VASET_STRING,
 }
 
+# Events whose results are carried by the state tables
+# ( see VivWorkspaceCore._getStateTables )
+state_events = set([
+    VWE_ADDLOCATION, VWE_DELLOCATION,
+    VWE_ADDCODEBLOCK, VWE_DELCODEBLOCK,
+    VWE_ADDXREF, VWE_DELXREF,
+    VWE_SETNAME,
+    VWE_ADDFUNCTION, VWE_DELFUNCTION, VWE_SETFUNCMETA, VWE_SETFUNCARGS,
+])
+
 class VivEventDist(VivEventCore):
     '''
     Similar to an event core, but does optimized distribution
@@ -149,8 +159,8 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
     def __init__(self):
         viv_impapi.ImportApi.__init__(self)
         self.loclist = []
-        self.locmap   = e_page.MapLookup()
-        self.blockmap = e_page.MapLookup()
+        self.locmap   = e_page.IntervalLookup()
+        self.blockmap = e_page.IntervalLookup()
         self._mods_loaded = False
 
         # Storage for function local symbols
@@ -187,10 +197,25 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
         '''
         self._event_saved = len(self._event_list)
 
+    def _dropFuncGraph(self, va):
+        # Drop any cached function graph for the function containing va
+        # ( and the graphs of other functions which include its block )
+        if self._fgraph_cache:
+            self._fgraph_cache.pop(self.getFunction(va), None)
+            cb = self.getCodeBlock(va)
+            if cb != None:
+                self._dropBlockGraphs(cb[CB_VA])
+
+    def _dropBlockGraphs(self, cbva):
+        # Drop the cached function graphs which include the code block cbva
+        for fva in self._fgraph_blocks.pop(cbva, ()):
+            self._fgraph_cache.pop(fva, None)
+
     def _handleADDLOCATION(self, loc):
         lva, lsize, ltype, linfo = loc
         self.locmap.setMapLookup(lva, lsize, loc)
         self.loclist.append(loc)
+        self._dropFuncGraph(lva)
 
         # A few special handling cases...
         if ltype == LOC_IMPORT:
@@ -203,6 +228,7 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
         lva, lsize, ltype, linfo = loc
         self.locmap.setMapLookup(lva, lsize, None)
         self.loclist.remove(loc)
+        self._dropFuncGraph(lva)
 
     def _handleADDSEGMENT(self, einfo):
         self.segments.append(einfo)
@@ -250,12 +276,14 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
         self.codeblocks_by_funcva.pop(einfo)
         node = self._call_graph.getNode(einfo)
         self._call_graph.delNode(node)
+        self._fgraph_cache.pop(einfo, None)
 
     def _handleSETFUNCMETA(self, einfo):
         funcva, name, value = einfo
         m = self.funcmeta.get(funcva)
         if m != None:
             m[name] = value
+        self._fgraph_cache.pop(funcva, None)
         mcbname = "_fmcb_%s" % name.split(':')[0]
         mcb = getattr(self, mcbname, None)
         if mcb != None:
@@ -266,12 +294,16 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
         self.blockmap.setMapLookup(va, size, einfo)
         self.codeblocks_by_funcva.get(funcva).append(einfo)
         self.codeblocks.append(einfo)
+        self._fgraph_cache.pop(funcva, None)
+        self._dropBlockGraphs(va)
 
     def _handleDELCODEBLOCK(self, cb):
         va,size,funcva = cb
         self.codeblocks.remove(cb)
         self.codeblocks_by_funcva.get(cb[CB_FUNCVA]).remove(cb)
         self.blockmap.setMapLookup(va, size, None)
+        self._fgraph_cache.pop(funcva, None)
+        self._dropBlockGraphs(va)
 
     def _handleADDXREF(self, einfo):
         fromva, tova, reftype, rflags = einfo
@@ -289,11 +321,13 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
             xr_to.append(einfo)
             xr_from.append(einfo)
             self.xrefs.append(einfo)
+            self._dropFuncGraph(fromva)
 
     def _handleDELXREF(self, einfo):
         fromva, tova, reftype, refflags = einfo
         self.xrefs_by_to[tova].remove(einfo)
         self.xrefs_by_from[fromva].remove(einfo)
+        self._dropFuncGraph(fromva)
 
     def _handleSETNAME(self, einfo):
         va,name = einfo
@@ -315,6 +349,8 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
     def _handleADDMMAP(self, einfo):
         va, perms, fname, mbytes = einfo
         e_mem.MemoryObject.addMemoryMap(self, va, perms, fname, mbytes)
+        self.clearOpcodeCache()
+        self.clearEmulatorPool()
 
         blen = len(mbytes)
         self.locmap.initMapLookup(va, blen)
@@ -528,6 +564,51 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
             self.funcmeta[funcva] = {} # His metadata
             self.codeblocks_by_funcva[funcva] = [] # Init code block list
 
+    def _getStateTables(self):
+        '''
+        Return a dict of the location, code block, xref, name and function
+        tables which the state_events build.  Storage modules may save them
+        to load a workspace without replaying those events.
+        '''
+        return {
+            'locations':    (self.loclist, self.locmap),
+            'codeblocks':   (self.codeblocks, self.codeblocks_by_funcva, self.blockmap),
+            'xrefs':        (self.xrefs, self.xrefs_by_to, self.xrefs_by_from),
+            'names':        (self.name_by_va, self.va_by_name),
+            'functions':    (self.funcmeta, self.func_args),
+        }
+
+    def _setStateTables(self, tables):
+        '''
+        Install tables from _getStateTables() in place of replaying the
+        state_events ( the other events must already be replayed ) and
+        update the call graph and codeflow context to match.
+        '''
+        self.loclist, self.locmap = tables['locations']
+        self.codeblocks, self.codeblocks_by_funcva, self.blockmap = tables['codeblocks']
+        self.xrefs, self.xrefs_by_to, self.xrefs_by_from = tables['xrefs']
+        self.name_by_va, self.va_by_name = tables['names']
+        self.funcmeta, self.func_args = tables['functions']
+        self._fgraph_cache = {}
+        self._fgraph_blocks = {}
+
+        noret = self.getMeta('NoReturnApis', {})
+        for lva, lsize, ltype, linfo in self.loclist:
+            if ltype == LOC_IMPORT and noret.get(linfo.lower()):
+                self.cfctx.addNoReturnAddr( lva )
+
+        for va, meta in self.funcmeta.items():
+            node = self._call_graph.getFunctionNode(va)
+            self._call_graph.setNodeProp(node,'repr',self.getName(va))
+            self.cfctx.addFunctionDef(va, meta.get('CallsFrom'))
+
+        for va, meta in self.funcmeta.items():
+            for name,value in meta.items():
+                mcbname = "_fmcb_%s" % name.split(':')[0]
+                mcb = getattr(self, mcbname, None)
+                if mcb != None:
+                    mcb(va, name, value)
+
     #def _loadImportApi(self, apidict):
         #self._imp_api.update( apidict )
 
@@ -542,6 +623,8 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
 
         archid = envi.getArchByName(value)
         self.setMemArchitecture(archid)
+        self.clearOpcodeCache()
+        self.clearEmulatorPool()
 
         # Default calling convention for architecture
         # This will be superceded by Platform and Parser settings
@@ -655,15 +738,13 @@ class VivCodeFlowContext(e_codeflow.CodeFlowContext):
         vw._fireEvent(VWE_ADDFUNCTION, (fva,fmeta))
 
         # Go through the function analysis modules in order
-        for fmname in vw.fmodlist:
-            fmod = vw.fmods.get(fmname)
-            try:
-                fmod.analyzeFunction(vw, fva)
-            except Exception, e:
-                if vw.verbose:
-                    traceback.print_exc()
-                vw.verbprint("Function Analysis Exception for 0x%x   %s: %s" % (fva, fmod.__name__, e))
-                vw.setFunctionMeta(fva, "%s fail" % fmod.__name__, traceback.format_exc())
+        fmnames = vw.fmodlist
+        if vw._fmod_deferred != None:
+            # Parallel analysis: leave the fmodpar ones for the workers
+            fmnames = [ fmname for fmname in fmnames if fmname not in vw.fmodpar ]
+            vw._fmod_deferred.append(fva)
+
+        vw._runFuncAnalysisModules(fva, fmnames)
 
         fname = vw.getName( fva )
         if vw.getMeta('NoReturnApis').get( fname.lower() ):
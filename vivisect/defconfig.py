@@ -29,6 +29,12 @@ defconfig = {
             'pointertables':{
                 'table_min_len':4,
             },
+            'entrypoints':{
+                'prioritize':False,
+            },
+            'parallel':{
+                'workers':0,
+            },
         },
     },
     'cli':vdb.defconfig.get('cli'), # FIXME make our own...
@@ -69,6 +75,12 @@ docconfig = {
             'pointertables':{
                 'table_min_len':'How many pointers must be in a row to make a table?',
             },
+            'entrypoints':{
+                'prioritize':'Analyze exports first (and then by xref count) rather than in the order found?',
+            },
+            'parallel':{
+                'workers':'How many worker processes to use for parallel function analysis (0 to disable)?',
+            },
         },
 
     },
@@ -24,6 +24,32 @@ def imphook(impname):
 
     return imptemp
 
+# (impname, method name) import hooks for each emulator class
+_imphook_names = {}
+
+def getImpHookNames(cls):
+    '''
+    Return a list of (impname, methname) tuples for the @imphook
+    decorated methods of an emulator class (computed once per class).
+    '''
+    names = _imphook_names.get(cls)
+    if names == None:
+        names = []
+        for name in dir(cls):
+            val = getattr(cls, name, None)
+            if val == None:
+                continue
+
+            impname = getattr(val, '__imphook__', None)
+            if impname == None:
+                continue
+
+            names.append((impname, name))
+
+        _imphook_names[cls] = names
+
+    return names
+
 class WorkspaceEmulator:
 
     taintregs = []
@@ -77,16 +103,52 @@ class WorkspaceEmulator:
         taintbytes = ''.join([ e_bits.buildbytes(taint,self.psize) for taint in taints ])
         self.writeMemory(self.stack_pointer, taintbytes )
 
-        for name in dir(self):
-            val = getattr(self, name, None)
-            if val == None:
-                continue
+        self._initImpHooks()
 
-            impname = getattr(val, '__imphook__',None)
-            if impname == None:
-                continue
+        # Remember the pristine state for resetEmulator()
+        self._emu_pristine = None
+        self._snapPristine()
+
+    def _initImpHooks(self):
+        self.hooks = dict([ (impname, getattr(self, name)) for impname, name in getImpHookNames(self.__class__) ])
 
-            self.hooks[impname] = val
+    def _snapPristine(self):
+        # The taint counter can not be copied, so restart it
+        taintnext = self.taintva.next()
+        self.taintva = itertools.count(taintnext, 8192)
+        opts = (dict(self._emu_opts), self._safe_mem, self._func_only)
+        self._emu_pristine = (self.getEmuSnap(), dict(self.taints), taintnext, opts)
+
+    def resetEmulator(self):
+        '''
+        Reset the emulator to the state it was constructed in (registers,
+        memory, taints, code path, options and import hooks) so it may be
+        reused rather than building a new one.  The cost scales with the
+        memory which has been written since construction.
+
+        Example:
+            emu.runFunction(fva, maxhit=1)
+            emu.resetEmulator()
+            emu.runFunction(otherva, maxhit=1)
+        '''
+        esnap, taints, taintnext, opts = self._emu_pristine
+
+        self.setEmuSnap(esnap)
+        self.taints = dict(taints)
+        self.taintva = itertools.count(taintnext, 8192)
+
+        emuopts, self._safe_mem, self._func_only = opts
+        self._emu_opts = dict(emuopts)
+        self._initImpHooks()
+
+        self.funcva = None
+        self.emustop = False
+        self.emumon = None
+        self.op = None
+        self.opcache = {}
+        self.uninit_use = {}
+        self.path = self.newCodePathNode()
+        self.curpath = self.path
 
     def stopEmu(self):
         '''
@@ -117,7 +179,13 @@ class WorkspaceEmulator:
         # getByteDef etc... use it.
         op = self.opcache.get(pc)
         if op == None:
-            op = envi.Emulator.parseOpcode(self, pc)
+            # If we haven't written to the map, the workspace opcode
+            # cache is shared with (and by) every other emulator
+            mdef = self._getMapDef(pc)
+            if mdef != None and not isinstance(mdef[3], e_mem.MemoryPages) and self.vw.isValidPointer(pc):
+                op = self.vw.parseOpcode(pc, arch=self.imem_archs[0].getArchId())
+            else:
+                op = envi.Emulator.parseOpcode(self, pc)
             self.opcache[pc] = op
         return op
 
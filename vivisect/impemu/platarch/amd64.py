@@ -21,8 +21,8 @@ class Amd64WorkspaceEmulator(v_i_emulator.WorkspaceEmulator, e_amd64.Amd64Emulat
 
     def __init__(self, vw, logwrite=False, logread=False):
         e_amd64.Amd64Emulator.__init__(self)
-        v_i_emulator.WorkspaceEmulator.__init__(self, vw, logwrite=logwrite, logread=logread)
         self.setEmuOpt('i386:reponce',True)
+        v_i_emulator.WorkspaceEmulator.__init__(self, vw, logwrite=logwrite, logread=logread)
 
     def getRegister(self, index):
         """
@@ -0,0 +1,125 @@
+'''
+Multi-process function analysis for the vivisect workspace.
+
+Worker processes are forked from the parent and therefore start with a
+(copy on write) snapshot of the workspace.  Each worker runs the requested
+function analysis modules for a batch of functions and returns the events
+which were fired.  The parent then replays them in function order.
+
+mapWorkspace() runs any other read only work (such as emulation trials)
+over the same kind of worker pool.
+
+Where workers can not be forked (the "spawn" start method used on
+Windows) they would start without the workspace, so the work is done
+serially in this process instead.
+'''
+import os
+import multiprocessing
+
+# The workspace being analyzed ( inherited by the forked workers )
+_par_vw = None
+_par_fmnames = None
+_par_func = None
+
+def canFork():
+    '''
+    Returns True if worker processes are forked from this one (and
+    therefore inherit the workspace being analyzed).
+    '''
+    getmeth = getattr(multiprocessing, 'get_start_method', None)
+    if getmeth != None:
+        return getmeth() == 'fork'
+    return hasattr(os, 'fork')
+
+def _parInitWorker():
+    vw = _par_vw
+
+    # Do not share server connections / event channels with the parent
+    vw.server = None
+    vw.chan_lookup = {}
+
+    # Anything found in a worker is analyzed in the worker
+    vw._fmod_deferred = None
+
+def _parAnalyzeFunction(fva):
+    vw = _par_vw
+    start = len(vw._event_list)
+    vw._runFuncAnalysisModules(fva, _par_fmnames)
+    return (fva, vw._event_list[start:])
+
+def _parCallFunc(arg):
+    return _par_func(arg)
+
+def analyzeFunctions(vw, fvas, fmnames, workers):
+    '''
+    Run the given function analysis modules for the list of functions
+    using a pool of worker processes.  Returns a list of (fva, events)
+    tuples in the same order as fvas.
+
+    NOTE: If workers can not be forked, the modules are run serially in
+          this process and the (already fired) events are not returned.
+
+    Example:
+        for fva, events in analyzeFunctions(vw, fvas, fmnames, 4):
+            for event, einfo in events:
+                vw._fireEvent(event, einfo)
+    '''
+    global _par_vw
+    global _par_fmnames
+
+    if not fvas:
+        return []
+
+    if not canFork():
+        for fva in fvas:
+            vw._runFuncAnalysisModules(fva, fmnames)
+        return [ (fva, []) for fva in fvas ]
+
+    _par_vw = vw
+    _par_fmnames = fmnames
+
+    chunksize = max(1, len(fvas) / (workers * 4))
+
+    pool = multiprocessing.Pool(workers, initializer=_parInitWorker)
+    try:
+        return pool.map(_parAnalyzeFunction, fvas, chunksize)
+    finally:
+        pool.terminate()
+        _par_vw = None
+        _par_fmnames = None
+
+def mapWorkspace(vw, func, args, workers):
+    '''
+    Call func(arg) for each of args using a pool of worker processes
+    (forked from this one, so func may be any callable and may use the
+    workspace and anything else built before the call).  func must not
+    modify the workspace and its return values must be picklable.
+    Returns the results in the same order as args.
+
+    NOTE: where workers can not be forked ( see canFork() ) func is
+          called for each arg in this process instead.
+
+    Example:
+        verdicts = mapWorkspace(vw, trials.getVerdict, vas, 4)
+    '''
+    global _par_vw
+    global _par_func
+
+    if not args:
+        return []
+
+    if not canFork():
+        return [ func(arg) for arg in args ]
+
+    _par_vw = vw
+    _par_func = func
+
+    chunksize = max(1, len(args) / (workers * 4))
+
+    pool = multiprocessing.Pool(workers, initializer=_parInitWorker)
+    try:
+        return pool.map(_parCallFunc, args, chunksize)
+    finally:
+        pool.terminate()
+        _par_vw = None
+        _par_func = None
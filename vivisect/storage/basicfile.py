@@ -62,6 +62,11 @@ def vivEventsFromFile(filename):
     return events
 
 def loadWorkspace(vw, filename):
+    # Hand off workspaces saved in the streaming format
+    import vivisect.storage.streamfile as viv_streamfile
+    if viv_streamfile.isStreamFile(filename):
+        return viv_streamfile.loadWorkspace(vw, filename)
+
     events = vivEventsFromFile(filename)
     vw.importWorkspace(events)
     return
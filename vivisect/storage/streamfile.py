@@ -0,0 +1,333 @@
+'''
+A streaming workspace storage format.
+
+The file is a signature followed by frames.  Each frame is a "<4sII"
+(tag, event count, length) header followed by a zlib compressed pickle:
+
+    EVTS - a chunk of events ( appended by each save )
+    SNAP - the start of a snapshot of the workspace
+    SEVT - a chunk of (compacted) snapshot events
+    STAT - one of the workspace state tables ( locations, xrefs, ... )
+    SEND - the end of a snapshot
+
+A full save writes a single snapshot.  Incremental saves append EVTS
+frames, and once enough events have been appended since the snapshot,
+the file is rewritten with a fresh snapshot ( dropping the old frames ).
+
+Loading a snapshot does not replay the events which build the location,
+code block, xref, name and function tables ( see base.state_events ).
+They are kept in the workspace event list and the tables are loaded
+directly from the STAT frames.  The EVTS frames after the snapshot are
+then replayed as usual, one chunk at a time.
+
+Example:
+    vw.setMeta('StorageModule', 'vivisect.storage.streamfile')
+    vw.saveWorkspace()
+'''
+import zlib
+import struct
+import cPickle as pickle
+
+import vivisect
+import vivisect.base as viv_base
+
+from vivisect.const import *
+
+vivsig_stream = 'VIVSTRM'.ljust(8,'\x00')
+
+frame_fmt = '<4sII'
+frame_size = struct.calcsize(frame_fmt)
+
+# How many events go in each compressed frame
+chunksize = 4096
+# Append a snapshot once this many events follow the last one
+snapinterval = 0x40000
+
+def compactEvents(events):
+    '''
+    Return a list of events which produces the same workspace as the
+    given (complete) event list, with redundant events removed:
+
+    * locations which were deleted and then replaced in place
+    * names which were later changed ( for names only ever used once,
+      and not used by a function add )
+    * comments which were later changed
+    * duplicate xrefs ( which the workspace ignores anyway )
+    '''
+    drop = set()
+
+    locadds = {}    # loc tuple -> indexes of its live ADDLOCATION events
+    xrefs = set()   # the currently live xrefs
+    lastname = {}   # va -> index of its most recent SETNAME
+    namevas = {}    # name -> set of vas which have used it
+    pinned = set()  # SETNAME indexes which must be kept
+    lastcmt = {}    # va -> index of its most recent COMMENT
+
+    evcount = len(events)
+    for i, (event, einfo) in enumerate(events):
+
+        if event == VWE_ADDLOCATION:
+            if isinstance(einfo, tuple):
+                locadds.setdefault(einfo, []).append(i)
+
+        elif event == VWE_DELLOCATION:
+            if not isinstance(einfo, tuple):
+                continue
+
+            idxs = locadds.get(einfo)
+            if not idxs:
+                continue
+
+            j = idxs.pop()
+
+            # Only when the location is replaced by one covering the
+            # same range ( which re-covers anything the delete cleared )
+            if len(idxs) or i + 1 >= evcount:
+                continue
+
+            nevent, ninfo = events[i+1]
+            if nevent != VWE_ADDLOCATION:
+                continue
+
+            if ninfo[L_VA] != einfo[L_VA] or ninfo[L_SIZE] != einfo[L_SIZE]:
+                continue
+
+            # Imports have a side effect on codeflow noret addrs
+            if einfo[L_LTYPE] == LOC_IMPORT:
+                continue
+
+            drop.add(j)
+            drop.add(i)
+
+        elif event == VWE_ADDXREF:
+            if einfo in xrefs:
+                drop.add(i)
+            xrefs.add(einfo)
+
+        elif event == VWE_DELXREF:
+            xrefs.discard(einfo)
+
+        elif event == VWE_SETNAME:
+            va, name = einfo
+            prev = lastname.get(va)
+            if prev != None and prev not in pinned:
+                drop.add(prev)
+            lastname[va] = i
+            if name != None:
+                namevas.setdefault(name, set()).add(va)
+
+        elif event == VWE_ADDFUNCTION:
+            # The function add uses the name current at the time
+            prev = lastname.get(einfo[0])
+            if prev != None:
+                pinned.add(prev)
+
+        elif event == VWE_COMMENT:
+            va, comment = einfo
+            prev = lastcmt.get(va)
+            if prev != None:
+                drop.add(prev)
+
+            if comment == None:
+                # Nothing to delete once the earlier ones are gone
+                lastcmt.pop(va, None)
+                drop.add(i)
+            else:
+                lastcmt[va] = i
+
+    # A superseded name may only go if no other va ever used it
+    # ( setting a name on one va un-maps it from the other... )
+    keep = set(lastname.values())
+    for i in list(drop):
+        event, einfo = events[i]
+        if event != VWE_SETNAME or i in keep:
+            continue
+
+        name = einfo[1]
+        if name != None and len(namevas.get(name)) > 1:
+            drop.discard(i)
+
+    return [ events[i] for i in xrange(evcount) if i not in drop ]
+
+def _writeFrame(f, tag, count, obj):
+    data = zlib.compress(pickle.dumps(obj, protocol=2))
+    f.write(struct.pack(frame_fmt, tag, count, len(data)))
+    f.write(data)
+
+def _writeEvents(f, tag, events):
+    for i in xrange(0, len(events), chunksize):
+        chunk = events[i:i+chunksize]
+        _writeFrame(f, tag, len(chunk), chunk)
+
+def _writeSnapshot(f, vw):
+    events = compactEvents(vw.exportWorkspace())
+    _writeFrame(f, 'SNAP', len(events), None)
+    _writeEvents(f, 'SEVT', events)
+    for name, table in sorted(vw._getStateTables().items()):
+        _writeFrame(f, 'STAT', 1, (name, table))
+    _writeFrame(f, 'SEND', len(events), None)
+
+def _readFrame(f, filename, offset, length):
+    f.seek(offset)
+    try:
+        return pickle.loads(zlib.decompress(f.read(length)))
+    except (zlib.error, pickle.UnpicklingError), e:
+        raise vivisect.InvalidWorkspace(filename, "invalid workspace file")
+
+def _readFrames(f, filename):
+    '''
+    Return a list of (tag, count, offset, length) tuples for the frames
+    in the file ( a truncated trailing frame is ignored ).
+    '''
+    f.seek(0)
+    if f.read(8) != vivsig_stream:
+        raise vivisect.InvalidWorkspace(filename, "invalid workspace file")
+
+    frames = []
+    while True:
+        hdr = f.read(frame_size)
+        if len(hdr) != frame_size:
+            break
+
+        tag, count, length = struct.unpack(frame_fmt, hdr)
+        offset = f.tell()
+        f.seek(length, 1)
+        frames.append((tag, count, offset, length))
+
+    # Drop a truncated last frame
+    f.seek(0, 2)
+    fsize = f.tell()
+    while frames and frames[-1][2] + frames[-1][3] > fsize:
+        frames.pop()
+
+    return frames
+
+def _getReplayFrames(frames):
+    '''
+    Return a tuple of (snapframes, evtframes) for the most recent
+    complete snapshot ( its SEVT and STAT frames, or an empty list )
+    and the EVTS frames after it.
+    '''
+    snapidx = None
+    for i in xrange(len(frames)-1, -1, -1):
+        if frames[i][0] == 'SEND':
+            snapidx = i
+            break
+
+    if snapidx == None:
+        return [], [ fr for fr in frames if fr[0] == 'EVTS' ]
+
+    snapframes = []
+    for i in xrange(snapidx-1, -1, -1):
+        tag = frames[i][0]
+        if tag == 'SNAP':
+            break
+        snapframes.append(frames[i])
+
+    snapframes.reverse()
+    return snapframes, [ fr for fr in frames[snapidx+1:] if fr[0] == 'EVTS' ]
+
+def _countSinceSnapshot(frames):
+    count = 0
+    for tag, fcount, offset, length in reversed(frames):
+        if tag == 'SEND':
+            break
+        if tag == 'EVTS':
+            count += fcount
+    return count
+
+def iterEventsFromFile(filename):
+    '''
+    Yield the events needed to rebuild the workspace stored in the
+    given file ( decompressing only one chunk at a time ).
+    '''
+    f = file(filename, 'rb')
+    try:
+        snapframes, evtframes = _getReplayFrames(_readFrames(f, filename))
+        for tag, count, offset, length in snapframes + evtframes:
+            if tag == 'STAT':
+                continue
+
+            for event in _readFrame(f, filename, offset, length):
+                yield event
+
+    finally:
+        f.close()
+
+def isStreamFile(filename):
+    f = file(filename, 'rb')
+    try:
+        return f.read(8) == vivsig_stream
+    finally:
+        f.close()
+
+def vivEventsFromFile(filename):
+    return list(iterEventsFromFile(filename))
+
+def saveWorkspace(vw, filename):
+    f = file(filename, 'wb')
+    try:
+        f.write(vivsig_stream)
+        _writeSnapshot(f, vw)
+    finally:
+        f.close()
+
+def saveWorkspaceChanges(vw, filename):
+    elist = vw.exportWorkspaceChanges()
+    if not len(elist):
+        return
+
+    f = file(filename, 'r+b')
+    try:
+        frames = _readFrames(f, filename)
+        if _countSinceSnapshot(frames) + len(elist) < snapinterval:
+            # Append after the last good frame
+            end = 8
+            if frames:
+                end = frames[-1][2] + frames[-1][3]
+            f.seek(end)
+            f.truncate()
+
+            _writeEvents(f, 'EVTS', elist)
+            return
+
+    finally:
+        f.close()
+
+    # Time for a new snapshot ( which replaces everything before it )
+    saveWorkspace(vw, filename)
+
+def loadWorkspace(vw, filename):
+    # During import, if we have a server, be sure not to notify
+    # the server about the events he just gave us...
+    local = vw.server != None
+
+    f = file(filename, 'rb')
+    try:
+        snapframes, evtframes = _getReplayFrames(_readFrames(f, filename))
+
+        # Only replay the snapshot events which the state tables do not cover
+        elist = vw._event_list
+        fe = vw._fireEvent
+        tables = {}
+        for tag, count, offset, length in snapframes:
+            obj = _readFrame(f, filename, offset, length)
+            if tag == 'STAT':
+                name, table = obj
+                tables[name] = table
+                continue
+
+            for event, einfo in obj:
+                if event in viv_base.state_events:
+                    elist.append((event, einfo))
+                else:
+                    fe(event, einfo, local=local)
+
+        if tables:
+            vw._setStateTables(tables)
+
+        for tag, count, offset, length in evtframes:
+            vw.importWorkspace(_readFrame(f, filename, offset, length))
+
+    finally:
+        f.close()
@@ -1,3 +1,5 @@
+import copy
+
 import visgraph.pathcore as vg_pathcore
 import vivisect.tools.graphutil as viv_graph
 import vivisect.symboliks.effects as vsym_effects
@@ -368,7 +370,7 @@ class SymbolikAnalysisContext:
         graph = SymbolikFunctionGraph()
 
         if fgraph == None:
-            fgraph = viv_graph.buildFunctionGraph(self.vw, fva)
+            fgraph = self.vw.getCodeBlockGraph(fva)
 
         for nodeva,ninfo in fgraph.getNodes():
 
@@ -545,6 +547,13 @@ class SymbolikAnalysisContext:
         For each path through the function, run all symbolik
         effects in an emulator instance and yield
         emu, effects tuples...
+
+        NOTE: paths which share a prefix with the previous path ( as the
+        code path generators produce them ) resume from a snapshot of the
+        emulator state at the end of the prefix rather than re-applying
+        the effects of every block from the function entry.  The state of
+        every path is interned by one SymbolikInterner so the (mostly
+        similar) expressions of the paths share their nodes.
         '''
         if graph == None:
             graph = self.getSymbolikGraph(fva)
@@ -556,24 +565,54 @@ class SymbolikAnalysisContext:
         if paths == None:
             paths = viv_graph.getCodePaths(graph, maxpath=maxpath)
 
+        emu = self.getFuncEmu(fva, fargs=args)
+        emu.setSymInterner(SymbolikInterner())
+        for fname, funccb in self.funccb.items():
+            emu.addFunctionCallback(fname, funccb)
+
+        patheffects = emu.applyEffects(self.preeffects)
+        pathconstraints = emu.applyEffects(self.preconstraints)
+        opcodes = []
+
+        # The stack of applied path steps ( the current branch of the
+        # path prefix trie ).  Each entry is a tuple of:
+        # ( (nid, eid), emu snapshot, len(patheffects), len(pathconstraints), len(opcodes) )
+        # with a snapshot of None marking a step which killed the path.
+        rootsnap = emu.getSymSnapshot()
+        prefix = []
+
         pcnt = 0
         for path in paths:
             if pcnt > maxpath:
                 break
 
             pcnt+=1
-            skippath = False
-            emu = self.getFuncEmu(fva, fargs=args)
 
-            for fname, funccb in self.funccb.items():
-                emu.addFunctionCallback(fname, funccb)
+            # Find the part of this path we have already applied
+            depth = 0
+            maxdepth = min(len(path), len(prefix))
+            while depth < maxdepth and prefix[depth][0] == path[depth]:
+                depth += 1
+
+            if depth and prefix[depth-1][1] == None:
+                # The shared prefix already failed its constraints
+                continue
+
+            del prefix[depth:]
 
-            opcodes = []
+            if depth:
+                step, snap, effcnt, concnt, opcnt = prefix[-1]
+            else:
+                snap, effcnt, concnt, opcnt = rootsnap, len(self.preeffects), len(self.preconstraints), 0
 
-            patheffects = emu.applyEffects(self.preeffects)
-            pathconstraints = emu.applyEffects(self.preconstraints)
+            # Snapshots are shared by every path below them, so restore copies
+            emu.setSymSnapshot(self._copySymSnapshot(snap))
+            del patheffects[effcnt:]
+            del pathconstraints[concnt:]
+            del opcodes[opcnt:]
 
-            for nid, eid in path:
+            skippath = False
+            for nid, eid in path[depth:]:
                 # This is the edge that *got us here* so it has to
                 # be processed first!
                 if eid != None:
@@ -595,6 +634,7 @@ class SymbolikAnalysisContext:
                         if not all( discs ): # emtpy discs is True...
                             #print('SKIP: %s %s' % (repr(discs),[str(c) for c in constraints ]))
                             skippath = True
+                            prefix.append( ((nid, eid), None, None, None, None) )
                             break
 
                         # reduce/remove constraints that were discrete and passed
@@ -604,18 +644,28 @@ class SymbolikAnalysisContext:
                     patheffects.extend(constraints)
                     pathconstraints.extend( cons )
 
-                if skippath:
-                    break
-
                 effects = emu.applyEffects( graph.getNodeProps(nid).get('symbolik_effects',()) )
                 patheffects.extend(effects)
 
                 opcodes.extend( graph.getNodeProps(nid).get('opcodes',() ) )
 
-            if not skippath:
-                # Store off some info into emu meta for analysis to use
-                emu.setMeta('opcodes', opcodes)
-                yield emu, patheffects
+                prefix.append( ((nid, eid), emu.getSymSnapshot(), len(patheffects), len(pathconstraints), len(opcodes)) )
+
+            if skippath:
+                continue
+
+            # Hand out a copy of the emulator ( the caller may keep it )
+            pemu = copy.copy(emu)
+            pemu.setSymInterner(None)
+            pemu.setSymSnapshot(self._copySymSnapshot(emu.getSymSnapshot()))
+
+            # Store off some info into emu meta for analysis to use
+            pemu.setMeta('opcodes', list(opcodes))
+            yield pemu, list(patheffects)
+
+    def _copySymSnapshot(self, snap):
+        meta, symvars, symmem, rseed = snap
+        return ( dict(meta), dict(symvars), dict(symmem), rseed )
 
     def getSymbolikOutputs(self, fva, args=None):
         '''
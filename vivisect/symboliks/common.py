@@ -140,9 +140,16 @@ class SymbolikBase:
         return o_pow(self, other, self.getWidth())
 
     def __hash__(self):
-        return hash(self.solve())
+        return self.getStructHash()
 
     def __eq__(self, other):
+        '''
+        Symbolik objects are equal when they are structurally identical
+        ( use solve() to compare equivalent expressions ).  Comparing to
+        an int compares the solution.
+        '''
+        if other is self:
+            return True
 
         if other == None:
             return False
@@ -150,7 +157,7 @@ class SymbolikBase:
         if type(other) in (int, long):
             return self.solve() == other
 
-        return self.solve() == other.solve()
+        return self.isStructEqual(other)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -198,21 +205,36 @@ class SymbolikBase:
         '''
         Algebraic reduction and operator folding where possible.
 
+        If the given emulator has a SymbolikInterner ( see
+        setSymInterner() ) the reduced tree is interned as it is built.
+
         Example:
             symobj = symobj.reduce()
         '''
+        intr = None
+        if emu != None:
+            intr = emu.getSymInterner()
+
         def doreduce(path,oldkid,ctx):
-            return oldkid._reduce(emu=emu)
-        
-        sym = self.walkTree(doreduce)
+            newkid = oldkid._reduce(emu=emu)
+            if newkid == None:
+                newkid = oldkid
+
+            elif ctx != None and not oldkid.isStructEqual(newkid):
+                ctx['changed'] = True
+
+            if intr != None:
+                newkid = intr.intern(newkid)
+
+            return newkid
+
+        ctx = {'changed':True}
+        sym = self.walkTree(doreduce, ctx=ctx)
         if foo:
-            symstr = str(sym)
-            while True:
-                sym = sym.walkTree(doreduce)
-                s1str = str(sym)
-                if s1str == symstr:
-                    break
-                symstr = s1str
+            # Until a pass leaves the tree structurally unchanged
+            while ctx['changed']:
+                ctx['changed'] = False
+                sym = sym.walkTree(doreduce, ctx=ctx)
 
         return sym
 
@@ -222,6 +244,52 @@ class SymbolikBase:
         '''
         return None
 
+    def _sym_struct(self):
+        '''
+        Return a tuple of the (non-kid) values which, along with the class
+        and the kids, make this symbolik structurally unique.
+        '''
+        return ()
+
+    @symcache
+    def getStructHash(self):
+        '''
+        Return a hash of the structure of this symbolik AST.  Unlike
+        solve(), structurally different but equivalent expressions
+        hash differently.
+        '''
+        kids = tuple([ k.getStructHash() for k in self.kids ])
+        return hash( (self.__class__, self._sym_struct(), kids) )
+
+    def isStructEqual(self, other):
+        '''
+        Returns True if the given symbolik AST is structurally identical
+        to this one ( which is an identity check for interned objects ).
+        '''
+        if other is self:
+            return True
+
+        if not isinstance(other, SymbolikBase):
+            return False
+
+        if self.getStructHash() != other.getStructHash():
+            return False
+
+        if self.__class__ != other.__class__:
+            return False
+
+        if self._sym_struct() != other._sym_struct():
+            return False
+
+        if len(self.kids) != len(other.kids):
+            return False
+
+        for i in xrange(len(self.kids)):
+            if not self.kids[i].isStructEqual(other.kids[i]):
+                return False
+
+        return True
+
     def update(self, emu):
         '''
         Return an updated representation for this symbolik state based on the given
@@ -417,6 +485,9 @@ class Call(SymbolikBase):
         symargs  = [ x.update(emu) for x in self.kids[1:] ]
         return Call(symfunc, self.width, symargs) 
 
+    def _sym_struct(self):
+        return (self.width,)
+
     @symcache
     def isDiscrete(self, emu=None):
         # symbolik calls are *never* discrete
@@ -525,6 +596,9 @@ class Var(SymbolikBase):
     def getWidth(self):
         return self.width
 
+    def _sym_struct(self):
+        return (self.name, self.width)
+
 class LookupVar (Var):
     '''
     A 'LookupVar' is a special kind of variable used to track hardware-level 
@@ -571,6 +645,10 @@ class LookupVar (Var):
 
         return LookupVar(self.name, offset, lookupdict=self.lookupdict, width=self.width)
 
+    def _sym_struct(self):
+        # the offset is not a kid...
+        return (self.name, self.width, repr(self.offset), id(self.lookupdict))
+
     def _reduce(self, emu=None):
         self.offset._reduce(emu=emu) 
         return self
@@ -617,6 +695,9 @@ class Arg(SymbolikBase):
     def update(self, emu):
         return Arg(self.idx, width=self.width)
 
+    def _sym_struct(self):
+        return (self.idx, self.width)
+
     def getWidth(self):
         return self.width
 
@@ -680,6 +761,9 @@ class Const(SymbolikBase):
         return self
         #return Const(self.value, self.width, ptrname=self.ptrname, constname=self.constname)
 
+    def _sym_struct(self):
+        return (self.value, self.width, self.ptrname, self.constname)
+
     @symcache
     def isDiscrete(self, emu=None):
         return True
@@ -731,6 +815,9 @@ class Operator(SymbolikBase):
         v2 = self.kids[1].update(emu)
         return self.__class__(v1, v2, self.width)
 
+    def _sym_struct(self):
+        return (self.width,)
+
     def _solve(self, emu=None, vals=None):
         v1 = self.kids[0].solve(emu=emu, vals=vals)
         v2 = self.kids[1].solve(emu=emu, vals=vals)
@@ -860,3 +947,92 @@ class o_sextend(SymbolikBase):
     def update(self, emu):
         kids = [ k.update(emu) for k in self.kids ]
         return self.__class__(*kids)
+
+class SymbolikInterner:
+    '''
+    An interning table for symbolik ASTs.  Structurally identical
+    expressions interned by the same interner become the same object,
+    so large sets of (mostly similar) expressions share their nodes and
+    may be compared with isStructEqual() by identity.
+
+    NOTE: interned nodes are shared, so in-place modification of an
+          interned tree ( walkTree() / reduce() ) changes it for every
+          tree which shares it.  Modified nodes are re-interned the next
+          time they are seen ( interning is only an optimization, the
+          results of isStructEqual() do not depend on it ).
+
+    Example:
+        intr = SymbolikInterner()
+        sym1 = intr.intern( symexp('(x + 3) * y') )
+        sym2 = intr.intern( symexp('(x + 3) * y') )
+        # sym1 is sym2
+    '''
+    def __init__(self):
+        self._sym_table = {}
+        self._sym_canon = {}    # _sym_id -> table key of canonical objects
+
+    def __len__(self):
+        return len(self._sym_table)
+
+    def clear(self):
+        self._sym_table.clear()
+        self._sym_canon.clear()
+
+    def intern(self, symobj):
+        '''
+        Return the canonical object for the given symbolik AST.  Any
+        kids of the given AST are replaced (in place) with their
+        canonical objects.
+
+        ( subtrees which are already canonical are not walked again and
+        anything which is not a SymbolikBase, such as a Constraint stored
+        in a flag variable, is returned as is )
+        '''
+        if not isinstance(symobj, SymbolikBase):
+            return symobj
+
+        key = self._sym_canon.get(symobj._sym_id)
+        if key != None and key[2] == tuple([ k._sym_id for k in symobj.kids ]):
+            return symobj
+
+        for i in xrange(len(symobj.kids)):
+            oldkid = symobj.kids[i]
+            newkid = self.intern(oldkid)
+            if newkid is not oldkid:
+                symobj.setSymKid(i, newkid)
+
+        return self.internNode(symobj)
+
+    def internNode(self, symobj):
+        '''
+        Return the canonical object for the given symbolik node whose
+        kids are already canonical ( as they are from a depth first
+        walkTree() callback ).
+        '''
+        kidids = tuple([ k._sym_id for k in symobj.kids ])
+        key = (symobj.__class__, symobj._sym_struct(), kidids)
+
+        ret = self._sym_table.get(key)
+        if ret is symobj:
+            return symobj
+
+        # make sure nobody changed the canonical one's kids
+        if ret is None or tuple([ k._sym_id for k in ret.kids ]) != kidids:
+            if ret is not None:
+                self._sym_canon.pop(ret._sym_id, None)
+            self._sym_table[key] = symobj
+            self._sym_canon[symobj._sym_id] = key
+            return symobj
+
+        # a (modified) formerly canonical object may still be shared
+        if self._sym_canon.pop(symobj._sym_id, None) != None:
+            return ret
+
+        # detach the duplicate so our (shared) kids don't keep it alive
+        for kid in symobj.kids:
+            for i, obj in enumerate(kid.parents):
+                if obj is symobj:
+                    kid.parents.pop(i)
+                    break
+
+        return ret
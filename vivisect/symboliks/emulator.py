@@ -23,6 +23,7 @@ class SymbolikEmulator:
         self._sym_rseed = ''
         self._sym_vw = vw
         self._sym_cconvs = {}    # function emulation can be calling convention aware
+        self._sym_intern = None  # optional SymbolikInterner for stored state
 
         self._sym_expr_parser = v_s_expr.SymbolikExpressionParser(defwidth=vw.psize)
 
@@ -39,6 +40,18 @@ class SymbolikEmulator:
           self._sym_mem,
           self._sym_rseed ) = snap
 
+    def setSymInterner(self, intr):
+        '''
+        Set a SymbolikInterner ( or None ) used to intern the symbolik
+        values written to variables / memory ( and reduced with this
+        emulator ) so emulation of many similar paths shares their
+        expression nodes.
+        '''
+        self._sym_intern = intr
+
+    def getSymInterner(self):
+        return self._sym_intern
+
     def setMeta(self, name, val):
         '''
         Store metadata in the emulator instance for later.
@@ -126,11 +139,16 @@ class SymbolikEmulator:
         # FIXME handle write size.. (using isDiscrete?)
         addrval = symaddr.solve(emu=self, vals=vals)
         #sizeval = symsize.solve(slvctx=self)
+        if self._sym_intern != None:
+            symaddr = self._sym_intern.intern(symaddr)
+            symval = self._sym_intern.intern(symval)
         self._sym_mem[addrval] = (symaddr, symval)
 
     def setSymVariable(self, name, symval, width=None):
         if width == None:
             width = self.__width__
+        if self._sym_intern != None:
+            symval = self._sym_intern.intern(symval)
         self._sym_vars[name] = symval
 
     def getSymVariable(self, name, create=True):
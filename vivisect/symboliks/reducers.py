@@ -8,8 +8,8 @@ from vivisect.symboliks.expression import symexp
 
 def ismatch(sym,tmp):
     '''
-    FIXME - eventually optimize this into one match call
-            against a set of trees....
+    NOTE: reduceoper() uses compileRules() / matchRules() to
+          match against all the rules for an operator at once.
 
     Given a sym and s "symbolik template" determine if
     the given sym matches the specified template.
@@ -315,23 +315,189 @@ reducers = {
     ]),
 }
 
+def _tmpBinds(tmp):
+    '''
+    Return a list of (path, name) tuples for the template vars in the
+    given template ( in the order ismatch() visits them ).
+    '''
+    binds = []
+    todo = [ (tmp, ()), ]
+    while todo:
+        t, path = todo.pop()
+        if t.symtype == SYMT_VAR:
+            binds.append( (path, t.name) )
+            continue
+
+        if t.symtype & SYMT_OPER:
+            todo.append( (t.kids[0], path + (0,)) )
+            todo.append( (t.kids[1], path + (1,)) )
+
+    return binds
+
+def _tmpKeys(tmp):
+    '''
+    Return the (preorder) list of discrimination keys for a template.
+    '''
+    keys = []
+    todo = [tmp,]
+    while todo:
+        t = todo.pop()
+        if t.symtype == SYMT_VAR:
+            if t.name.startswith('c'):
+                keys.append('c')
+            elif t.name.startswith('x'):
+                keys.append('x')
+            else:
+                keys.append('v')
+            continue
+
+        if t.symtype & SYMT_OPER:
+            keys.append(t.symtype)
+            todo.append(t.kids[1])
+            todo.append(t.kids[0])
+            continue
+
+        if t.symtype == SYMT_CONST:
+            keys.append( ('k', t.value) )
+            continue
+
+        raise Exception(str(t))
+
+    return keys
+
+def compileRules(rules):
+    '''
+    Compile a list of (symtmp, reducer) rules ( as returned by
+    xpandrules() ) into a discrimination tree which matchRules() may
+    use to find the first matching rule in a single pass over a sym.
+
+    Each tree node is an [ edges, leaves ] list where edges maps a
+    key to the next node and leaves is a list of rule indexes.  Keys
+    are an operator symtype, ('k', value) for a specific constant,
+    or 'c', 'x', 'v' for a const, non-const or any expression.
+    '''
+    root = [ {}, [] ]
+    binds = []
+    for i, (symtmp, reducer) in enumerate(rules):
+        node = root
+        for key in _tmpKeys(symtmp):
+            nextnode = node[0].get(key)
+            if nextnode == None:
+                nextnode = [ {}, [] ]
+                node[0][key] = nextnode
+            node = nextnode
+
+        node[1].append(i)
+        binds.append( _tmpBinds(symtmp) )
+
+    return root, binds, rules
+
+def _bindRule(sym, binds):
+    ret = {}
+    for path, name in binds:
+        s = sym
+        for i in path:
+            s = s.kids[i]
+
+        # haz? if so, require equality...
+        haz = ret.get(name)
+        if haz is not None and haz.solve() != s.solve():
+            return None
+
+        ret[name] = s
+
+    # replace all consts with their solved values...
+    for k,v in ret.items():
+        if k.startswith('c'):
+            ret[k] = v.solve()
+
+    return ret
+
+def matchRules(sym, comp):
+    '''
+    Find the first rule in a compiled rule set ( see compileRules() )
+    which matches the given sym.
+
+    Returns: None or a (reducer, match) tuple where match is
+             the same dict ismatch() would return.
+    '''
+    root, binds, rules = comp
+
+    symwidth = sym.getWidth()
+
+    found = []
+    # pending syms are a (sym, rest) linked list in preorder
+    todo = [ (root, (sym, None)), ]
+    while todo:
+        node, pending = todo.pop()
+        edges, leaves = node
+        if pending == None:
+            found.extend(leaves)
+            continue
+
+        s, rest = pending
+        if s.symtype == SYMT_CONST:
+            for key in ( ('k', s.value), 'c', 'v' ):
+                nextnode = edges.get(key)
+                if nextnode != None:
+                    todo.append( (nextnode, rest) )
+            continue
+
+        if s.getWidth() != symwidth:
+            continue
+
+        for key in ('x', 'v'):
+            nextnode = edges.get(key)
+            if nextnode != None:
+                todo.append( (nextnode, rest) )
+
+        if s.symtype & SYMT_OPER:
+            nextnode = edges.get(s.symtype)
+            if nextnode != None:
+                todo.append( (nextnode, (s.kids[0], (s.kids[1], rest))) )
+
+    # Structure matches, now check repeated vars in rule order
+    found.sort()
+    for i in found:
+        m = _bindRule(sym, binds[i])
+        if m != None:
+            return rules[i][1], m
+
+    return None
+
+# symtype -> (rules, rulecount, compiled) ( recompiled if reducers changes )
+_compiled = {}
+
+def getCompiledRules(symtype):
+    rules = reducers.get(symtype)
+    if not rules:
+        return None
+
+    comp = _compiled.get(symtype)
+    if comp == None or comp[0] is not rules or comp[1] != len(rules):
+        comp = (rules, len(rules), compileRules(rules))
+        _compiled[symtype] = comp
+
+    return comp[2]
+
 def reduceoper(sym,emu=None):
     '''
     Apply the current set of operator reducers to the given
     SymbolikBase.  Sym *must* be an instance of the
     Operator(SymbolikBase) class..
     '''
-    if not reducers.get(sym.symtype):
+    comp = getCompiledRules(sym.symtype)
+    if comp == None:
         return
-    for symtmp,reducer in reducers.get(sym.symtype):
-        m = ismatch(sym,symtmp)
-        if m != None:
-            #print 'MATCH',str(symtmp)
-            ret = reducer(m,emu=emu)
-            # do this to much simplify reducers...
-            if type(ret) in (int,long):
-                ret = Const(ret,sym.getWidth())
-            return ret
+
+    match = matchRules(sym, comp)
+    if match != None:
+        reducer, m = match
+        ret = reducer(m,emu=emu)
+        # do this to much simplify reducers...
+        if type(ret) in (int,long):
+            ret = Const(ret,sym.getWidth())
+        return ret
 
 if __name__ == '__main__':
 
@@ -0,0 +1,79 @@
+import unittest
+
+import vivisect
+import vivisect.tools.graphutil as viv_graph
+import vivisect.symboliks.analysis as vsym_analysis
+
+from vivisect.symboliks.common import *
+
+def getBranchyWorkspace(count=4):
+    '''
+    Build an i386 workspace with a function made of count
+    "if (ecx == i) eax += 1" diamonds ( 2 ** count paths ).
+    '''
+    code = '5589e5' '31c0'                  # push ebp; mov ebp,esp; xor eax,eax
+    for i in xrange(count):
+        code += '83f9%.2x' % i              # cmp ecx,i
+        code += '7403'                      # jz +3
+        code += '83c001'                    # add eax,1
+    code += '5dc3'                          # pop ebp; ret
+
+    vw = vivisect.VivWorkspace()
+    vw.setMeta('Architecture', 'i386')
+    vw.addMemoryMap(0x41410000, 7, 'code', code.decode('hex') + '\x00' * 32)
+    vw.addFuncAnalysisModule('vivisect.analysis.generic.codeblocks')
+    vw.addFuncAnalysisModule('vivisect.analysis.i386.calling')
+    vw.makeFunction(0x41410000)
+    return vw
+
+class SymbolikPathsTest(unittest.TestCase):
+
+    def renderPath(self, emu, effects):
+        return ([ str(eff) for eff in effects ],
+                sorted([ (name, str(sym)) for name, sym in emu.getSymVariables() ]),
+                [ op.va for op in emu.getMeta('opcodes') ])
+
+    def test_symboliks_paths_shared_prefix(self):
+        vw = getBranchyWorkspace()
+        fva = 0x41410000
+        ctx = vsym_analysis.getSymbolikAnalysisContext(vw)
+        graph = ctx.getSymbolikGraph(fva)
+
+        # Run every path from scratch for comparison
+        args = [ Arg(i, width=vw.psize) for i in xrange(len(vw.getFunctionArgs(fva))) ]
+        expected = []
+        for path in viv_graph.getCodePaths(graph):
+            emu = ctx.getFuncEmu(fva, fargs=args)
+            effects = []
+            opcodes = []
+            for nid, eid in path:
+                if eid != None:
+                    cons = emu.applyEffects(graph.getEdgeProps(eid).get('symbolik_constraints', ()))
+                    effects.extend(cons)
+                effects.extend(emu.applyEffects(graph.getNodeProps(nid).get('symbolik_effects', ())))
+                opcodes.extend(graph.getNodeProps(nid).get('opcodes', ()))
+            emu.setMeta('opcodes', opcodes)
+            expected.append(self.renderPath(emu, effects))
+
+        paths = list(ctx.getSymbolikPaths(fva, graph=graph))
+        self.assertEqual(len(paths), 16)
+        self.assertEqual([ self.renderPath(emu, effs) for emu, effs in paths ], expected)
+
+        # Each path gets its own emulator state
+        eaxs = set([ emu.getSymVariable('eax').reduce().solve() for emu, effs in paths ])
+        self.assertEqual(eaxs, set(range(5)))
+
+    def test_symboliks_paths_interned(self):
+        vw = getBranchyWorkspace()
+        ctx = vsym_analysis.getSymbolikAnalysisContext(vw)
+
+        # Paths with the same number of adds build the same eax
+        eaxs = {}
+        for emu, effs in ctx.getSymbolikPaths(0x41410000):
+            self.assertIsNone(emu.getSymInterner())
+            eax = emu.getSymVariable('eax')
+            eaxs.setdefault(str(eax), []).append(eax)
+
+        self.assertEqual(sorted([ len(syms) for syms in eaxs.values() ]), [1, 1, 4, 4, 6])
+        for syms in eaxs.values():
+            self.assertEqual(len(set([ id(sym) for sym in syms ])), 1)
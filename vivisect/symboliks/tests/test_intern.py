@@ -0,0 +1,118 @@
+import unittest
+
+import vivisect
+import vivisect.symboliks.archs.i386 as vsym_i386
+import vivisect.symboliks.constraints as vsym_cons
+
+from vivisect.const import *
+from vivisect.symboliks.common import *
+from vivisect.symboliks.expression import symexp
+
+class TestSymbolikIntern(unittest.TestCase):
+
+    def test_symboliks_struct_hash(self):
+        s1 = symexp('(x + 3) * y')
+        s2 = symexp('(x + 3) * y')
+        s3 = symexp('(3 + x) * y')
+
+        self.assertEqual(s1.getStructHash(), s2.getStructHash())
+        self.assertTrue(s1.isStructEqual(s2))
+
+        # equivalent but not structurally identical
+        self.assertEqual(s1, s2)
+        self.assertEqual(hash(s1), hash(s2))
+        self.assertNotEqual(s1, s3)
+        self.assertEqual(s1.solve(), s3.solve())
+        self.assertFalse(s1.isStructEqual(s3))
+        self.assertEqual(symexp('x + 3'), symexp('x + 3').solve())
+
+        self.assertFalse(Var('x', 4).isStructEqual(Var('x', 8)))
+        self.assertFalse(Var('x', 4).isStructEqual(Const(3, 4)))
+
+    def test_symboliks_struct_hash_walktree(self):
+        s = symexp('x + 30')
+        h1 = s.getStructHash()
+
+        def swapx(path,sym,ctx):
+            if sym.symtype == SYMT_VAR and sym.name == 'x':
+                return Var('y',4)
+
+        s = s.walkTree(swapx)
+        self.assertNotEqual(s.getStructHash(), h1)
+        self.assertEqual(s.getStructHash(), symexp('y + 30').getStructHash())
+
+    def test_symboliks_intern(self):
+        intr = SymbolikInterner()
+
+        s1 = intr.intern( symexp('((x + 3) * y) ^ (x + 3)') )
+        s2 = intr.intern( symexp('((x + 3) * y) ^ (x + 3)') )
+        s3 = intr.intern( symexp('(x + 3) * z') )
+
+        self.assertIs(s1, s2)
+        self.assertIs(s1.kids[0].kids[0], s1.kids[1])
+        self.assertIs(s3.kids[0], s1.kids[1])
+        self.assertEqual(str(s1), '(((x + 3) * y) ^ (x + 3))')
+
+        # duplicates are detached from the shared kids
+        xplus3 = s1.kids[1]
+        self.assertEqual(len(xplus3.parents), 3)
+        self.assertEqual(len(xplus3.kids[0].parents), 1)
+
+    def test_symboliks_intern_modified(self):
+        intr = SymbolikInterner()
+
+        s1 = intr.intern( symexp('x + 3') )
+        s1 = s1.walkTree(lambda path,sym,ctx: Var('y',4) if str(sym) == 'x' else None)
+
+        # the stale canonical entry must not be handed out
+        s2 = intr.intern( symexp('x + 3') )
+        self.assertEqual(str(s2), '(x + 3)')
+        self.assertIsNot(s1, s2)
+
+    def test_symboliks_reduce_fixpoint(self):
+        sym = symexp('((foo & 0xff) & 0xff) & 0xff').reduce(foo=True)
+        self.assertEqual(str(sym), '(foo & 255)')
+
+        # takes three passes
+        sym = symexp('(x + (x + 3)) + (x * 2)')
+        self.assertEqual(str(sym.reduce(foo=True)), '((x * 4) + 3)')
+
+    def test_symboliks_reduce_fixpoint_collision(self):
+        # every tree hashes the same, so only structure may end the passes
+        gethash = SymbolikBase.getStructHash
+        SymbolikBase.getStructHash = lambda self: 0
+        try:
+            sym = symexp('(x + (x + 3)) + (x * 2)').reduce(foo=True)
+            self.assertEqual(str(sym), '((x * 4) + 3)')
+            sym = symexp('(3 + (3 - x)) + x').reduce(foo=True)
+            self.assertEqual(str(sym), '6')
+        finally:
+            SymbolikBase.getStructHash = gethash
+
+    def test_symboliks_intern_emu(self):
+        vw = vivisect.VivWorkspace()
+        vw.setMeta('Architecture', 'i386')
+        emu = vsym_i386.i386SymFuncEmu(vw)
+
+        intr = SymbolikInterner()
+        emu.setSymInterner(intr)
+        emu.setSymVariable('eax', symexp('(x + 3) * y'))
+        emu.setSymVariable('ebx', symexp('(x + 3) * y'))
+        emu.setSymVariable('ecx', symexp('(x + 3) ^ z'))
+        emu.writeSymMemory(Const(0x41414141, 4), symexp('(x + 3) * y'))
+
+        eax = emu.getSymVariable('eax')
+        self.assertIs(eax, emu.getSymVariable('ebx'))
+        self.assertIs(eax.kids[0], emu.getSymVariable('ecx').kids[0])
+        self.assertIs(eax, emu.readSymMemory(Const(0x41414141, 4), Const(4, 4)))
+
+        # reductions with the emulator are interned too
+        red = symexp('((x + 1) + 2) * y').reduce(emu=emu)
+        self.assertIs(red, eax)
+        red = symexp('(x + 3) * (y * 1)').reduce(emu=emu, foo=True)
+        self.assertIs(red, eax)
+
+        # values which are not symboliks ( such as flag constraints )
+        cons = vsym_cons.eq(Var('x', 4), Const(3, 4))
+        emu.setSymVariable('ZF', cons)
+        self.assertIs(emu.getSymVariable('ZF'), cons)
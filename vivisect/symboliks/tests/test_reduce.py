@@ -1,8 +1,43 @@
+import os
+import time
 import unittest
 
+import vivisect
+import vivisect.symboliks.reducers as vsym_reducers
+import vivisect.symboliks.analysis as vsym_analysis
+
 from vivisect.symboliks.common import *
 from vivisect.symboliks.expression import symexp
 
+def getArithSymboliks(rounds=16):
+    '''
+    Return the (unreduced) symbolik effects from an i386 function made
+    of rounds of add/sub/and/or/xor/shl on eax.
+    '''
+    code = '5589e5' '8b4508'            # push ebp; mov ebp,esp; mov eax,[ebp+8]
+    for i in xrange(rounds):
+        code += '83c010' '83e804'       # add eax,16; sub eax,4
+        code += '25ff000000'            # and eax,0xff
+        code += '0d00010000'            # or eax,0x100
+        code += '3555000000'            # xor eax,0x55
+        code += 'c1e002'                # shl eax,2
+        code += '01c8' '29c8'           # add eax,ecx; sub eax,ecx
+        code += '83c001'                # add eax,1
+    code += '5dc3'                      # pop ebp; ret
+
+    vw = vivisect.VivWorkspace()
+    vw.setMeta('Architecture', 'i386')
+    vw.addMemoryMap(0x41410000, 7, 'code', code.decode('hex') + '\x00' * 32)
+    vw.addFuncAnalysisModule('vivisect.analysis.generic.codeblocks')
+    vw.addFuncAnalysisModule('vivisect.analysis.i386.calling')
+    vw.makeFunction(0x41410000)
+
+    ctx = vsym_analysis.getSymbolikAnalysisContext(vw)
+    ret = []
+    for emu, effects in ctx.getSymbolikPaths(0x41410000):
+        ret.extend([ sym for name, sym in emu.getSymVariables() ])
+    return ret
+
 class TestReduceCase(unittest.TestCase):
     '''
     tests the reduction of asts consisting of add's and sub's if widths are
@@ -109,3 +144,77 @@ class TestReduceCase(unittest.TestCase):
         self.assertReduce('0 + (0 + foo)','foo')
         self.assertReduce('0 - (0 + foo)','0 - foo')
 
+
+class TestReduceCompiled(unittest.TestCase):
+
+    def getOperators(self):
+        opers = []
+        def cb(path, sym, ctx):
+            if sym.symtype & SYMT_OPER:
+                opers.append(sym)
+
+        for sym in getArithSymboliks():
+            sym.walkTree(cb)
+        return opers
+
+    def matchSequential(self, sym):
+        for symtmp, reducer in vsym_reducers.reducers.get(sym.symtype, ()):
+            m = vsym_reducers.ismatch(sym, symtmp)
+            if m != None:
+                return reducer, m
+
+    def test_symboliks_reduce_compiled_matches(self):
+        opers = self.getOperators()
+        self.assertTrue(len(opers) > 100)
+
+        hits = 0
+        for sym in opers:
+            seq = self.matchSequential(sym)
+            comp = vsym_reducers.getCompiledRules(sym.symtype)
+            if comp == None:
+                self.assertIsNone(seq)
+                continue
+
+            fast = vsym_reducers.matchRules(sym, comp)
+            if seq == None:
+                self.assertIsNone(fast)
+                continue
+
+            hits += 1
+            self.assertIs(fast[0], seq[0])
+            self.assertEqual(sorted(fast[1].keys()), sorted(seq[1].keys()))
+            for name, val in seq[1].items():
+                if name.startswith('c'):
+                    self.assertEqual(fast[1][name], val)
+                else:
+                    self.assertIs(fast[1][name], val)
+
+        self.assertTrue(hits > 0)
+
+    def test_symboliks_reduce_compiled_repeated(self):
+        # repeated template vars must still be equal
+        self.assertReduceStr('(foo + bar) + foo', '(bar + (foo * 2))')
+        self.assertReduceStr('(foo + bar) + baz', '((foo + bar) + baz)')
+        self.assertReduceStr('foo ^ foo', '0')
+        self.assertReduceStr('foo ^ bar', '(foo ^ bar)')
+
+    def assertReduceStr(self, s1, s2):
+        self.assertEqual(str(symexp(s1).reduce()), s2)
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_symboliks_reduce_compiled_bench(self):
+        opers = self.getOperators() * 20
+
+        start = time.time()
+        for sym in opers:
+            self.matchSequential(sym)
+        seqtime = time.time() - start
+
+        start = time.time()
+        for sym in opers:
+            comp = vsym_reducers.getCompiledRules(sym.symtype)
+            if comp != None:
+                vsym_reducers.matchRules(sym, comp)
+        comptime = time.time() - start
+
+        print('reducer match: %d opers sequential %.3fs compiled %.3fs' % (len(opers), seqtime, comptime))
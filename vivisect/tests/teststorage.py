@@ -0,0 +1,181 @@
+import os
+import tempfile
+import unittest
+
+import vivisect
+import vivisect.base as viv_base
+import vivisect.storage.streamfile as viv_streamfile
+import vivisect.tests.testworkspace as viv_testworkspace
+
+from vivisect.const import *
+
+def getWorkspaceState(vw):
+    return (sorted(vw.getLocations()),
+            sorted(vw.getXrefs()),
+            sorted(vw.getFunctions()),
+            sorted(vw.getNames()),
+            sorted(vw.getComments()),
+            [ vw.getFunctionMetaDict(fva) for fva in sorted(vw.getFunctions()) ])
+
+class StreamFileTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp(suffix='.viv')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.fname)
+
+    def getAnalyzedWorkspace(self):
+        vw = viv_testworkspace.getSampleFuncsWorkspace(count=4)
+        vw.setMeta('Format', 'blob')
+        vw.setMeta('StorageModule', 'vivisect.storage.streamfile')
+        vw.setMeta('StorageName', self.fname)
+        vw.analyze()
+        return vw
+
+    def loadWorkspace(self):
+        # The default ( basicfile ) storage module hands off to streamfile
+        vw = vivisect.VivWorkspace()
+        vw.loadWorkspace(self.fname)
+        return vw
+
+    def test_vivisect_streamfile_save_load(self):
+        vw = self.getAnalyzedWorkspace()
+        vw.saveWorkspace()
+
+        vw2 = self.loadWorkspace()
+        self.assertEqual(getWorkspaceState(vw2), getWorkspaceState(vw))
+        self.assertEqual(vw2.getMeta('StorageModule'), 'vivisect.storage.streamfile')
+
+    def test_vivisect_streamfile_changes(self):
+        vw = self.getAnalyzedWorkspace()
+        vw.saveWorkspace()
+
+        vw.makeName(0x41410000, 'woot')
+        vw.makeName(0x41410000, 'woot2')
+        vw.setComment(0x41410020, 'hi')
+        vw.saveWorkspace(fullsave=False)
+
+        vw2 = self.loadWorkspace()
+        self.assertEqual(vw2.getName(0x41410000), 'woot2')
+        self.assertEqual(vw2.vaByName('woot'), None)
+        self.assertEqual(getWorkspaceState(vw2), getWorkspaceState(vw))
+
+    def test_vivisect_streamfile_snapshot(self):
+        snapinterval = viv_streamfile.snapinterval
+        viv_streamfile.snapinterval = 2
+        try:
+            vw = self.getAnalyzedWorkspace()
+            vw.saveWorkspace()
+
+            for i in xrange(4):
+                vw.makeName(0x41410020, 'name%d' % i)
+                vw.saveWorkspace(fullsave=False)
+
+        finally:
+            viv_streamfile.snapinterval = snapinterval
+
+        f = file(self.fname, 'rb')
+        frames = viv_streamfile._readFrames(f, self.fname)
+        f.close()
+
+        # Each new snapshot replaced the frames before it
+        self.assertEqual([ fr[0] for fr in frames if fr[0] in ('SNAP', 'SEND', 'EVTS') ], [ 'SNAP', 'SEND' ])
+
+        # The last snapshot dropped the superseded names ( but kept the
+        # one in use when the function was added )
+        events = viv_streamfile.vivEventsFromFile(self.fname)
+        names = [ einfo for event, einfo in events if event == VWE_SETNAME and einfo[0] == 0x41410020 ]
+        self.assertEqual(names, [ (0x41410020, 'sub_41410020'), (0x41410020, 'name3') ])
+
+        vw2 = self.loadWorkspace()
+        self.assertEqual(getWorkspaceState(vw2), getWorkspaceState(vw))
+
+    def test_vivisect_streamfile_state(self):
+        vw = self.getAnalyzedWorkspace()
+        vw.setComment(0x41410020, 'hi')
+        vw.saveWorkspace()
+
+        vw.makeName(0x41410000, 'woot')
+        vw.saveWorkspace(fullsave=False)
+
+        # The snapshot tables are loaded rather than replayed
+        fired = []
+        def countEvent(einfo):
+            fired.append(einfo)
+
+        vw2 = vivisect.VivWorkspace()
+        for event in viv_base.state_events:
+            vw2.ehand[event] = countEvent
+        vw2.loadWorkspace(self.fname)
+        self.assertEqual(fired, [ (0x41410000, 'woot') ])
+
+        vw2 = self.loadWorkspace()
+        self.assertEqual(getWorkspaceState(vw2), getWorkspaceState(vw))
+
+        # The event list matches a full replay ( for later saves )
+        replay = vivisect.VivWorkspace()
+        replay.importWorkspace(viv_streamfile.vivEventsFromFile(self.fname))
+        events = replay.exportWorkspace()
+        self.assertEqual(vw2.exportWorkspace()[:len(events)], events)
+        for fva in vw.getFunctions():
+            self.assertEqual(vw2.getCodeBlocks(), vw.getCodeBlocks())
+            self.assertEqual(vw2.getFunctionBlocks(fva), vw.getFunctionBlocks(fva))
+            self.assertEqual(vw2.getFunctionArgs(fva), vw.getFunctionArgs(fva))
+        self.assertEqual(sorted(vw2.getCallGraph().getNodes()), sorted(vw.getCallGraph().getNodes()))
+
+        # and later changes / saves still work
+        vw2.makeName(0x41410020, 'woot2')
+        vw2.saveWorkspace()
+        vw3 = self.loadWorkspace()
+        self.assertEqual(vw3.getName(0x41410020), 'woot2')
+        self.assertEqual(vw3.getComment(0x41410020), 'hi')
+
+    def test_vivisect_streamfile_truncated(self):
+        vw = self.getAnalyzedWorkspace()
+        vw.saveWorkspace()
+        size = os.path.getsize(self.fname)
+
+        vw.makeName(0x41410000, 'woot')
+        vw.saveWorkspace(fullsave=False)
+
+        # A partial write of the last frame is ignored
+        f = file(self.fname, 'r+b')
+        f.truncate(os.path.getsize(self.fname) - 4)
+        f.close()
+
+        vw2 = self.loadWorkspace()
+        self.assertEqual(vw2.getName(0x41410000), 'sub_41410000')
+
+        # and overwritten by the next save
+        vw.makeName(0x41410020, 'woot2')
+        vw.saveWorkspace(fullsave=False)
+        vw2 = self.loadWorkspace()
+        self.assertEqual(vw2.getName(0x41410020), 'woot2')
+
+    def test_vivisect_streamfile_compact(self):
+        loc = (0x41410000, 1, LOC_OP, 0)
+        nloc = (0x41410000, 1, LOC_OP, 1)
+        events = [
+            (VWE_ADDLOCATION, loc),
+            (VWE_SETNAME, (0x41410000, 'foo')),
+            (VWE_ADDXREF, (0x41410000, 0x41410010, REF_CODE, 0)),
+            (VWE_ADDXREF, (0x41410000, 0x41410010, REF_CODE, 0)),
+            (VWE_SETNAME, (0x41410000, 'bar')),
+            (VWE_DELLOCATION, loc),
+            (VWE_ADDLOCATION, nloc),
+            (VWE_SETNAME, (0x41410010, 'baz')),
+            (VWE_SETNAME, (0x41410020, 'baz')),
+            (VWE_SETNAME, (0x41410010, 'qux')),
+            (VWE_COMMENT, (0x41410000, 'hi')),
+            (VWE_COMMENT, (0x41410000, None)),
+        ]
+        self.assertEqual(viv_streamfile.compactEvents(events), [
+            (VWE_ADDXREF, (0x41410000, 0x41410010, REF_CODE, 0)),
+            (VWE_SETNAME, (0x41410000, 'bar')),
+            (VWE_ADDLOCATION, nloc),
+            (VWE_SETNAME, (0x41410010, 'baz')),
+            (VWE_SETNAME, (0x41410020, 'baz')),
+            (VWE_SETNAME, (0x41410010, 'qux')),
+        ])
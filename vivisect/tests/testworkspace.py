@@ -0,0 +1,527 @@
+import os
+import time
+import random
+import struct
+import unittest
+
+import envi
+import envi.bits as e_bits
+import vivisect
+import vivisect.tests.samplecode as samplecode
+
+from vivisect.const import *
+
+def getSampleWorkspace():
+    vw = vivisect.VivWorkspace()
+    vw.setMeta('Architecture','i386')
+    vw.addMemoryMap(0x41410000, 7, 'none', samplecode.func1 + '\x00' * 32)
+    return vw
+
+def getSampleFuncsWorkspace(count=16):
+    '''
+    A workspace with count copies of samplecode.func1 as entry points
+    and the i386 codeblocks / calling function modules.
+    '''
+    vw = vivisect.VivWorkspace()
+    vw.setMeta('Architecture','i386')
+    vw.addMemoryMap(0x41410000, 7, 'none', (samplecode.func1 + '\xcc' * 6) * count + '\x00' * 32)
+    for i in xrange(count):
+        vw.addEntryPoint(0x41410000 + (i * 32))
+
+    vw.addFuncAnalysisModule('vivisect.analysis.generic.codeblocks')
+    vw.addFuncAnalysisModule('vivisect.analysis.i386.calling', parallel=True)
+    return vw
+
+def getEmuCodeWorkspace(count=48):
+    '''
+    A workspace with count (undefined) copies of samplecode.func1 and
+    a string, which are only referenced by pointers in a data map.
+    '''
+    vw = vivisect.VivWorkspace()
+    vw.setMeta('Architecture','i386')
+    code = (samplecode.func1 + '\xcc' * 6) * count
+    vw.addMemoryMap(0x41410000, 7, 'code', code + 'this is a string\x00' + '\x00' * 32)
+
+    ptrs = [ 0x41410000 + (i * 32) for i in xrange(count) ] + [ 0x41410000 + len(code) ]
+    vw.addMemoryMap(0x41420000, 6, 'data', struct.pack('<%dI' % len(ptrs), *ptrs) + '\x00' * 32)
+    return vw
+
+def getPointersWorkspace(arch='i386', count=2000):
+    '''
+    A workspace with two maps of random bytes and (unaligned) pointers
+    into them, with a few locations defined.
+    '''
+    rand = random.Random(count)
+    vw = vivisect.VivWorkspace()
+    vw.setMeta('Architecture', arch)
+    fmt = e_bits.le_fmt_chars[vw.psize]
+
+    parts = []
+    for i in xrange(count):
+        if rand.random() < 0.3:
+            parts.append(struct.pack(fmt, rand.choice((0x41410000, 0x41420000)) + rand.randint(0, 0xfff)))
+        else:
+            parts.append(chr(rand.randint(0, 255)) * rand.randint(1, 5))
+
+    bytez = ''.join(parts)[:0xf000]
+    vw.addMemoryMap(0x41410000, 7, 'a', bytez)
+    vw.addMemoryMap(0x41420000, 7, 'b', bytez[:0x1000])
+
+    for i in xrange(count / 20):
+        va = 0x41410000 + (rand.randint(0, len(bytez) - 16) & ~3)
+        if vw.getLocation(va) == None and vw.getLocation(va + 7) == None:
+            vw.makeNumber(va, 8)
+
+    return vw
+
+def slowFindPointers(vw):
+    # The per-byte findPointers loop
+    ret = []
+    size = vw.psize
+    for mva, msize, mperm, mname in vw.getMemoryMaps():
+        offset, bytez = vw.getByteDef(mva)
+        maxsize = len(bytez) - size
+        while offset + size < maxsize:
+            va = mva + offset
+            loctup = vw.getLocation(va)
+            if loctup != None:
+                offset = loctup[L_VA] + loctup[L_SIZE] - mva
+                continue
+
+            x = e_bits.parsebytes(bytez, offset, size)
+            if vw.isValidPointer(x):
+                ret.append((va, x))
+                offset += size
+                continue
+
+            offset += 1
+    return ret
+
+class VivWorkspaceTest(unittest.TestCase):
+
+    def test_vivisect_opcache(self):
+        vw = getSampleWorkspace()
+
+        op1 = vw.parseOpcode(0x41410000)
+        self.assertEqual(vw.getOpcodeCacheStats(), (0, 1))
+
+        op2 = vw.parseOpcode(0x41410000)
+        self.assertIs(op1, op2)
+        self.assertEqual(vw.getOpcodeCacheStats(), (1, 1))
+
+        # explicit arch shares the default entry
+        op3 = vw.parseOpcode(0x41410000, arch=envi.ARCH_I386)
+        self.assertIs(op1, op3)
+
+        # writes invalidate the cache
+        vw.writeMemory(0x41410000, '\x90')
+        op4 = vw.parseOpcode(0x41410000)
+        self.assertEqual(op4.mnem, 'nop')
+
+    def test_vivisect_written_map(self):
+        vw = getSampleWorkspace()
+        vw.writeMemory(0x41410000, '\x90')
+
+        # After a write getByteDef gives a buffer ( which has no find() )
+        mva, msize, mperms, mname = vw.getMemoryMap(0x41410000)
+        strva = mva + msize - 16
+        vw.writeMemory(strva, 'visi\x00')
+        vw.writeMemory(strva + 8, 'v\x00i\x00\x00\x00')
+        self.assertEqual(vw.asciiStringSize(strva), 5)
+        self.assertEqual(vw.uniStringSize(strva + 8), 5)
+        self.assertEqual(vw.parseNumber(strva, 4), 0x69736976)
+
+    def test_vivisect_opcache_bounded(self):
+        vw = getSampleWorkspace()
+        vw.setOpcodeCacheSize(2)
+
+        vw.parseOpcode(0x41410000)
+        vw.parseOpcode(0x41410001)
+        vw.parseOpcode(0x41410000)
+        vw.parseOpcode(0x41410003)
+
+        # 0x41410001 was the least recently used
+        vw.parseOpcode(0x41410000)
+        self.assertEqual(vw.getOpcodeCacheStats(), (2, 3))
+        vw.parseOpcode(0x41410001)
+        self.assertEqual(vw.getOpcodeCacheStats(), (2, 4))
+
+    def test_vivisect_opcache_emulator(self):
+        vw = getSampleWorkspace()
+        vw.makeFunction(0x41410000)
+
+        hits, misses = vw.getOpcodeCacheStats()
+
+        emu = vw.getEmulator()
+        emu.runFunction(0x41410000, maxhit=1)
+
+        # The emulator should not decode anything the workspace already has
+        self.assertEqual(vw.getOpcodeCacheStats()[1], misses)
+
+    def test_vivisect_analyze_parallel(self):
+        serial = getSampleFuncsWorkspace()
+        serial.analyze()
+
+        vw = getSampleFuncsWorkspace()
+        vw.config.viv.analysis.parallel.workers = 2
+        vw.analyze()
+
+        self.assertEqual(len(vw.getFunctions()), 16)
+        self.assertEqual(vw._fmod_deferred, None)
+        self.assertEqual(sorted(vw.getFunctions()), sorted(serial.getFunctions()))
+        self.assertEqual(sorted(vw.getLocations()), sorted(serial.getLocations()))
+        self.assertEqual(sorted(vw.getXrefs()), sorted(serial.getXrefs()))
+        for fva in serial.getFunctions():
+            self.assertEqual(vw.getFunctionMetaDict(fva), serial.getFunctionMetaDict(fva))
+            self.assertEqual(vw.getFunctionArgs(fva), serial.getFunctionArgs(fva))
+            self.assertEqual(vw.getFunctionLocals(fva), serial.getFunctionLocals(fva))
+
+    def test_vivisect_analyze_parallel_noret(self):
+
+        def getThunkWorkspace():
+            vw = vivisect.VivWorkspace()
+            vw.setMeta('Architecture','i386')
+            # jmp [0x41420000] ; call thunk ; nop ; ret ( x2 )
+            thunk = '\xff\x25\x00\x00\x42\x41'.ljust(16, '\xcc')
+            call1 = '\xe8' + struct.pack('<i', -0x15) + '\x90\xc3'
+            call2 = '\xe8' + struct.pack('<i', -0x25) + '\x90\xc3'
+            vw.addMemoryMap(0x41410000, 7, 'code', thunk + call1.ljust(16, '\xcc') + call2 + '\xcc' * 16)
+            vw.addMemoryMap(0x41420000, 6, 'imps', '\x00' * 16)
+
+            # Only the regex matches the thunk ( it is not in NoReturnApis )
+            vw.addNoReturnApiRegex('kernel32.exit.*')
+            vw.makeImport(0x41420000, 'kernel32', 'ExitProcess')
+
+            vw.addEntryPoint(0x41410000)
+            vw.addEntryPoint(0x41410010)
+
+            # The default blob modules ( and the i386 calling module )
+            vw.setMeta('Format', 'blob')
+            vivisect.analysis.addAnalysisModules(vw)
+            vw.addFuncAnalysisModule('vivisect.analysis.i386.calling')
+            return vw
+
+        def getTables(vw):
+            funcs = sorted(vw.getFunctions())
+            return (sorted(vw.getLocations()),
+                    sorted(vw.getCodeBlocks()),
+                    sorted(vw.getXrefs()),
+                    funcs,
+                    [ vw.getFunctionMetaDict(fva) for fva in funcs ],
+                    [ vw.getFunctionApi(fva) for fva in funcs ])
+
+        serial = None
+        for workers in (0, 2):
+            vw = getThunkWorkspace()
+            vw.config.viv.analysis.parallel.workers = workers
+            vw.analyze()
+
+            # Parallel analysis must give exactly the serial results
+            tables = getTables(vw)
+            if serial == None:
+                serial = tables
+            self.assertEqual(tables, serial)
+
+            self.assertEqual(vw.getLocation(0x41410015), None)
+            self.assertEqual(vw.getCodeBlock(0x41410010)[1], 5)
+
+            self.assertEqual(vw.getFunctionMeta(0x41410000, 'Thunk'), 'kernel32.ExitProcess')
+            self.assertTrue(vw.isNoReturnVa(0x41410000))
+            self.assertTrue(vw.cfctx._cf_noret.get(0x41410000))
+
+            # Code flow after the analysis must stop at calls to the thunk
+            vw.makeFunction(0x41410020)
+            self.assertTrue(vw.isLocType(0x41410020, LOC_OP))
+            self.assertEqual(vw.getLocation(0x41410025), None)
+
+    def test_vivisect_parallel_replay(self):
+        import vivisect.parallel as viv_parallel
+
+        vw = getSampleWorkspace()
+        loc = (0x41410000, 1, LOC_NUMBER, None)
+        meta = (0x41410000, 'Foo', 1)
+        results = [ (0x41410000, [ (VWE_ADDLOCATION, loc), (VWE_SETFUNCMETA, meta) ]),
+                    (0x41410010, [ (VWE_ADDLOCATION, loc), (VWE_SETFUNCMETA, meta) ]) ]
+
+        # Both workers made the location, but it is only added once
+        analyze = viv_parallel.analyzeFunctions
+        viv_parallel.analyzeFunctions = lambda vw, fvas, fmnames, workers: results
+        try:
+            vw._fmod_deferred = [ 0x41410000, 0x41410010 ]
+            vw._analyzeDeferredFunctions(2)
+        finally:
+            viv_parallel.analyzeFunctions = analyze
+            vw._fmod_deferred = None
+
+        self.assertEqual(vw.getLocations(), [ loc ])
+        self.assertEqual(len([ e for e, einfo in vw.exportWorkspace() if e == VWE_SETFUNCMETA ]), 1)
+
+    def test_vivisect_parallel_nofork(self):
+        import vivisect.parallel as viv_parallel
+
+        # Without fork() ( the spawn start method ) work is done serially
+        canfork = viv_parallel.canFork
+        viv_parallel.canFork = lambda: False
+        try:
+            serial = getSampleFuncsWorkspace(count=4)
+            serial.analyze()
+
+            vw = getSampleFuncsWorkspace(count=4)
+            vw.config.viv.analysis.parallel.workers = 2
+            vw.analyze()
+            self.assertEqual(len(vw.getFunctions()), 4)
+            for fva in serial.getFunctions():
+                self.assertEqual(vw.getFunctionMetaDict(fva), serial.getFunctionMetaDict(fva))
+
+            fvas = sorted(vw.getFunctions())
+            self.assertEqual(viv_parallel.analyzeFunctions(vw, fvas, [], 2), [ (fva, []) for fva in fvas ])
+
+            pid = os.getpid()
+            self.assertEqual(viv_parallel.mapWorkspace(vw, lambda va: (va, os.getpid()), fvas, 2),
+                             [ (fva, pid) for fva in fvas ])
+        finally:
+            viv_parallel.canFork = canfork
+
+    def test_vivisect_codeblock_graph_cache(self):
+        import vivisect.tools.graphutil as viv_graph
+
+        vw = getSampleFuncsWorkspace(count=2)
+        vw.analyze()
+        fva = 0x41410000
+
+        g = vw.getCodeBlockGraph(fva)
+        self.assertIs(vw.getCodeBlockGraph(fva), g)
+        self.assertIsNot(vw.getCodeBlockGraph(fva, revloop=True), g)
+
+        ref = viv_graph.buildFunctionGraph(vw, fva)
+        self.assertEqual(sorted(g.getNodes()), sorted(ref.getNodes()))
+        self.assertEqual(len(g.getEdges()), len(ref.getEdges()))
+
+        # Other functions keep their graphs...
+        g2 = vw.getCodeBlockGraph(fva + 32)
+
+        # Changing the function drops its graph
+        vw.setFunctionMeta(fva, 'BlockColors', {fva:'#f00'})
+        g1 = vw.getCodeBlockGraph(fva)
+        self.assertIsNot(g1, g)
+        self.assertEqual(g1.getNodeProps(fva).get('color'), '#f00')
+
+        cbva, cbsize, cbfva = vw.getFunctionBlocks(fva)[-1]
+        lva = vw.getLocation(cbva + cbsize - 1)[L_VA]
+        vw.addXref(lva, fva, REF_CODE)
+        self.assertIsNot(vw.getCodeBlockGraph(fva), g1)
+
+        self.assertIs(vw.getCodeBlockGraph(fva + 32), g2)
+
+    def test_vivisect_codeblock_graph_cache_shared(self):
+        vw = getSampleFuncsWorkspace(count=2)
+        vw.analyze()
+        fva1 = 0x41410000
+        fva2 = fva1 + 32
+
+        # A graph which reaches into the blocks of another function
+        cbva, cbsize, cbfva = vw.getFunctionBlocks(fva1)[-1]
+        lva = vw.getLocation(cbva + cbsize - 1)[L_VA]
+        vw.addXref(lva, fva2, REF_CODE)
+
+        g1 = vw.getCodeBlockGraph(fva1)
+        g2 = vw.getCodeBlockGraph(fva2)
+        self.assertTrue(g1.hasNode(fva2))
+
+        # Changing the other function drops both graphs
+        cbva, cbsize, cbfva = vw.getFunctionBlocks(fva2)[-1]
+        lva = vw.getLocation(cbva + cbsize - 1)[L_VA]
+        vw.addXref(lva, fva2, REF_CODE)
+        self.assertIsNot(vw.getCodeBlockGraph(fva2), g2)
+        g3 = vw.getCodeBlockGraph(fva1)
+        self.assertIsNot(g3, g1)
+        self.assertEqual(len(g3.getEdges()), len(g1.getEdges()) + 1)
+
+        # So does replacing one of its blocks
+        vw.delCodeBlock(cbva)
+        vw.addCodeBlock(cbva, cbsize, cbfva)
+        g4 = vw.getCodeBlockGraph(fva1)
+        self.assertIsNot(g4, g3)
+        self.assertEqual(sorted(g4.getNodes()), sorted(g3.getNodes()))
+
+    def test_vivisect_undefined_ranges(self):
+        vw = getSampleWorkspace()
+        vw.addMemoryMap(0x41420000, 7, 'none', '\x00' * 16)
+        mapsize = len(samplecode.func1) + 32
+
+        self.assertEqual(list(vw.iterUndefinedRanges()), [(0x41410000, mapsize), (0x41420000, 16)])
+
+        vw.makeNumber(0x41420004, 4)
+        vw.makeNumber(0x41420008, 4)
+        self.assertEqual(list(vw.iterUndefinedRanges(0x41420004)), [(0x41420000, 4), (0x4142000c, 4)])
+
+        vw.delLocation(0x41420004)
+        self.assertEqual(list(vw.iterUndefinedRanges(0x41420000)), [(0x41420000, 8), (0x4142000c, 4)])
+        self.assertRaises(envi.SegmentationViolation, list, vw.iterUndefinedRanges(0x10))
+
+        vw.makeFunction(0x41410000)
+        undef = sum([ size for va, size in vw.iterUndefinedRanges() ])
+        self.assertEqual(vw.getDiscoveredInfo(), (mapsize + 16 - undef, undef))
+        for va, size in vw.iterUndefinedRanges():
+            self.assertIsNone(vw.getLocation(va))
+            self.assertIsNone(vw.getLocation(va + size - 1))
+
+    def test_vivisect_findpointers(self):
+        vw = getPointersWorkspace()
+        ptrs = vw.findPointers(cache=False)
+        self.assertTrue(len(ptrs) > 400)
+        self.assertEqual(ptrs, slowFindPointers(vw))
+
+        vw = getPointersWorkspace(arch='amd64', count=1000)
+        self.assertEqual(vw.findPointers(cache=False), slowFindPointers(vw))
+
+        # Cached results drop newly defined locations
+        va, x = vw.findPointers()[0]
+        vw.makePointer(va, follow=False)
+        self.assertFalse(va in [ pva for pva, px in vw.findPointers() ])
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_vivisect_findpointers_bench(self):
+        vw = getPointersWorkspace(count=12000)
+
+        start = time.time()
+        slow = slowFindPointers(vw)
+        slowtime = time.time() - start
+
+        start = time.time()
+        ptrs = vw.findPointers(cache=False)
+        bulktime = time.time() - start
+
+        self.assertEqual(ptrs, slow)
+        print('findPointers: per byte %.3fs bulk %.3fs' % (slowtime, bulktime))
+
+    def test_vivisect_emulator_reset(self):
+        vw = getSampleWorkspace()
+        emu = vw.getEmulator()
+        fresh = vw.getEmulator()
+
+        sp = emu.getStackCounter()
+        emu.runFunction(0x41410000, maxhit=1)
+        emu.writeMemory(0x41410000, '\x90\x90')
+        emu.setVivTaint('apicall', None)
+
+        emu.resetEmulator()
+        self.assertEqual(emu.getRegisterSnap(), fresh.getRegisterSnap())
+        self.assertEqual(emu.readMemory(sp, 64), fresh.readMemory(sp, 64))
+        self.assertEqual(emu.readMemory(0x41410000, 2), samplecode.func1[:2])
+        self.assertEqual(emu.parseOpcode(0x41410000).mnem, 'push')
+        self.assertEqual(sorted(emu.taints.keys()), sorted(fresh.taints.keys()))
+        self.assertEqual(emu.setVivTaint('apicall', None), fresh.setVivTaint('apicall', None))
+        self.assertIsNone(emu.funcva)
+
+    def test_vivisect_emucode(self):
+        import vivisect.analysis.generic.emucode as v_emucode
+
+        serial = getEmuCodeWorkspace()
+        v_emucode.analyze(serial)
+        funcs = sorted(serial.getFunctions())
+        self.assertEqual(funcs, [ 0x41410000 + (i * 32) for i in xrange(48) ])
+        self.assertEqual(serial.getLocation(0x41410000 + (48 * 32))[L_LTYPE], LOC_STRING)
+
+        vw = getEmuCodeWorkspace()
+        vw.config.viv.analysis.parallel.workers = 2
+        v_emucode.analyze(vw)
+        self.assertEqual(sorted(vw.getFunctions()), funcs)
+        self.assertEqual(vw.getLocations(), serial.getLocations())
+
+        # Only new events are examined for new candidates
+        queue = v_emucode.EmuCodeQueue(vw)
+        self.assertEqual(queue.getCandidates(), [])
+        vw.makeName(0x41410000 + (48 * 32) + 0x11 + 4, 'newname')
+        self.assertEqual(queue.getCandidates(), [ 0x41410000 + (48 * 32) + 0x11 + 4 ])
+        self.assertEqual(queue.getCandidates(), [])
+
+        vw.addXref(0x41420000, 0x41410000 + (48 * 32) + 0x11 + 8, REF_PTR)
+        vw.makeName(0x41410000 + (48 * 32) + 0x11 + 4, 'newername')
+        self.assertEqual(queue.getCandidates(), [ 0x41410000 + (48 * 32) + 0x11 + 8 ])
+
+        chanid = queue.chanid
+        self.assertTrue(chanid in vw.chan_lookup)
+        queue.close()
+        self.assertFalse(chanid in vw.chan_lookup)
+        self.assertEqual(vw.chan_lookup, {})
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_vivisect_emucode_bench(self):
+        import vivisect.analysis.generic.emucode as v_emucode
+
+        vw = getEmuCodeWorkspace(count=200)
+        vas = v_emucode.EmuCodeQueue(vw).getCandidates()
+
+        start = time.time()
+        for va in vas:
+            emu = vw.getEmulator()
+            emu.setEmulationMonitor(v_emucode.watcher(vw, va))
+            emu.runFunction(va, maxhit=1)
+        newtime = time.time() - start
+
+        start = time.time()
+        trials = v_emucode.EmuCodeTrials(vw)
+        verdicts = [ trials.getVerdict(va) for va in vas ]
+        resettime = time.time() - start
+
+        self.assertEqual(verdicts.count(v_emucode.EMU_FUNC), 200)
+        print('emucode trials: new emulators %.3fs reset %.3fs' % (newtime, resettime))
+
+    def test_vivisect_emulator_pool(self):
+        import vivisect.impemu.emulator as v_i_emulator
+
+        vw = getSampleWorkspace()
+        emu = vw.getPooledEmulator()
+        emu.setEmuOpt('i386:reponce', False)
+        emu._safe_mem = False
+        emu.hooks['kernel32.nope'] = None
+        emu.runFunction(0x41410000, maxhit=1)
+        vw.releaseEmulator(emu)
+
+        emu2 = vw.getPooledEmulator()
+        self.assertIs(emu, emu2)
+        self.assertTrue(emu2.getEmuOpt('i386:reponce'))
+        self.assertTrue(emu2._safe_mem)
+        self.assertFalse('kernel32.nope' in emu2.hooks)
+        self.assertEqual(emu2.getRegisterSnap(), vw.getEmulator().getRegisterSnap())
+
+        # A second emulator while the first is in use
+        emu3 = vw.getPooledEmulator()
+        self.assertIsNot(emu2, emu3)
+        self.assertIsNot(emu2, vw.getPooledEmulator(logwrite=True))
+
+        # Changing workspace memory drops the pooled emulators
+        vw.releaseEmulator(emu2)
+        vw.releaseEmulator(emu3)
+        vw.writeMemory(0x41410000, '\x90')
+        self.assertIsNot(vw.getPooledEmulator(), emu2)
+
+        # Import hooks are found once per class
+        vw.setMeta('Platform', 'windows')
+        emu = vw.getPooledEmulator()
+        names = v_i_emulator.getImpHookNames(emu.__class__)
+        self.assertIs(v_i_emulator.getImpHookNames(emu.__class__), names)
+        self.assertTrue('ntdll.seh3_prolog' in emu.hooks)
+        self.assertEqual(sorted(emu.hooks.keys()), sorted(set([ impname for impname, name in names ])))
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_vivisect_emulator_pool_bench(self):
+        vw = getSampleWorkspace()
+        vw.makeFunction(0x41410000)
+        count = 200
+
+        start = time.time()
+        for i in xrange(count):
+            emu = vw.getEmulator()
+            emu.runFunction(0x41410000, maxhit=1)
+        newtime = time.time() - start
+
+        start = time.time()
+        for i in xrange(count):
+            emu = vw.getPooledEmulator()
+            emu.runFunction(0x41410000, maxhit=1)
+            vw.releaseEmulator(emu)
+        pooltime = time.time() - start
+
+        print('emulators: new %.3fs pooled %.3fs' % (newtime, pooltime))
@@ -507,7 +507,10 @@ def buildFunctionGraph(vw, fva, revloop=False, g=None):
         t = (fva, vw.isFunction(fva))
         raise Exception('Invalid initial code block for 0x%.8x isfunc: %s' % t)
 
-    todo = [ (fcb, []), ]
+    todo = [ fcb, ]
+
+    # The block each block was found from ( for loop detection )
+    parents = { fva: None, }
 
     fcbva, fcbsize, fcbfunc = fcb
 
@@ -517,9 +520,16 @@ def buildFunctionGraph(vw, fva, revloop=False, g=None):
 
     while todo:
 
-        (cbva,cbsize,cbfunc),path = todo.pop()
+        cbva,cbsize,cbfunc = todo.pop()
 
-        path.append(cbva)
+        # The set of blocks on the path which found this one
+        path = ()
+        if revloop:
+            path = set()
+            pva = cbva
+            while pva != None:
+                path.add(pva)
+                pva = parents.get(pva)
 
         # If the code block va doesn't have a node yet, make one
         if not g.hasNode(cbva):
@@ -551,7 +561,8 @@ def buildFunctionGraph(vw, fva, revloop=False, g=None):
 
                 # Since we haven't seen this node, lets add it to todo
                 # and build a new node for it.
-                todo.append( ((tova,tosize,tofunc), list(path)) )
+                todo.append( (tova,tosize,tofunc) )
+                parents[tova] = cbva
                 bcolor = colors.get(tova, '#0f0')
                 g.addNode(nid=tova, cbva=tova, cbsize=tosize, color=bcolor)
 
@@ -580,7 +591,8 @@ def buildFunctionGraph(vw, fva, revloop=False, g=None):
                 #if fbfunc != fva and fbva not in blocks:
                 #    continue
 
-                todo.append( ((fbva,fbsize,fbfunc), list(path)) )
+                todo.append( (fbva,fbsize,fbfunc) )
+                parents[fbva] = cbva
                 bcolor = colors.get(fallva, '#0f0')
                 g.addNode(nid=fallva, cbva=fallva, cbsize=fbsize, color=bcolor)
 
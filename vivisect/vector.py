@@ -36,7 +36,7 @@ def getEmuAtVa(vw, va, maxhit=None):
         return None
 
     cbva,cbsize,cbfva = vw.getCodeBlock(va)
-    fgraph = v_graphutil.buildFunctionGraph(vw, fva)
+    fgraph = vw.getCodeBlockGraph(fva)
 
     # Just take the first one off the iterator...
     for path in v_graphutil.getCodePathsTo(fgraph, cbva):
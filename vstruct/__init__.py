@@ -8,6 +8,70 @@ import vstruct.primitives as vs_prims
 def isVstructType(x):
     return isinstance(x, vs_prims.v_base)
 
+# Compiled codec layouts ( by field formats ) and classes with pcb_ callbacks
+_vs_layouts = {}
+_vs_pcbclasses = {}
+
+def _hasPcbMethods(cls):
+    ret = _vs_pcbclasses.get(cls)
+    if ret == None:
+        ret = len([ n for n in dir(cls) if n.startswith('pcb_') ]) != 0
+        _vs_pcbclasses[cls] = ret
+    return ret
+
+def _primCodecFmt(prim, fast):
+    # Fast parsing sets values with vsSetValue() ( which v_wstr can't take raw )
+    if fast and isinstance(prim, vs_prims.v_wstr):
+        return None
+    return prim.vsGetCodecFmt()
+
+def _fmtEndian(fmt):
+    # Single byte fields parse the same in either byte order
+    if fmt[0] in '<>' and fmt[1:] not in ('B','b'):
+        return fmt[0]
+    return None
+
+def _getCodecLayout(fmts):
+    '''
+    Return a list of (struct, fieldcount) tuples which parse the given
+    list of field formats ( one struct per run of the same byte order ).
+    '''
+    key = tuple(fmts)
+    layout = _vs_layouts.get(key)
+    if layout != None:
+        return layout
+
+    layout = []
+    endian = None
+    body = []
+    for fmt in fmts:
+        fend = _fmtEndian(fmt)
+        if fend != None and endian != None and fend != endian:
+            layout.append( (struct.Struct(endian + ''.join(body)), len(body)) )
+            body = []
+            endian = None
+
+        if fend != None:
+            endian = fend
+
+        body.append( fmt.lstrip('<>') )
+
+    if body:
+        layout.append( (struct.Struct((endian or '<') + ''.join(body)), len(body)) )
+
+    if len(_vs_layouts) > 4096:
+        _vs_layouts.clear()
+
+    _vs_layouts[key] = layout
+    return layout
+
+def _buildCodecOps(ops, prims, fmts):
+    # Append (struct, prims) ops for the given run of fixed size fields
+    off = 0
+    for s, count in _getCodecLayout(fmts):
+        ops.append( (s, prims[off:off+count]) )
+        off += count
+
 class VStruct(vs_prims.v_base):
     '''
     The VStruct class is the bases for all groups of primitive fields which
@@ -28,15 +92,19 @@ class VStruct(vs_prims.v_base):
 
     '''
     def __init__(self):
-        # A tiny bit of evil...
-        object.__setattr__(self, '_vs_values', {})
-        vs_prims.v_base.__init__(self)
-        self._vs_name = self.__class__.__name__
-        self._vs_fields = []
-        self._vs_field_align = False # To toggle visual studio style packing
-        self._vs_padnum = 0
-        self._vs_pcallbacks = {}
-        self._vs_fastfields = None
+        # A tiny bit of evil... ( and skip __setattr__ for speed )
+        self.__dict__.update({
+            '_vs_values':{},
+            '_vs_meta':{},
+            '_vs_name':self.__class__.__name__,
+            '_vs_fields':[],
+            '_vs_field_align':False, # To toggle visual studio style packing
+            '_vs_padnum':0,
+            '_vs_pcallbacks':{},
+            '_vs_codec':None,
+            '_vs_fastcodec':None,
+            '_vs_owners':None,
+        })
 
     def __mul__(self, x):
         # build a list of instances of this vstruct
@@ -67,6 +135,7 @@ class VStruct(vs_prims.v_base):
             self._vs_pcallbacks[fieldname] = cblist
 
         cblist.append(callback)
+        self._vsLayoutChanged()
 
     def vsGetClassPath(self):
         '''
@@ -92,19 +161,143 @@ class VStruct(vs_prims.v_base):
             fobj.vsParseFd(fd)
             self._vsFireCallbacks(fname)
 
-    def _vsInitFastFields(self):
-        fields = self.vsGetFastParseFields()
-        self._vs_fastfields = fields
-        fmt = ''.join([ f._vs_fmt for f in fields ])
-        endian = '<'
-        if fmt.find('>') != -1:
-            endian = '>'
-        # Strip all in-band endian specifiers
-        fmt = fmt.replace('<','')
-        fmt = fmt.replace('>','')
+    def _vsDropCodec(self):
+        # Skip __setattr__ ( these are not fields )
+        self.__dict__['_vs_codec'] = None
+        self.__dict__['_vs_fastcodec'] = None
+
+    def _vsLayoutChanged(self):
+        self._vsDropCodec()
+        vs_prims.v_base._vsLayoutChanged(self)
+
+    def _vsHasCallbacks(self):
+        return len(self._vs_pcallbacks) != 0 or _hasPcbMethods(self.__class__)
+
+    def _vsGetCodecFields(self, prims, fmts, fast=False, owner=None):
+        '''
+        Append each primitive in this structure (recursively) and its
+        struct format to the given lists.  Returns False if the structure
+        can not be parsed as one fixed layout (callbacks, dynamic size
+        fields or a custom vsParse).
+
+        If owner is specified, the fields are told the owner's codec
+        includes them ( see _vsAddCodecOwner() ).
+        '''
+        if self.__class__.vsParse.im_func is not VStruct.vsParse.im_func:
+            return False
+
+        if not fast and self._vsHasCallbacks():
+            return False
+
+        if owner != None:
+            self._vsAddCodecOwner(owner)
+
+        values = self._vs_values
+        for fname in self._vs_fields:
+            fobj = values[fname]
+            if isinstance(fobj, VStruct):
+                if not fobj._vsGetCodecFields(prims, fmts, fast=fast, owner=owner):
+                    return False
+                continue
 
-        self._vs_fastfmt = endian + fmt
-        self._vs_fastlen = struct.calcsize( self._vs_fastfmt )
+            fmt = _primCodecFmt(fobj, fast)
+            if fmt == None:
+                return False
+
+            if owner != None:
+                fobj._vsAddCodecOwner(owner)
+
+            prims.append(fobj)
+            fmts.append(fmt)
+
+        return True
+
+    def _vsCompileCodec(self, fast=False):
+        '''
+        Build the list of parse ops for this structure.  Each op is either
+        a (struct, prims) tuple which unpacks a run of (possibly nested)
+        fixed size fields in one go, or (None, field) for fields which
+        must parse themselves.
+        '''
+        ops = []
+        prims = []
+        fmts = []
+        for fname in self._vs_fields:
+            fobj = self._vs_values.get(fname)
+            if isinstance(fobj, VStruct):
+                kprims = []
+                kfmts = []
+                if fobj._vsGetCodecFields(kprims, kfmts, fast=fast, owner=self):
+                    prims.extend(kprims)
+                    fmts.extend(kfmts)
+                    continue
+
+            else:
+                fmt = _primCodecFmt(fobj, fast)
+                if fmt != None:
+                    fobj._vsAddCodecOwner(self)
+                    prims.append(fobj)
+                    fmts.append(fmt)
+                    continue
+
+            _buildCodecOps(ops, prims, fmts)
+            ops.append( (None, fobj) )
+            prims = []
+            fmts = []
+
+        _buildCodecOps(ops, prims, fmts)
+        return ops
+
+    def _vsGetCodec(self, fast=False):
+        '''
+        Return the (cached) parse ops for this structure ( or None if
+        the structure has callbacks which must fire during parsing ).
+        '''
+        if fast:
+            codec = self._vs_fastcodec
+        else:
+            codec = self._vs_codec
+
+        if codec != None:
+            return codec[0]
+
+        ops = None
+        if fast or not self._vsHasCallbacks():
+            ops = self._vsCompileCodec(fast=fast)
+
+        # Dropped by _vsDropCodec() when the layout of a field changes
+        codec = (ops,)
+        if fast:
+            self.__dict__['_vs_fastcodec'] = codec
+        else:
+            self.__dict__['_vs_codec'] = codec
+        return ops
+
+    def _vsParseCodec(self, ops, sbytes, offset, fast=False):
+        for s, prims in ops:
+            if s == None:
+                offset = prims.vsParse(sbytes, offset=offset)
+                continue
+
+            try:
+                values = s.unpack_from(sbytes, offset)
+            except struct.error:
+                if fast:
+                    raise
+                # Short input, let the fields parse what they can
+                for prim in prims:
+                    offset = prim.vsParse(sbytes, offset=offset)
+                continue
+
+            if fast:
+                for i in xrange(len(prims)):
+                    prims[i].vsSetValue(values[i])
+            else:
+                for i in xrange(len(prims)):
+                    prims[i]._vs_value = values[i]
+
+            offset += s.size
+        return offset
 
     def vsParse(self, sbytes, offset=0, fast=False):
         """
@@ -115,16 +308,16 @@ class VStruct(vs_prims.v_base):
         Any method named pcb_<FieldName> will be called back when the specified
         field is set by the parser.
 
+        Structures without callbacks are parsed using a compiled codec which
+        unpacks runs of fixed size fields (including nested structures)
+        with one struct call each.
+
         the "fast" option enables fastparse which will *not* call any callbacks
-        can may not be compatible with some structure defs.  ( eg mixed endian )
+        can may not be compatible with some structure defs.
         """
-        if fast:
-            if self._vs_fastfields == None:
-                self._vsInitFastFields()
-            values = struct.unpack_from( self._vs_fastfmt, sbytes, offset )
-            # Ephemeral list comprehension for speed
-            [ self._vs_fastfields[i].vsSetValue( values[i] ) for i in xrange(len(values)) ]
-            return offset + self._vs_fastlen
+        ops = self._vsGetCodec(fast=fast)
+        if ops != None:
+            return self._vsParseCodec(ops, sbytes, offset, fast=fast)
 
         # In order for callbacks to change fields, we can't use vsGetFields()
         for fname in self._vs_fields:
@@ -148,10 +341,13 @@ class VStruct(vs_prims.v_base):
         Get back the byte sequence associated with this structure.
         """
         if fast:
-            if self._vs_fastfields == None:
-                self._vsInitFastFields()
-            ffvals = [ ff.vsGetValue() for ff in self._vs_fastfields ]
-            return struct.pack(self._vs_fastfmt, *ffvals)
+            ret = []
+            for s, prims in self._vsGetCodec(fast=True):
+                if s == None:
+                    ret.append( prims.vsEmit() )
+                    continue
+                ret.append( s.pack( *[ p._vs_value for p in prims ] ) )
+            return ''.join(ret)
 
         ret = ''
         for fname, fobj in self.vsGetFields():
@@ -211,6 +407,7 @@ class VStruct(vs_prims.v_base):
         '''
         if isVstructType(value):
             self._vs_values[name] = value
+            self._vsLayoutChanged()
             return
         x = self._vs_values.get(name)
         return x.vsSetValue(value)
@@ -263,6 +460,7 @@ class VStruct(vs_prims.v_base):
 
         self._vs_fields.append(name)
         self._vs_values[name] = value
+        self._vsLayoutChanged()
 
     def vsDelField(self, name):
         '''
@@ -272,6 +470,7 @@ class VStruct(vs_prims.v_base):
         if field == None:
             raise Exception('Invalid Field Name: %s' % name)
         self._vs_fields.remove(name)
+        self._vsLayoutChanged()
 
     def vsInsertField(self, name, value, befname):
         '''
@@ -284,6 +483,7 @@ class VStruct(vs_prims.v_base):
         idx = self._vs_fields.index(befname)
         self._vs_fields.insert(idx, name)
         self._vs_values[name] = value
+        self._vsLayoutChanged()
 
     def vsGetPrims(self):
         """
@@ -425,8 +625,13 @@ class VStruct(vs_prims.v_base):
 
 class VArray(VStruct):
 
+    # ( eclass, struct, values, built ) for elements which are only
+    # held as unpacked values ( see vsParseElements() )
+    _vs_dense = None
+
     def __init__(self, elems=()):
         VStruct.__init__(self)
+        self.__dict__['_vs_dense'] = None
         for e in elems:
             self.vsAddElement(e)
 
@@ -441,8 +646,135 @@ class VArray(VStruct):
         for i in xrange( count ):
             self.vsAddElement( eclass() )
 
+    def vsParseElements(self, eclass, count, sbytes, offset=0):
+        '''
+        Add count new elements of the given class, parsed from the given
+        bytes (a str, buffer or memoryview).  Returns the offset after the
+        last element.
+
+        If the elements have a fixed layout (in one byte order) they are
+        unpacked with one (cached) struct, and an empty array only keeps
+        the values: each element object is built when it is first used
+        ( and all of them are if the array is used as a structure ).
+
+        Example:
+            syms = vstruct.VArray()
+            syms.vsParseElements(Elf32Symbol, symcount, symtab)
+        '''
+        if count <= 0:
+            return offset
+
+        # Check the element layout once...
+        proto = eclass()
+        layout = ()
+        if isinstance(proto, VStruct):
+            fmts = []
+            if proto._vsGetCodecFields([], fmts):
+                layout = _getCodecLayout(fmts)
+        else:
+            fmt = _primCodecFmt(proto, False)
+            if fmt != None:
+                layout = _getCodecLayout([fmt])
+
+        if len(layout) != 1:
+            # Not one fixed layout, so parse them one at a time...
+            elems = [ proto ] + [ eclass() for i in xrange(count - 1) ]
+            for elem in elems:
+                self.vsAddElement(elem)
+            for elem in elems:
+                offset = elem.vsParse(sbytes, offset=offset)
+            return offset
+
+        s = layout[0][0]
+        endoff = offset + (s.size * count)
+        values = [ s.unpack_from(sbytes, off) for off in xrange(offset, endoff, s.size) ]
+
+        if len(self._vs_fields):
+            for vals in values:
+                self.vsAddElement(self._vsDenseElement(eclass, vals))
+            return endoff
+
+        self.__dict__['_vs_dense'] = (eclass, s, values, {})
+        del self.__dict__['_vs_fields']
+        del self.__dict__['_vs_values']
+        return endoff
+
+    def _vsDenseElement(self, eclass, vals):
+        # Build an element from its unpacked values
+        elem = eclass()
+        prims = [ elem ]
+        if isinstance(elem, VStruct):
+            prims = []
+            elem._vsGetCodecFields(prims, [])
+
+        for i in xrange(len(prims)):
+            prims[i]._vs_value = vals[i]
+        return elem
+
+    def _vsInflate(self):
+        '''
+        Build the elements of a dense array as (normal) fields.
+        '''
+        eclass, s, values, built = self._vs_dense
+        self.__dict__['_vs_dense'] = None
+
+        fields = []
+        fvalues = {}
+        for i in xrange(len(values)):
+            elem = built.get(i)
+            if elem == None:
+                elem = self._vsDenseElement(eclass, values[i])
+            fname = "%d" % i
+            fields.append(fname)
+            fvalues[fname] = elem
+
+        self.__dict__['_vs_fields'] = fields
+        self.__dict__['_vs_values'] = fvalues
+        self._vsLayoutChanged()
+
+    def __getattr__(self, name):
+        # Any use of the fields of a dense array builds them
+        if self.__dict__.get('_vs_dense') != None and name in ('_vs_fields', '_vs_values'):
+            self._vsInflate()
+            return self.__dict__[name]
+        return VStruct.__getattr__(self, name)
+
+    def __len__(self):
+        dense = self._vs_dense
+        if dense == None:
+            return VStruct.__len__(self)
+
+        eclass, s, values, built = dense
+        return (s.size * (len(values) - len(built))) + sum([ len(elem) for elem in built.values() ])
+
+    def vsEmit(self, fast=False):
+        dense = self._vs_dense
+        if dense == None:
+            return VStruct.vsEmit(self, fast=fast)
+
+        eclass, s, values, built = dense
+        ret = []
+        for i in xrange(len(values)):
+            elem = built.get(i)
+            if elem != None:
+                ret.append( elem.vsEmit() )
+                continue
+            ret.append( s.pack(*values[i]) )
+        return ''.join(ret)
+
     def __getitem__(self, index):
-        return self.vsGetField("%d" % index)
+        dense = self._vs_dense
+        if dense == None:
+            return self.vsGetField("%d" % index)
+
+        eclass, s, values, built = dense
+        elem = built.get(index)
+        if elem == None:
+            if index < 0 or index >= len(values):
+                raise Exception("Invalid field: %d" % index)
+            elem = self._vsDenseElement(eclass, values[index])
+            built[index] = elem
+        return elem
 
     #FIXME slice asignment
 
@@ -521,6 +853,13 @@ def resolvepath(impmod, pathstr):
 
 # NOTE: Gotta import this *after* VStruct/VSArray defined
 import vstruct.defs as vs_defs
+import vstruct.view as vs_view
+
+def getStructureClass(sname):
+    """
+    Return the class for the specified structure (see getStructure).
+    """
+    return resolve(vs_defs, sname.split("."))
 
 def getStructure(sname):
     """
@@ -529,12 +868,28 @@ def getStructure(sname):
     addStructure() or a python path (ie. win32.TEB) of a
     definition from within vstruct.defs.
     """
-    x = resolve(vs_defs, sname.split("."))
+    x = getStructureClass(sname)
     if x != None:
         return x()
 
     return None
 
+def getStructureView(sname, sbytes, offset=0):
+    """
+    Return a lazy view (see vstruct.view) of the specified structure at
+    the given offset in the bytes.  Fields are only decoded when they
+    are accessed.
+
+    Example:
+        ep = vstruct.getStructureView('windows.win_6_1_amd64.ntoskrnl.EPROCESS', bytez)
+        pid = ep.UniqueProcessId
+    """
+    x = getStructureClass(sname)
+    if x == None:
+        return None
+
+    return vs_view.getStructView(x, sbytes, offset=offset)
+
 def getModuleNames():
     return [x for x in dir(vs_defs) if not x.startswith("__")]
 
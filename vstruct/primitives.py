@@ -1,4 +1,9 @@
 import struct
+import weakref
+
+def _isParser(obj, cls):
+    # Is obj still using the vsParse() implementation from cls?
+    return obj.__class__.vsParse.im_func is cls.vsParse.im_func
 
 class v_enum(object):
     def __init__(self):
@@ -26,9 +31,37 @@ class v_bitmask(object):
         return [ v for k,v in self._vs_reverseMap.items() if (val&k) != 0 ]
 
 class v_base(object):
+
+    # A WeakSet of the structures whose compiled codecs include us
+    _vs_owners = None
+
     def __init__(self):
         self._vs_meta = {}
 
+    def _vsAddCodecOwner(self, owner):
+        '''
+        Note that the compiled codec of the given structure includes this
+        field ( it is dropped by _vsLayoutChanged() ).
+        '''
+        owners = self._vs_owners
+        if owners == None:
+            # Weak, so fields do not keep their parents alive
+            owners = weakref.WeakSet()
+            self.__dict__['_vs_owners'] = owners
+        owners.add(owner)
+
+    def _vsLayoutChanged(self):
+        '''
+        Note that this field was resized ( or fields were added / removed )
+        so the compiled codecs of the structures which include it must be
+        rebuilt.
+        '''
+        owners = self._vs_owners
+        if owners:
+            self.__dict__['_vs_owners'] = None
+            for owner in list(owners):
+                owner._vsDropCodec()
+
     def vsGetMeta(self, name, defval=None):
         return self._vs_meta.get(name, defval)
 
@@ -62,6 +95,14 @@ class v_prim(v_base):
         '''
         return NotImplemented
 
+    def vsGetCodecFmt(self):
+        '''
+        Return the struct format which parses this primitive with the
+        same results as vsParse() (or None if it can't be).  Used by
+        the compiled structure codecs.
+        '''
+        return None
+
     def vsParseFd(self, fd):
         # Most primitives should be able to simply use this...
         fbytes = fd.read(self._vs_length)
@@ -133,6 +174,11 @@ class v_number(v_prim):
     def vsGetValue(self):
         return self._vs_value
 
+    def vsGetCodecFmt(self):
+        if not _isParser(self, v_number):
+            return None
+        return self._vs_fmt
+
     def vsParse(self, fbytes, offset=0):
         '''
         Parse the given numeric type from the given bytes
@@ -350,6 +396,11 @@ class v_float(v_prim):
     def vsGetValue(self):
         return self._vs_value
 
+    def vsGetCodecFmt(self):
+        if not _isParser(self, v_float):
+            return None
+        return self._vs_fmt
+
     def vsParse(self, fbytes, offset=0):
         '''
         Parse the given numeric type from the given bytes
@@ -483,6 +534,11 @@ class v_bytes(v_prim):
             raise Exception('v_bytes field set to wrong length!')
         self._vs_value = val
 
+    def vsGetCodecFmt(self):
+        if not _isParser(self, v_bytes):
+            return None
+        return '%ds' % self._vs_length
+
     def vsParse(self, fbytes, offset=0):
         offend = offset + self._vs_length
         self._vs_value = fbytes[offset : offend]
@@ -495,6 +551,7 @@ class v_bytes(v_prim):
         size = int(size)
         self._vs_length = size
         self._vs_fmt = '%ds' % size
+        self._vsLayoutChanged()
         # Either chop or expand my string...
         b = self._vs_value[:size]
         self._vs_value = b.ljust(size, '\x00')
@@ -518,6 +575,11 @@ class v_str(v_prim):
         self._vs_value = val.ljust(size, '\x00')
         self._vs_align = 1
 
+    def vsGetCodecFmt(self):
+        if not _isParser(self, v_str):
+            return None
+        return '%ds' % self._vs_length
+
     def vsParse(self, fbytes, offset=0):
         offend = offset + self._vs_length
         self._vs_value = fbytes[offset : offend]
@@ -537,6 +599,7 @@ class v_str(v_prim):
         size = int(size)
         self._vs_length = size
         self._vs_fmt = '%ds' % size
+        self._vsLayoutChanged()
         # Either chop or expand my string...
         b = self._vs_value[:size]
         self._vs_value = b.ljust(size, '\x00')
@@ -602,6 +665,11 @@ class v_wstr(v_str):
         self._vs_encode = encode
         self._vs_align = 2
 
+    def vsGetCodecFmt(self):
+        if not _isParser(self, v_wstr):
+            return None
+        return '%ds' % self._vs_length
+
     def vsParse(self, fbytes, offset=0):
         offend = offset + self._vs_length
         self._vs_value = fbytes[offset : offend]
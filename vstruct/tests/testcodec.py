@@ -0,0 +1,255 @@
+import os
+import time
+import struct
+import unittest
+
+import vstruct
+from vstruct.primitives import *
+
+class inner(vstruct.VStruct):
+    def __init__(self):
+        vstruct.VStruct.__init__(self)
+        self.a = v_uint16(bigend=True)
+        self.b = v_uint32(bigend=True)
+
+class outer(vstruct.VStruct):
+    def __init__(self):
+        vstruct.VStruct.__init__(self)
+        self.x = v_uint8()
+        self.y = v_uint32()
+        self.kid = inner()
+        self.z = v_uint16()
+        self.s = v_str(size=4)
+
+class callback(vstruct.VStruct):
+    def __init__(self):
+        vstruct.VStruct.__init__(self)
+        self.lenfield = v_uint8()
+        self.strfield = v_str(size=0x20)
+
+    def pcb_lenfield(self):
+        self.vsGetField('strfield').vsSetLength(self.lenfield)
+
+class pair(vstruct.VStruct):
+    def __init__(self):
+        vstruct.VStruct.__init__(self)
+        self.addr = v_uint32()
+        self.size = v_uint16()
+        self.flags = v_int16()
+
+def legacyParse(vs, bytez):
+    # Parse with the per-field loop (no codecs)
+    codec = vstruct.VStruct._vsGetCodec
+    vstruct.VStruct._vsGetCodec = lambda self, fast=False: None
+    try:
+        return vs.vsParse(bytez)
+    finally:
+        vstruct.VStruct._vsGetCodec = codec
+
+outbytes = '01020304050a0b0c0d0e0f111241424300'.decode('hex')
+
+class VStructCodecTest(unittest.TestCase):
+
+    def test_vstruct_codec_nested(self):
+        v = outer()
+        self.assertEqual( v.vsParse(outbytes), 17 )
+        self.assertEqual( v.x, 0x01 )
+        self.assertEqual( v.y, 0x05040302 )
+        self.assertEqual( v.kid.a, 0x0a0b )
+        self.assertEqual( v.kid.b, 0x0c0d0e0f )
+        self.assertEqual( v.z, 0x1211 )
+        self.assertEqual( v.s, 'ABC' )
+
+        # One op per byte order run
+        self.assertEqual( len(v._vsGetCodec()), 3 )
+
+        l = outer()
+        legacyParse(l, outbytes)
+        self.assertEqual( v.vsEmit(), l.vsEmit() )
+
+    def test_vstruct_codec_fast(self):
+        v = outer()
+        self.assertEqual( v.vsParse(outbytes, fast=True), 17 )
+        self.assertEqual( v.kid.b, 0x0c0d0e0f )
+        self.assertEqual( v.vsEmit(fast=True), outbytes )
+
+        p = pair()
+        p.vsParse('\x00' * 6 + '\xfe\xff', fast=True)
+        self.assertEqual( p.flags, -2 )
+
+    def test_vstruct_codec_offset(self):
+        v = outer()
+        self.assertEqual( v.vsParse('ZZZ' + outbytes, offset=3), 20 )
+        self.assertEqual( v.kid.a, 0x0a0b )
+
+        v = outer()
+        v.vsParse(buffer(outbytes))
+        self.assertEqual( v.y, 0x05040302 )
+        self.assertEqual( v.s, 'ABC' )
+
+    def test_vstruct_codec_relayout(self):
+        v = outer()
+        v.vsParse(outbytes)
+
+        # Resizing a nested field must recompile the codec
+        v.vsGetField('s').vsSetLength(2)
+        self.assertEqual( v.vsParse(outbytes), 15 )
+        self.assertEqual( v.s, 'AB' )
+
+        v.kid.vsAddField('c', v_uint8())
+        self.assertEqual( v.vsParse(outbytes), 16 )
+        self.assertEqual( v.kid.c, 0x11 )
+        self.assertEqual( v.z, 0x4112 )
+
+        # A parsed nested structure shares its fields with the outer codec
+        v.kid.vsParse(outbytes)
+        v.kid.vsDelField('c')
+        self.assertEqual( v.vsParse(outbytes), 15 )
+        self.assertEqual( v.z, 0x1211 )
+        self.assertEqual( v.kid.vsParse(outbytes), 6 )
+        self.assertEqual( v.kid.a, 0x0102 )
+
+    def test_vstruct_codec_relayout_owner(self):
+        v1 = outer()
+        v2 = outer()
+        v1.vsParse(outbytes)
+        v2.vsParse(outbytes)
+        codec1 = v1._vsGetCodec()
+        codec2 = v2._vsGetCodec()
+        self.assertIs( v1._vsGetCodec(), codec1 )
+
+        # Only the structure which includes the resized field recompiles
+        v2.vsGetField('s').vsSetLength(2)
+        v_bytes(size=4).vsSetLength(8)
+        self.assertIs( v1._vsGetCodec(), codec1 )
+        self.assertIsNot( v2._vsGetCodec(), codec2 )
+        self.assertEqual( v2.vsParse(outbytes), 15 )
+
+        # So do the owners of a nested structure
+        codec2 = v2._vsGetCodec()
+        v2.kid.a = v_uint8()
+        self.assertIs( v1._vsGetCodec(), codec1 )
+        self.assertIsNot( v2._vsGetCodec(), codec2 )
+        self.assertEqual( v2.vsParse(outbytes), 14 )
+        self.assertEqual( v2.kid.a, 0x0a )
+        self.assertEqual( v1.vsParse(outbytes), 17 )
+
+        # Fields do not keep the structures which include them alive
+        kid = v1.kid
+        self.assertEqual( len(kid._vs_owners), 1 )
+        del v1
+        self.assertEqual( len(kid._vs_owners), 0 )
+
+    def test_vstruct_codec_callbacks(self):
+        v = vstruct.VStruct()
+        v.hdr = v_uint32()
+        v.cb = callback()
+        v.tail = v_uint8()
+
+        self.assertEqual( v.vsParse('AAAA\x02BCD'), 8 )
+        self.assertEqual( v.cb.strfield, 'BC' )
+        self.assertEqual( v.tail, 0x44 )
+
+    def test_vstruct_codec_short(self):
+        v = vstruct.VStruct()
+        v.x = v_uint16()
+        v.y = v_bytes(size=8)
+        l = vstruct.VStruct()
+        l.x = v_uint16()
+        l.y = v_bytes(size=8)
+
+        self.assertEqual( v.vsParse('ABCD'), legacyParse(l, 'ABCD') )
+        self.assertEqual( v.y, 'CD' )
+
+        self.assertRaises( struct.error, outer().vsParse, outbytes[:8] )
+
+    def test_vstruct_varray_dense(self):
+        bytez = ''.join([ struct.pack('<IHh', i, i * 2, -i) for i in xrange(100) ])
+
+        v = vstruct.VArray()
+        self.assertEqual( v.vsParseElements(pair, 100, memoryview(bytez)), len(bytez) )
+        self.assertEqual( len(v), len(bytez) )
+        self.assertEqual( v[0].addr, 0 )
+        self.assertEqual( v[99].addr, 99 )
+        self.assertEqual( v[99].size, 198 )
+        self.assertEqual( v.vsEmit(), bytez )
+
+        v = vstruct.VArray()
+        self.assertEqual( v.vsParseElements(pair, 0, bytez), 0 )
+        self.assertEqual( len(v), 0 )
+
+        # Elements with callbacks are parsed one at a time
+        v = vstruct.VArray()
+        self.assertEqual( v.vsParseElements(callback, 2, '\x01A\x02BC'), 5 )
+        self.assertEqual( v[1].strfield, 'BC' )
+
+        # Primitive elements
+        v = vstruct.VArray()
+        self.assertEqual( v.vsParseElements(v_uint16, 3, '\x01\x00\x02\x00\x03\x00'), 6 )
+        self.assertEqual( [ v[i].vsGetValue() for i in xrange(3) ], [1, 2, 3] )
+
+    def test_vstruct_varray_dense_lazy(self):
+        bytez = ''.join([ struct.pack('<IHh', i, i * 2, -i) for i in xrange(100) ])
+        v = vstruct.VArray()
+        v.vsParseElements(pair, 100, bytez)
+
+        # Elements are only built when they are used
+        self.assertEqual( v[7].size, 14 )
+        self.assertIs( v[7], v[7] )
+        self.assertEqual( len(v._vs_dense[3]), 1 )
+        self.assertRaises( Exception, v.__getitem__, 100 )
+
+        # ( and changes to them are kept )
+        v[7].flags = 0x1234
+        expect = bytez[:7 * 8] + struct.pack('<IHh', 7, 14, 0x1234) + bytez[8 * 8:]
+        self.assertEqual( v.vsEmit(), expect )
+
+        # Using the array as a structure builds the rest
+        fields = list(v.vsGetFields())
+        self.assertIsNone( v._vs_dense )
+        self.assertEqual( len(fields), 100 )
+        self.assertIs( fields[7][1], v[7] )
+        self.assertEqual( v[99].addr, 99 )
+        self.assertEqual( v.vsEmit(), expect )
+        self.assertEqual( len(v), len(bytez) )
+
+        # Elements added later follow the parsed ones
+        v.vsAddElement(pair())
+        self.assertEqual( len(v), len(bytez) + 8 )
+        v.vsParseElements(pair, 2, bytez)
+        self.assertEqual( v[102].size, 2 )
+
+        v = vstruct.VArray()
+        v.vsParseElements(pair, 100, bytez)
+        self.assertEqual( v.vsParse(expect), len(expect) )
+        self.assertEqual( v[7].flags, 0x1234 )
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_vstruct_codec_bench(self):
+        count = 2000
+        bytez = ''.join([ struct.pack('<IHH', i, i, i) for i in xrange(count) ])
+
+        start = time.time()
+        l = vstruct.VArray()
+        l.vsAddElements(count, pair)
+        legacyParse(l, bytez)
+        legacytime = time.time() - start
+
+        start = time.time()
+        v = vstruct.VArray()
+        v.vsParseElements(pair, count, bytez)
+        densetime = time.time() - start
+
+        self.assertEqual( v.vsEmit(), l.vsEmit() )
+
+        # A reparse of the same structure only runs the codec
+        l.vsParse(bytez)
+        start = time.time()
+        l.vsParse(bytez)
+        codectime = time.time() - start
+
+        start = time.time()
+        legacyParse(l, bytez)
+        reparsetime = time.time() - start
+
+        print('varray: legacy %.3fs dense %.3fs reparse %.3fs codec %.3fs' % (legacytime, densetime, reparsetime, codectime))
@@ -0,0 +1,141 @@
+import gc
+import os
+import time
+import unittest
+
+import vstruct
+import vstruct.view as vs_view
+from vstruct.primitives import *
+
+class inner(vstruct.VStruct):
+    def __init__(self):
+        vstruct.VStruct.__init__(self)
+        self.a = v_uint16(bigend=True)
+        self.b = v_int32()
+
+class outer(vstruct.VStruct):
+    def __init__(self):
+        vstruct.VStruct.__init__(self)
+        self.x = v_uint8()
+        self.kid = inner()
+        self.arr = vstruct.VArray([ v_uint16() for i in xrange(3) ])
+        self.name = v_str(size=8)
+        self.wname = v_wstr(size=4)
+        self.odd = v_uint24()
+
+class dynamic(vstruct.VStruct):
+    def __init__(self):
+        vstruct.VStruct.__init__(self)
+        self.x = v_uint8()
+        self.s = v_zstr()
+
+obytes = '01' + '0a0b' + 'feffffff' + '010002000300' + '414243000000000' + '0' + '61006200000000' + '00' + '112233'
+obytes = obytes.decode('hex')
+
+class VStructViewTest(unittest.TestCase):
+
+    def test_vstruct_view_fields(self):
+        p = outer()
+        p.vsParse('ZZ' + obytes, offset=2)
+
+        v = vs_view.getStructView(outer, 'ZZ' + obytes, offset=2)
+        self.assertTrue( isinstance(v, vs_view.VStructView) )
+        self.assertEqual( len(v), len(p) )
+
+        self.assertEqual( v.x, 1 )
+        self.assertEqual( v.kid.a, 0x0a0b )
+        self.assertEqual( v.kid.b, p.kid.b )
+        self.assertEqual( v.arr[2], 3 )
+        self.assertEqual( v.name, 'ABC' )
+        self.assertEqual( v.wname, p.wname )
+        self.assertEqual( v.odd, p.odd )
+
+        self.assertRaises( AttributeError, getattr, v, 'nope' )
+
+    def test_vstruct_view_offsets(self):
+        v = vs_view.getStructView(outer, obytes)
+        p = outer()
+        self.assertEqual( v.vsGetOffset('kid.b'), p.vsGetOffset('kid.b') )
+        self.assertEqual( v.vsGetOffset('name'), p.vsGetOffset('name') )
+        self.assertEqual( v.vsGetFieldNames(), ['x', 'kid', 'arr', 'name', 'wname', 'odd'] )
+
+        self.assertEqual( v.vsEmit(), obytes )
+        self.assertEqual( v.vsGetStruct().vsEmit(), obytes )
+
+    def test_vstruct_view_memoryview(self):
+        v = vs_view.getStructView(outer, memoryview(obytes))
+        self.assertEqual( v.kid.a, 0x0a0b )
+        self.assertEqual( v.name, 'ABC' )
+        self.assertEqual( v.vsEmit(), obytes )
+
+    def test_vstruct_view_dynamic(self):
+        self.assertFalse( vs_view.getViewLayout(dynamic).fixed )
+
+        # Dynamic layouts are simply parsed
+        v = vs_view.getStructView(dynamic, '\x01abc\x00')
+        self.assertTrue( isinstance(v, dynamic) )
+        self.assertEqual( v.s, 'abc' )
+
+    def test_vstruct_view_short(self):
+        self.assertRaises( Exception, vs_view.getStructView, outer, obytes[:-1] )
+
+    def test_vstruct_view_getstructure(self):
+        import vstruct.defs.windows.win_6_1_amd64.ntoskrnl as nt
+
+        sname = 'windows.win_6_1_amd64.ntoskrnl.EPROCESS'
+        ep = nt.EPROCESS()
+        bytez = ''.join([ chr(i & 0xff) for i in xrange(len(ep)) ])
+        ep.vsParse(bytez)
+
+        v = vstruct.getStructureView(sname, bytez)
+        self.assertEqual( v.UniqueProcessId, ep.UniqueProcessId )
+        self.assertEqual( v.Pcb.Header.SignalState, ep.Pcb.Header.SignalState )
+        self.assertEqual( v.vsGetOffset('ActiveProcessLinks.Blink'), ep.vsGetOffset('ActiveProcessLinks.Blink') )
+
+        self.assertEqual( vstruct.getStructureView('nope.nope', bytez), None )
+
+    def test_vstruct_view_lazy(self):
+        import vstruct.defs.windows.win_6_1_amd64.ntoskrnl as nt
+
+        bytez = '\x41' * len(nt.EPROCESS())
+
+        # Warm up the layout ( computed once per class )
+        vs_view.getStructView(nt.EPROCESS, bytez)
+
+        # Reading one field should not build the structure
+        gc.collect()
+        gc.disable()
+        try:
+            before = len(gc.get_objects())
+            pid = vs_view.getStructView(nt.EPROCESS, bytez).Pcb.Header.Type
+            objcount = len(gc.get_objects()) - before
+        finally:
+            gc.enable()
+
+        self.assertEqual( pid, 0x41 )
+        self.assertTrue( objcount < 10 )
+
+    @unittest.skipUnless(os.getenv('VIVBENCH'), 'VIVBENCH env var not set')
+    def test_vstruct_view_bench(self):
+        import vstruct.defs.windows.win_6_1_amd64.ntoskrnl as nt
+
+        bytez = '\x41' * len(nt.EPROCESS())
+        count = 50
+
+        start = time.time()
+        for i in xrange(count):
+            ep = nt.EPROCESS()
+            ep.vsParse(bytez)
+            pid = ep.UniqueProcessId
+        parsetime = time.time() - start
+
+        # Warm up the layout ( computed once per class )
+        vs_view.getStructView(nt.EPROCESS, bytez)
+
+        start = time.time()
+        for i in xrange(count):
+            vpid = vs_view.getStructView(nt.EPROCESS, bytez).UniqueProcessId
+        viewtime = time.time() - start
+
+        self.assertEqual( vpid, pid )
+        print('EPROCESS: parse %.4fs view %.4fs' % (parsetime, viewtime))
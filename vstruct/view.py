@@ -0,0 +1,223 @@
+'''
+Lazy structure views.
+
+A view binds a structure definition to a buffer and an offset without
+parsing anything.  Fields are decoded only when they are accessed (using
+an offset table which is computed once per structure class), so reading
+one field of a large structure does not build the whole object tree.
+
+Example:
+    import vstruct.view as vs_view
+
+    ep = vs_view.getStructView(ntoskrnl.EPROCESS, bytez)
+    print ep.UniqueProcessId
+    print ep.Pcb.Header.Type
+'''
+import copy
+import struct
+
+import vstruct
+import vstruct.primitives as vs_prims
+
+# Primitives whose vsGetValue() is just the parsed value
+_raw_getters = (
+    vs_prims.v_prim.vsGetValue.im_func,
+    vs_prims.v_number.vsGetValue.im_func,
+    vs_prims.v_float.vsGetValue.im_func,
+)
+
+# Field kinds in a layout
+VFK_PRIM = 0    # unpacked with a struct
+VFK_STRUCT = 1  # a nested view
+VFK_OPAQUE = 2  # parsed from a copy of the template field
+
+def _isFixedOpaque(field):
+    # Fields which parse themselves but always have the same size
+    return isinstance(field, (vs_prims.v_number, vs_prims.GUID))
+
+class ViewLayout(object):
+    '''
+    The offset table for one structure definition (built from a template
+    instance).  If any field has a dynamic size ( or the structure uses
+    callbacks / a custom vsParse ) the layout is not "fixed" and can not
+    be used for views.
+    '''
+    def __init__(self, vs):
+        self.vs = vs
+        self.name = vs._vs_name
+        self.fixed = True
+        self.fields = {}
+        self.names = []
+
+        if vs.__class__.vsParse.im_func is not vstruct.VStruct.vsParse.im_func:
+            self.fixed = False
+
+        if vs._vsHasCallbacks():
+            self.fixed = False
+
+        offset = 0
+        for fname in vs._vs_fields:
+            field = vs._vs_values.get(fname)
+
+            if isinstance(field, vstruct.VStruct):
+                sub = ViewLayout(field)
+                if not sub.fixed:
+                    self.fixed = False
+                fdef = (VFK_STRUCT, offset, sub, field)
+
+            else:
+                fmt = field.vsGetCodecFmt()
+                if fmt != None:
+                    raw = field.__class__.vsGetValue.im_func in _raw_getters
+                    fdef = (VFK_PRIM, offset, struct.Struct(fmt), (field, raw))
+                else:
+                    if not _isFixedOpaque(field):
+                        self.fixed = False
+                    fdef = (VFK_OPAQUE, offset, None, field)
+
+            self.names.append(fname)
+            self.fields[fname] = fdef
+            offset += len(field)
+
+        self.size = offset
+
+    def getFieldValue(self, name, sbytes, offset):
+        '''
+        Decode the named field for a structure at the given offset (returns
+        the same thing as attribute access on a parsed structure, but
+        nested structures are returned as views).
+        '''
+        kind, foff, info, field = self.fields[name]
+        foff += offset
+
+        if kind == VFK_PRIM:
+            value = info.unpack_from(sbytes, foff)[0]
+            prim, raw = field
+            if raw:
+                return value
+
+            prim = copy.copy(prim)
+            prim._vs_value = value
+            return prim.vsGetValue()
+
+        if kind == VFK_STRUCT:
+            return VStructView(info, sbytes, foff)
+
+        field = copy.deepcopy(field)
+        field.vsParse(sbytes, offset=foff)
+        if isinstance(field, vs_prims.v_prim):
+            return field.vsGetValue()
+        return field
+
+# Layouts for structure classes ( built from their default instance )
+_vs_layouts = {}
+
+def getViewLayout(cls):
+    '''
+    Return the (cached) ViewLayout for the given structure class.
+    '''
+    layout = _vs_layouts.get(cls)
+    if layout == None:
+        layout = ViewLayout(cls())
+        _vs_layouts[cls] = layout
+    return layout
+
+class VStructView(object):
+    '''
+    A read only view of a structure at an offset in a buffer ( a str,
+    buffer, memoryview or anything else struct.unpack_from takes ).
+    '''
+    __slots__ = ('_vs_layout', '_vs_bytes', '_vs_offset')
+
+    def __init__(self, layout, sbytes, offset=0):
+        if not layout.fixed:
+            raise Exception('Structure %s has no fixed layout!' % layout.name)
+
+        self._vs_layout = layout
+        self._vs_bytes = sbytes
+        self._vs_offset = offset
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        layout = self._vs_layout
+        if not layout.fields.has_key(name):
+            raise AttributeError(name)
+
+        return layout.getFieldValue(name, self._vs_bytes, self._vs_offset)
+
+    def __getitem__(self, name):
+        # Allow array style access for VArray views
+        if isinstance(name, (int, long)):
+            name = '%d' % name
+
+        layout = self._vs_layout
+        if not layout.fields.has_key(name):
+            raise KeyError(name)
+
+        return layout.getFieldValue(name, self._vs_bytes, self._vs_offset)
+
+    def __len__(self):
+        return self._vs_layout.size
+
+    def __repr__(self):
+        return self._vs_layout.name
+
+    def vsGetTypeName(self):
+        return self._vs_layout.name
+
+    def vsGetFieldNames(self):
+        return list(self._vs_layout.names)
+
+    def vsGetOffset(self, name, offset=0):
+        '''
+        Return the offset of a member (by name, nested names like 'a.b'
+        are allowed) relative to the start of this structure.
+        '''
+        layout = self._vs_layout
+        for fname in name.split('.'):
+            fdef = layout.fields.get(fname)
+            if fdef == None:
+                raise Exception('Invalid Field Specified!')
+
+            offset += fdef[1]
+            if fdef[0] == VFK_STRUCT:
+                layout = fdef[2]
+
+        return offset
+
+    def vsEmit(self):
+        '''
+        Return the bytes covered by this structure.
+        '''
+        start = self._vs_offset
+        bytez = self._vs_bytes[start:start + self._vs_layout.size]
+        if isinstance(bytez, memoryview):
+            return bytez.tobytes()
+        return str(bytez)
+
+    def vsGetStruct(self):
+        '''
+        Return a fully parsed copy of the structure.
+        '''
+        vs = copy.deepcopy(self._vs_layout.vs)
+        vs.vsParse(self._vs_bytes, offset=self._vs_offset)
+        return vs
+
+def getStructView(cls, sbytes, offset=0):
+    '''
+    Return a lazy view of the given structure class at the offset in the
+    buffer.  Structures without a fixed layout are parsed instead ( and
+    returned as a normal structure instance ).
+    '''
+    layout = getViewLayout(cls)
+    if not layout.fixed:
+        vs = cls()
+        vs.vsParse(sbytes, offset=offset)
+        return vs
+
+    if len(sbytes) < offset + layout.size:
+        raise Exception('Not enough data for %s!' % layout.name)
+
+    return VStructView(layout, sbytes, offset)